@@ -0,0 +1,147 @@
+# Copyright (c) 2010, Mats Kindahl, Charles Bell, and Lars Thalmann
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials
+#       provided with the distribution.
+#
+#     * Neither the name of Sun Microsystems nor the names of its
+#       contributors may be used to endorse or promote products
+#       derived from this software without specific prior written
+#       permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL SUN
+# MICROSYSTEMS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+"""
+Benchmark of the binary log readers.
+
+Each reader is run in a separate process on a synthetic binary log
+and the number of events per second, the megabytes per second (of
+the input to the reader), and the peak resident set size of the
+process are reported. The events per second count all events in the
+binary log, also those skipped by the filtered reader, which reports
+the events it returned separately. The results are written as one
+JSON object per line so that they can be compared between releases::
+
+   python binlog_readers.py --events 1000000 --output results.json
+"""
+
+import sys, os.path
+_HERE = os.path.dirname(os.path.abspath(__file__))
+_ROOTPATH = os.path.split(_HERE)[0]
+sys.path.append(_ROOTPATH)
+
+import json
+import multiprocessing
+import optparse
+import resource
+import shutil
+import tempfile
+import time
+
+import replicant
+import synthetic
+
+def _read_text(path, lazy=False):
+    return replicant.read_events(open(path + '.txt'), lazy=lazy)
+
+def _read_binary(path, lazy=False):
+    return replicant.read_binary_events(open(path, 'rb'), lazy=lazy)
+
+def _read_mapped(path, lazy=False):
+    return replicant.read_mapped_events(path, lazy=lazy)
+
+def _read_filtered(path):
+    event_filter = replicant.EventFilter(event_types=["Xid"])
+    return replicant.read_mapped_events(path, event_filter=event_filter)
+
+READERS = {
+    'text': (_read_text, '.txt'),
+    'text-lazy': (lambda path: _read_text(path, lazy=True), '.txt'),
+    'binary': (_read_binary, ''),
+    'binary-lazy': (lambda path: _read_binary(path, lazy=True), ''),
+    'mapped': (_read_mapped, ''),
+    'mapped-lazy': (lambda path: _read_mapped(path, lazy=True), ''),
+    'mapped-filtered': (_read_filtered, ''),
+}
+
+def _run(name, path, events, queue):
+    "Run a reader in a child process and report the result."
+    reader, suffix = READERS[name]
+    returned = 0
+    start = time.time()
+    for event in reader(path):
+        event.end_pos
+        returned += 1
+    seconds = time.time() - start
+    size = os.path.getsize(path + suffix)
+    queue.put({
+        'reader': name,
+        'events': events,
+        'returned': returned,
+        'bytes': size,
+        'seconds': seconds,
+        'events_per_second': events / seconds,
+        'mb_per_second': size / seconds / (1 << 20),
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    })
+
+def benchmark(path, names, events):
+    """Run the named readers on a generated binary log holding the
+    given number of events and return results."""
+    results = []
+    for name in names:
+        queue = multiprocessing.Queue()
+        proc = multiprocessing.Process(target=_run,
+                                       args=(name, path, events, queue))
+        proc.start()
+        results.append(queue.get())
+        proc.join()
+    return results
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option("-n", "--events", type="int", default=100000,
+                      help="number of events to generate")
+    parser.add_option("-r", "--reader", action="append", dest="readers",
+                      choices=sorted(READERS),
+                      help="reader to benchmark (default all)")
+    parser.add_option("-o", "--output", help="file to append results to")
+    options, args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "synthetic-bin.000001")
+        synthetic.generate(path, options.events)
+        # The log starts with a format description event
+        results = benchmark(path, options.readers or sorted(READERS),
+                            options.events + 1)
+    finally:
+        shutil.rmtree(directory)
+
+    output = open(options.output, 'a') if options.output else sys.stdout
+    for result in results:
+        result['timestamp'] = int(time.time())
+        output.write(json.dumps(result, sort_keys=True) + "\n")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+# Copyright (c) 2010, Mats Kindahl, Charles Bell, and Lars Thalmann
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials
+#       provided with the distribution.
+#
+#     * Neither the name of Sun Microsystems nor the names of its
+#       contributors may be used to endorse or promote products
+#       derived from this software without specific prior written
+#       permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL SUN
+# MICROSYSTEMS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+"""
+Generator for synthetic binary logs, both in the binary format and in
+the textual format produced by mysqlbinlog.
+
+The same sequence of events is used for both formats, so the event
+positions in the textual output match the binary file. Usage::
+
+   python synthetic.py [options] basename
+
+creates basename (binary) and basename.txt (textual).
+"""
+
+import optparse
+import random
+import struct
+import time
+
+_FORMAT_DESCRIPTION_EVENT, _QUERY_EVENT, _INTVAR_EVENT = 15, 2, 5
+_USER_VAR_EVENT, _XID_EVENT = 14, 16
+
+_SERVER_VERSION = '5.1.41-log'
+_DELIMITER = '/*!*/;'
+
+# Post-header lengths of the format description event of a 5.1
+# server, indexed by event type code minus one.
+_POST_HEADER_LEN = [56, 13, 0, 8, 0, 18, 0, 4, 4, 4, 4, 18, 0, 0, 84, 0,
+                    4, 26, 8, 0, 0, 0, 8, 8, 8, 2, 0]
+
+DEFAULT_MIX = {'Query': 60, 'Intvar': 10, 'User_var': 10, 'Xid': 20}
+
+class _Writer(object):
+    "Write events in both formats at the same time."
+
+    def __init__(self, binary, text, server_id, when):
+        self.binary = binary
+        self.text = text
+        self.server_id = server_id
+        self.when = when
+        self.pos = 4
+        self.xid = 0
+        binary.write('\xfebin')
+        text.write("/*!40019 SET @@session.max_insert_delayed_threads=0*/;\n"
+                   "DELIMITER %s\n" % _DELIMITER)
+
+    def event(self, type_code, type_string, body, lines):
+        size = 19 + len(body)
+        end = self.pos + size
+        self.binary.write(struct.pack('<IBIIIH', self.when, type_code,
+                                      self.server_id, size, end, 0))
+        self.binary.write(body)
+        stamp = time.strftime("%y%m%d %H:%M:%S", time.localtime(self.when))
+        self.text.write("# at %d\n#%s server id %d  end_log_pos %d \t%s\n"
+                        % (self.pos, stamp, self.server_id, end,
+                           type_string))
+        self.text.write(lines)
+        self.pos = end
+
+    def close(self):
+        self.text.write("DELIMITER ;\n# End of log file\n")
+
+def _start(writer):
+    body = struct.pack('<H50sIB', 4, _SERVER_VERSION, writer.when, 19)
+    body += ''.join(chr(length) for length in _POST_HEADER_LEN)
+    stamp = time.strftime("%y%m%d %H:%M:%S", time.localtime(writer.when))
+    writer.event(_FORMAT_DESCRIPTION_EVENT,
+                 "Start: binlog v 4, server v %s created %s at startup"
+                 % (_SERVER_VERSION, stamp),
+                 body, "ROLLBACK%s\n" % _DELIMITER)
+
+def _query(writer, rand):
+    query = "INSERT INTO t1 VALUES (%d, '%s')" \
+        % (rand.randint(0, 1 << 30), 'x' * rand.randint(0, 200))
+    status, db = '', 'test'
+    body = struct.pack('<IIBHH', 5, 0, len(db), 0, len(status))
+    body += status + db + '\0' + query
+    writer.event(_QUERY_EVENT, "Query\tthread_id=5\texec_time=0\terror_code=0",
+                 body, "SET TIMESTAMP=%d%s\n%s\n%s\n"
+                 % (writer.when, _DELIMITER, query, _DELIMITER))
+
+def _intvar(writer, rand):
+    value = rand.randint(1, 1 << 30)
+    writer.event(_INTVAR_EVENT, "Intvar", struct.pack('<BQ', 2, value),
+                 "SET INSERT_ID=%d%s\n" % (value, _DELIMITER))
+
+def _user_var(writer, rand):
+    value = rand.randint(0, 1 << 30)
+    body = struct.pack('<I', 3) + 'foo' + struct.pack('<BBII', 0, 2, 8, 8)
+    body += struct.pack('<q', value) + '\0'
+    writer.event(_USER_VAR_EVENT, "User_var", body,
+                 "SET @`foo`:=%d%s\n" % (value, _DELIMITER))
+
+def _xid(writer, rand):
+    writer.xid += 1
+    writer.event(_XID_EVENT, "Xid = %d" % writer.xid,
+                 struct.pack('<Q', writer.xid), "COMMIT%s\n" % _DELIMITER)
+
+_GENERATOR = {
+    'Query': _query,
+    'Intvar': _intvar,
+    'User_var': _user_var,
+    'Xid': _xid,
+}
+
+def generate(basename, events=100000, mix=None, seed=4711, server_id=1,
+             when=1278882445):
+    """Generate a binary log with the given number of events, where
+    mix is a dictionary giving the relative frequency of each event
+    type. Writes the binary log to basename and the textual format to
+    basename.txt and returns the size of the binary log."""
+    rand = random.Random(seed)
+    choices = []
+    for type_string, weight in sorted((mix or DEFAULT_MIX).items()):
+        choices.extend([_GENERATOR[type_string]] * weight)
+
+    binary, text = open(basename, 'wb'), open(basename + '.txt', 'w')
+    writer = _Writer(binary, text, server_id, when)
+    _start(writer)
+    for number in xrange(events):
+        if number % 1000 == 0:
+            writer.when += 1
+        rand.choice(choices)(writer, rand)
+    writer.close()
+    binary.close()
+    text.close()
+    return writer.pos
+
+def _parse_mix(option, opt, value, parser):
+    mix = {}
+    for item in value.split(','):
+        type_string, weight = item.split('=')
+        if type_string not in _GENERATOR:
+            raise optparse.OptionValueError("unknown event type %s"
+                                            % type_string)
+        mix[type_string] = int(weight)
+    parser.values.mix = mix
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options] basename")
+    parser.add_option("-n", "--events", type="int", default=100000,
+                      help="number of events to generate")
+    parser.add_option("-m", "--mix", type="string", action="callback",
+                      callback=_parse_mix,
+                      help="event mix, e.g. Query=60,Xid=20,Intvar=20")
+    parser.add_option("-s", "--seed", type="int", default=4711)
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error("expected a base name for the files")
+    generate(args[0], options.events, getattr(options, 'mix', None),
+             options.seed)
+
+if __name__ == '__main__':
+    main()
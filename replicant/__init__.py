@@ -37,11 +37,15 @@ replicant - A library for working with deployments of MySQL servers.
 
 from exception import *
 from common import *
+from instrument import *
+from pool import *
 from server import *
 from configfile import *
 from machine import *
 from roles import *
 from commands import *
 from backup import *
+from parallel import *
+from rolling import *
 from binlog import *
 
@@ -1,4 +1,5 @@
 import os, replicant, subprocess, urlparse
+from replicant import remote
 
 class BackupImage(object):
     "Class for representing a backup image"
@@ -24,28 +25,34 @@ class PhysicalBackup(BackupImage):
                   if os.path.isdir(os.path.join(datadir, d))]
         server.sql("FLUSH TABLES WITH READ LOCK")
         position = replicant.fetch_master_pos(server)
-        if server.host != "localhost":
-            path = basename(self.url.path)
-        else:
-            path = self.url.path
-        server.ssh(["tar", "zpscf", path, "-C", datadir] + db)
-        if server.host != "localhost":
-            subprocess.call(["scp", server.host + ":" + path, self.url.path])
-        server.sql("UNLOCK TABLES")
+        # The archive is streamed from tar directly into the image,
+        # without a copy on the server or in memory.
+        output = open(self.url.path, 'wb')
+        try:
+            process = server.ssh_stream(
+                ["tar", "zpscf", "-", "-C", datadir] + db, output=output)
+            if process.wait() != 0:
+                raise replicant.CommandError, \
+                    "tar exited with status %d on %s: %s" % (
+                    process.returncode, server.name, process.errors.strip())
+        finally:
+            output.close()
+            server.sql("UNLOCK TABLES")
         return position
 
     def restore_server(self, server):
         if server.host == "localhost":
             path = self.url.path
         else:
-            path = basename(self.url.path)
+            path = os.path.basename(self.url.path)
 
         datadir = server.fetch_config().get('datadir')
 
         try:
             server.stop()
             if server.host != "localhost":
-                call(["scp", self.url.path, server.host + ":" + path])
+                target = server.ssh_user.name + "@" + server.host + ":" + path
+                subprocess.call(remote.scp_command(self.url.path, target))
             server.ssh(["tar", "zxf", path, "-C", datadir])
         finally:
             server.start()
@@ -35,18 +35,32 @@
 Module holding support for reading the output of mysqlbinlog and
 present it using an API.
 
+Binary log files can also be decoded directly, without going through
+mysqlbinlog, using read_binary_events().
 """
 
 import subprocess
+import struct
+import bisect
+import array
+import itertools
+import multiprocessing
+import mmap
+import os
 import re
 import time
 
-from . import exception
+from . import exception, common
 
 class UnrecognizedFormatError(exception.Error):
     """Exception thrown when an unrecognizable format is encountered."""
     pass
 
+class TailerError(exception.Error):
+    """Exception raised when the binary log of a server cannot be
+    followed."""
+    pass
+
 
 def _match_regex(regex, string):
     """Match a regular expression on a string and return the groups as
@@ -60,13 +74,63 @@ def _match_regex(regex, string):
 class LogEvent(object):
     """
     Base class for all binary log events
+
+    Events are kept in memory in large numbers, so the event classes
+    use slots. The timestamp of the event is stored in the when
+    attribute as seconds since the epoch and the timestamp attribute
+    gives it as a time.struct_time in local time.
+
+    Events can be created lazily, in which case only the header
+    fields are set and the fields of the subclass are decoded by a
+    loader function when one of them is first accessed.
     """
+
+    __slots__ = ('event_type', 'start_pos', 'end_pos', 'when', 'server_id',
+                 '_loader')
+
     def __init__(self, event_type, start_pos, end_pos, timestamp, server_id):
+        if isinstance(timestamp, time.struct_time):
+            timestamp = int(time.mktime(timestamp))
         self.event_type = event_type
         self.start_pos = start_pos
         self.end_pos = end_pos
-        self.timestamp = timestamp
+        self.when = timestamp
         self.server_id = server_id
+        self._loader = None
+
+    def __getattr__(self, name):
+        # Only called for slots that are not set, which for a lazy
+        # event are the fields that have not been decoded yet.
+        if name == '_loader':
+            raise AttributeError, name
+        loader = self._loader
+        if loader is None:
+            raise AttributeError, name
+        self._loader = None
+        self._set_fields(loader())
+        return getattr(self, name)
+
+    def _set_fields(self, values):
+        """Set the fields of the subclass from a sequence of values
+        given in the order of the slots of the subclass."""
+        for name, value in zip(type(self).__slots__, values):
+            setattr(self, name, value)
+
+    def __getstate__(self):
+        return dict((name, getattr(self, name))
+                    for cls in type(self).__mro__
+                    for name in getattr(cls, '__slots__', ()))
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    @property
+    def timestamp(self):
+        """
+        The timestamp of the event as a time.struct_time.
+        """
+        return time.localtime(self.when)
 
     @property
     def size(self):
@@ -79,7 +143,9 @@ class QueryEvent(LogEvent):
     """
     Class for representing query log events.
     """
-    
+
+    __slots__ = ('thread_id', 'exec_time', 'error_code', 'query')
+
     def __init__(self, event_type, start_log_pos, end_log_pos, server_id,
                  timestamp, thread_id, exec_time, error_code, query):
         LogEvent.__init__(self, event_type, start_log_pos, end_log_pos,
@@ -93,6 +159,9 @@ class IntvarEvent(LogEvent):
     """
     Integer variable event.
     """
+
+    __slots__ = ('name', 'value')
+
     def __init__(self, event_type, start_log_pos, end_log_pos, timestamp,
                  server_id, name, value):
         LogEvent.__init__(self, event_type, start_log_pos, end_log_pos,
@@ -104,6 +173,9 @@ class UservarEvent(LogEvent):
     """
     User variable event.
     """
+
+    __slots__ = ('name', 'value')
+
     def __init__(self, event_type, start_log_pos, end_log_pos, timestamp,
                  server_id, name, value):
         LogEvent.__init__(self, event_type, start_log_pos, end_log_pos,
@@ -116,6 +188,8 @@ class XidEvent(LogEvent):
     XID event 
     """
 
+    __slots__ = ('xid',)
+
     def __init__(self, event_type, start_log_pos, end_log_pos, timestamp,
                  server_id, xid):
         LogEvent.__init__(self, event_type, start_log_pos, end_log_pos,
@@ -126,6 +200,9 @@ class StartEvent(LogEvent):
     """
     Start event or format description log event.
     """
+
+    __slots__ = ('binlog_version', 'server_version')
+
     def __init__(self, event_type, start_log_pos, end_log_pos, timestamp,
                  server_id, binlog_version, server_version):
         LogEvent.__init__(self, event_type, start_log_pos, end_log_pos,
@@ -133,54 +210,163 @@ class StartEvent(LogEvent):
         self.binlog_version = binlog_version
         self.server_version = server_version
 
+class RotateEvent(LogEvent):
+    """
+    Rotate event, giving the name of the next binary log file and the
+    position to start reading from in that file.
+    """
+
+    __slots__ = ('next_file', 'next_pos')
+
+    def __init__(self, event_type, start_log_pos, end_log_pos, timestamp,
+                 server_id, next_file, next_pos):
+        LogEvent.__init__(self, event_type, start_log_pos, end_log_pos,
+                          timestamp, server_id)
+        self.next_file = next_file
+        self.next_pos = next_pos
+
+class TableMapEvent(LogEvent):
+    """
+    Table map event, mapping a table identifier to a table name and
+    the types of the columns of the table.
+    """
+
+    __slots__ = ('table_id', 'flags', 'db', 'table', 'column_types')
+
+    def __init__(self, event_type, start_log_pos, end_log_pos, timestamp,
+                 server_id, table_id, flags, db, table, column_types):
+        LogEvent.__init__(self, event_type, start_log_pos, end_log_pos,
+                          timestamp, server_id)
+        self.table_id = table_id
+        self.flags = flags
+        self.db = db
+        self.table = table
+        self.column_types = column_types
+
+class RowsEvent(LogEvent):
+    """
+    Rows event (Write_rows, Update_rows, or Delete_rows).
+
+    The row images are not decoded since that requires the column
+    metadata of the table map event. They are available in their
+    packed format in the rows attribute.
+    """
+
+    __slots__ = ('table_id', 'flags', 'width', 'rows')
+
+    def __init__(self, event_type, start_log_pos, end_log_pos, timestamp,
+                 server_id, table_id, flags, width, rows):
+        LogEvent.__init__(self, event_type, start_log_pos, end_log_pos,
+                          timestamp, server_id)
+        self.table_id = table_id
+        self.flags = flags
+        self.width = width
+        self.rows = rows
+
 class UnknownEvent(LogEvent):
     """An unknown event"""
+
+    __slots__ = ()
+
     def __init__(self, event_type, start_log_pos, end_log_pos, timestamp,
-                 server_id, binlog_version, server_version):
+                 server_id):
         LogEvent.__init__(self, event_type, start_log_pos, end_log_pos,
                           timestamp, server_id)
 
 
+def _skip_event(istream):
+    """Skip the lines of an event and return the first line following
+    it, which either starts a new event or ends the binlog."""
+    line = istream.next()
+    while not line.startswith('# at ') and not line.startswith('DELIMITER'):
+        line = istream.next()
+    return line
+
+def _make_event(cls, event_type, start_pos, end_pos, timestamp, server_id,
+                fields, lazy):
+    """Create an event of class cls. The fields parameter is a
+    function returning the values of the fields of the class in the
+    order of its slots. For lazy events, it is not called until one
+    of the fields is accessed."""
+    event = cls.__new__(cls)
+    LogEvent.__init__(event, event_type, start_pos, end_pos, timestamp,
+                      server_id)
+    if lazy:
+        event._loader = fields
+    else:
+        event._set_fields(fields())
+    return event
+
+class _TimestampParser(object):
+    """Parser for the timestamps in the output of mysqlbinlog.
+
+    Events written during the same second share the same timestamp
+    string, so the last string parsed is cached."""
+
+    def __init__(self):
+        self.__last = (None, None)
+
+    def __call__(self, timestamp):
+        last_timestamp, last_when = self.__last
+        if timestamp == last_timestamp:
+            return last_when
+        when = int(time.mktime(time.strptime(timestamp, "%y%m%d %H:%M:%S")))
+        self.__last = (timestamp, when)
+        return when
+
+_parse_timestamp = _TimestampParser()
+
 class LogEventReader(object):
     """
     Base class for log event readers. All event readers inherit from
     this class.
+
+    The timestamp is given either as seconds since the epoch or as
+    the timestamp string printed by mysqlbinlog.
+
+    If lazy is true, the reader only reads the lines of the event and
+    parsing them is deferred until a field of the event is accessed.
+
+    After read(), the line attribute holds the first line following
+    the event, or None if the reader recognized the end of the event
+    without reading further. Readers of the events that end a
+    transaction do the latter, so that the event is returned without
+    waiting for the next event to be written.
     """
     def __init__(self, event_type, start_pos, end_pos, server_id,
-                 timestamp, delimiter):
+                 timestamp, delimiter, lazy=False):
+        if isinstance(timestamp, basestring):
+            timestamp = _parse_timestamp(timestamp)
         self.event_type = event_type
         self.start_pos = int(start_pos)
         self.end_pos = int(end_pos)
         self.server_id = int(server_id)
-        self.timestamp = time.strptime(timestamp, "%y%m%d %H:%M:%S")
+        self.timestamp = timestamp
         self.delimiter = delimiter
+        self.lazy = lazy
         self.line = None
 
     def read(self, rest, istream):
         return None
 
+    def _make_event(self, cls, fields):
+        return _make_event(cls, self.event_type, self.start_pos,
+                           self.end_pos, self.timestamp, self.server_id,
+                           fields, self.lazy)
+
     def _eat_until_next_event(self, istream):
-        """Read lines until it matches the beginning of a new event"""
-        mobj, line = None, None
-        while not mobj:
-            line = istream.next()
-            mobj = re.match(r'# at (\d+)', line)
-        self.line = line
+        """Read lines until it matches the beginning of a new event or
+        the end of the binlog"""
+        self.line = _skip_event(istream)
 
 class UnrecognizedEventReader(LogEventReader):
     """
     Reader that will always return an event representing 
     """
-    def __init__(self, event_type, start_pos, end_pos, server_id,
-                 timestamp, delimiter):
-        LogEventReader.__init__(self, event_type, start_pos, end_pos,
-                                server_id, timestamp, delimiter)
-        self.line = None
-
     def read(self, rest, istream):
         self._eat_until_next_event(istream)
         return UnknownEvent(self.event_type, self.start_pos, self.end_pos,
-                            self.server_id, self.timestamp)
+                            self.timestamp, self.server_id)
 
 class QueryEventReader(LogEventReader):
     """
@@ -193,25 +379,17 @@ class QueryEventReader(LogEventReader):
                             r'exec_time=(\d+)\s+'
                             r'error_code=(\d+)\s+')
 
-    def __init__(self, event_type, start_pos, end_pos, server_id,
-                 timestamp, delimiter):
-        LogEventReader.__init__(self, event_type, start_pos, end_pos,
-                                server_id, timestamp, delimiter)
-        self.line = None
-
     def read(self, rest, istream):
         """
         Will return a new event and the first line that is not part of
         the event, or None if there are no more lines.
         """
 
-        thread_id, exec_time, error_code = _match_regex(self._QUERY_CRE, rest)
-
         # After the header line, there is a sequence of lines ending
         # in the delimiter. These are generated by mysqlbinlog to
         # encode special information.
         self.line = istream.next()
-        while self.line[-len(self.delimiter):] == self.delimiter:
+        while self.line[-len(self.delimiter) - 1:-1] == self.delimiter:
             self.line = istream.next()
 
         # Now comes the query, consisting of one or more lines ending
@@ -221,72 +399,74 @@ class QueryEventReader(LogEventReader):
             query_lines.append(self.line)
             self.line = istream.next()
 
-        # Then we need to ensure that self.line is the next line that
-        # is not part of the event.
-        self.line = istream.next()
+        # The delimiter line ends the event, so the next line is not
+        # read until the next event is requested.
+        self.line = None
 
-        return QueryEvent(self.event_type, self.start_pos, self.end_pos,
-                          self.server_id, self.timestamp,
-                          thread_id, exec_time, error_code,
-                          ''.join(query_lines))
+        # The lines are joined at once so that a lazy event holds a
+        # single string rather than a list of lines.
+        query = ''.join(query_lines)
+        regex = self._QUERY_CRE
+        def fields():
+            thread_id, exec_time, error_code = _match_regex(regex, rest)
+            return thread_id, exec_time, error_code, query
+        return self._make_event(QueryEvent, fields)
 
 class IntvarEventReader(LogEventReader):
     """Reader to read an Intvar event for handling auto_increment values."""
 
     TYPE_STRING = "Intvar"
 
-    def __init__(self, event_type, start_pos, end_pos, server_id,
-                 timestamp, delimiter):
-        LogEventReader.__init__(self, event_type, start_pos, end_pos,
-                                server_id, timestamp, delimiter)
+    _INTVAR_CRE = re.compile(r"set\s+(\w+)\s*=\s*(.+)", re.IGNORECASE)
 
     def read(self, rest, istream):
-        self.line = istream.next()
-        mobj = re.match("set\s+(\w+)\s*=\s*(.+)", self.line, re.IGNORECASE)
-        if not mobj:
-            raise UnrecognizedFormatError, self.line
-        name, value = mobj.groups()
+        line = self.line = istream.next()
+        regex = self._INTVAR_CRE
+        def fields():
+            mobj = regex.match(line)
+            if not mobj:
+                raise UnrecognizedFormatError, line
+            return mobj.groups()
         self._eat_until_next_event(istream)
-        return IntvarEvent(self.event_type, self.start_pos, self.end_pos,
-                           self.server_id, self.timestamp, name, value)
+        return self._make_event(IntvarEvent, fields)
 
 class UservarEventReader(LogEventReader):
     """Reader for processing a user variable assignment event."""
 
     TYPE_STRING = "User_var"
 
-    def __init__(self, event_type, start_pos, end_pos, server_id,
-                 timestamp, delimiter):
-        LogEventReader.__init__(self, event_type, start_pos, end_pos,
-                                server_id, timestamp, delimiter)
-        
+    _USERVAR_CRE = re.compile(r"set\s+(@\S+)\s*:=\s*(.+)", re.IGNORECASE)
+
     def read(self, rest, istream):
-        self.line = istream.next()
-        mobj = re.match("set\s+(@\S+)\s*:=\s*(.+)", self.line, re.IGNORECASE)
-        if not mobj:
-            raise UnrecognizedFormatError, self.line
-        name, value = mobj.groups()
+        line = self.line = istream.next()
+        regex = self._USERVAR_CRE
+        def fields():
+            mobj = regex.match(line)
+            if not mobj:
+                raise UnrecognizedFormatError, line
+            return mobj.groups()
         self._eat_until_next_event(istream)
-        return UservarEvent(self.event_type, self.start_pos, self.end_pos,
-                            self.server_id, self.timestamp, name, value)
+        return self._make_event(UservarEvent, fields)
             
 
 class XidEventReader(LogEventReader):
     TYPE_STRING = "Xid"
 
-    def __init__(self, event_type, start_pos, end_pos, server_id,
-                 timestamp, delimiter):
-        LogEventReader.__init__(self, event_type, start_pos, end_pos,
-                                server_id, timestamp, delimiter)
+    _XID_CRE = re.compile(r"\s*=\s*(\d+)")
 
     def read(self, rest, istream):
-        mobj = re.match("\s*=\s*(\d+)", rest)
-        if not mobj:
-            raise UnrecognizedFormatError, rest
-        xid = mobj.groups()
-        self._eat_until_next_event(istream)
-        return XidEvent(self.event_type, self.start_pos, self.end_pos,
-                        self.server_id, self.timestamp, xid)
+        regex = self._XID_CRE
+        def fields():
+            return [int(_match_regex(regex, rest)[0])]
+        # The XID is followed by a COMMIT line, which ends the event.
+        line = istream.next()
+        if line.startswith('COMMIT'):
+            self.line = None
+        elif line.startswith('# at ') or line.startswith('DELIMITER'):
+            self.line = line
+        else:
+            self._eat_until_next_event(istream)
+        return self._make_event(XidEvent, fields)
 
 class StartEventReader(LogEventReader):
     """Start event reader.
@@ -299,19 +479,28 @@ class StartEventReader(LogEventReader):
                             r'server v\s*(\S+)\s+'
                             r'created\s*(\d{6}\s+\d?\d:\d\d:\d\d)')
 
-    def __init__(self, event_type, start_pos, end_pos, server_id,
-                 timestamp, delimiter):
-        LogEventReader.__init__(self, event_type, start_pos, end_pos,
-                                server_id, timestamp, delimiter)
-        self.line = None
+    def read(self, rest, istream):
+        regex = self._START_CRE
+        def fields():
+            return _match_regex(regex, rest)[:2]
+        self._eat_until_next_event(istream)
+        return self._make_event(StartEvent, fields)
+
+class RotateEventReader(LogEventReader):
+    """Reader for rotate events, which give the name of the next
+    binary log file."""
+
+    TYPE_STRING = "Rotate"
+
+    _ROTATE_CRE = re.compile(r'\s*to\s+(\S+)\s+pos:\s*(\d+)')
 
     def read(self, rest, istream):
-        binlog_version, server_string, create_timestamp \
-            = _match_regex(self._START_CRE, rest)
+        regex = self._ROTATE_CRE
+        def fields():
+            next_file, next_pos = _match_regex(regex, rest)
+            return next_file, int(next_pos)
         self._eat_until_next_event(istream)
-        return StartEvent(self.event_type, self.start_pos, self.end_pos,
-                          self.server_id, self.timestamp,
-                          binlog_version, server_string)
+        return self._make_event(RotateEvent, fields)
 
 # We could probably loop the dictionary and find all the events of the
 # form "...Reader", but I prefer to be explicit here and name the
@@ -322,15 +511,91 @@ _READER = {
     UservarEventReader.TYPE_STRING: UservarEventReader,
     XidEventReader.TYPE_STRING: XidEventReader,
     StartEventReader.TYPE_STRING: StartEventReader,
+    RotateEventReader.TYPE_STRING: RotateEventReader,
 }
 
 
-_TYPE_CRE = re.compile(r'#(\d{6}\s+\d?\d:\d\d:\d\d)\s+' # Datetime
-                       r'server id\s+(\d+)\s+'          # Server ID
-                       r'end_log_pos\s+(\d+)\s+'        # End log pos
-                       r'(\w+)')                        # Type
-                       
-def read_events(istream):
+class EventFilter(object):
+    """
+    Filter deciding what events the readers should return.
+
+    The filter is checked by the readers using only the header of an
+    event, before the rest of the event is parsed, so events that do
+    not match are skipped without creating any objects for them. All
+    conditions given have to match for an event to be returned:
+
+    event_types
+
+       Collection of event type names, for example ``["Query",
+       "Xid"]``.
+
+    server_ids
+
+       Collection of server ids.
+
+    start_pos, stop_pos
+
+       Range of positions, where events starting at or after
+       start_pos and before stop_pos are returned. The positions are
+       byte offsets in the binary log file.
+
+    start_time, stop_time
+
+       Range of times, where events with a timestamp at or after
+       start_time and before stop_time are returned. The times are
+       given either as datetime objects in local time or as seconds
+       since the epoch.
+    """
+
+    def __init__(self, event_types=None, server_ids=None,
+                 start_pos=None, stop_pos=None,
+                 start_time=None, stop_time=None):
+        def _seconds(when):
+            if hasattr(when, 'timetuple'):
+                return time.mktime(when.timetuple())
+            return when
+        self.event_types = event_types and frozenset(event_types)
+        self.server_ids = server_ids and frozenset(server_ids)
+        self.start_pos = start_pos
+        self.stop_pos = stop_pos
+        self.start_time = _seconds(start_time)
+        self.stop_time = _seconds(stop_time)
+        self.needs_time = start_time is not None or stop_time is not None
+
+    def match(self, event_type, start_pos, server_id, when=None):
+        """Check if an event with the given header fields should be
+        returned. The timestamp only needs to be provided if
+        needs_time is true."""
+        if self.event_types is not None \
+                and event_type not in self.event_types:
+            return False
+        if self.server_ids is not None and server_id not in self.server_ids:
+            return False
+        if self.start_pos is not None and start_pos < self.start_pos:
+            return False
+        if self.stop_pos is not None and start_pos >= self.stop_pos:
+            return False
+        if self.start_time is not None and when < self.start_time:
+            return False
+        if self.stop_time is not None and when >= self.stop_time:
+            return False
+        return True
+
+    def match_header(self, start_pos, header):
+        """Check if an event should be returned given its position and
+        the unpacked common header of the binary format."""
+        return self.match(_TYPE_NAME.get(header[1], str(header[1])),
+                          start_pos, header[2], header[0])
+
+# Regular expression matching the "# at" line and the header line of
+# an event in one go.
+_EVENT_CRE = re.compile(r'# at (\d+)\s+'                 # Position
+                        r'#(\d{6}\s+\d?\d:\d\d:\d\d)\s+' # Datetime
+                        r'server id\s+(\d+)\s+'          # Server ID
+                        r'end_log_pos\s+(\d+)\s+'        # End log pos
+                        r'(\w+)')                        # Type
+
+def read_events(istream, lazy=False, event_filter=None):
     """
     Generator that accepts a stream of input lines and parses it into
     a sequence of events.
@@ -338,6 +603,13 @@ def read_events(istream):
     It assumes that the input stream represents the complete output
     from mysqlbinlog and will first read the header, continuing with
     each individual event.
+
+    If lazy is true, only the header fields of the events (type,
+    positions, timestamp, and server id) are parsed when the event is
+    read. The remaining fields are parsed when first accessed.
+
+    If an EventFilter is given, events not matching it are skipped
+    using only the header line of the event.
     """
 
     # Read header
@@ -348,46 +620,986 @@ def read_events(istream):
 
     delimiter = mobj.group(1)
 
-    while not re.match(r'# at \d+', line):
+    while not line.startswith('# at '):
         line = istream.next()
 
-    while line:
-        # Here, line matches "# at \d+" or "DELIMITER ..."
-        mobj = re.match(r'# at (\d+)', line)
-        if not mobj:
-            if re.match("DELIMITER", line):
+    # Bind everything used in the loop to locals since this loop is
+    # executed once for each event.
+    match_event = _EVENT_CRE.match
+    reader_for = _READER.get
+    parse_timestamp = _TimestampParser()
+    next_line = istream.next
+
+    while True:
+        # Here, line starts with "# at " or "DELIMITER"
+        if not line.startswith('# at '):
+            if line.startswith('DELIMITER'):
                 return          # End of binlog file
             else:
                 raise UnrecognizedFormatError, line
-        bytepos = mobj.group(1)
 
-        # Read the type by reading the beginning of the next line
-        line = istream.next()
-        mobj = _TYPE_CRE.match(line)
+        # Parse the position and the header line together
+        header = line + next_line()
+        mobj = match_event(header)
         if not mobj:
-            raise UnrecognizedFormatError, line
+            raise UnrecognizedFormatError, header
+        bytepos, timestamp, server_id, end_pos, event_type = mobj.groups()
+        start_pos, server_id = int(bytepos), int(server_id)
+
+        if event_filter:
+            when = None
+            if event_filter.needs_time:
+                when = parse_timestamp(timestamp)
+            if not event_filter.match(event_type, start_pos, server_id, when):
+                line = _skip_event(istream)
+                continue
 
         # Fetch the correct reader class and initialize it with the
         # remains of the line and passing in the file handle to allow
         # it to read lines.
-        reader_class = _READER.get(mobj.group(4), UnrecognizedEventReader)
-        reader = reader_class(mobj.group(4), bytepos, mobj.group(3),
-                              mobj.group(2), mobj.group(1), delimiter)
-        yield reader.read(line[mobj.end():], istream)
+        reader = reader_for(event_type, UnrecognizedEventReader)(
+            event_type, start_pos, int(end_pos), server_id,
+            parse_timestamp(timestamp), delimiter, lazy)
+        yield reader.read(header[mobj.end():], istream)
         line = reader.line
+        if line is None:
+            line = next_line()
 
-def mysqlbinlog(files, user=None, passwd=None, host="localhost", port=3306):
+class EventBatch(object):
     """
+    A batch of events stored column by column.
+
+    The positions, server ids, and timestamps (in seconds since the
+    epoch) of the events are stored in arrays of unsigned integers
+    and the event types and queries in lists, where the query is None
+    for events that are not query events. Element i of each column
+    belongs to the same event.
     """
+
+    __slots__ = ('event_types', 'start_positions', 'end_positions',
+                 'server_ids', 'timestamps', 'queries')
+
+    def __init__(self):
+        self.event_types = []
+        self.start_positions = array.array('L')
+        self.end_positions = array.array('L')
+        self.server_ids = array.array('L')
+        self.timestamps = array.array('L')
+        self.queries = []
+
+    def __len__(self):
+        return len(self.event_types)
+
+    def append(self, event):
+        """Add an event to the batch."""
+        self.event_types.append(event.event_type)
+        self.start_positions.append(event.start_pos)
+        self.end_positions.append(event.end_pos)
+        self.server_ids.append(event.server_id)
+        self.timestamps.append(event.when)
+        if isinstance(event, QueryEvent):
+            self.queries.append(event.query)
+        else:
+            self.queries.append(None)
+
+def read_event_batches(events, size=1024):
+    """
+    Generator that groups a sequence of events into EventBatch
+    instances of the given size. The last batch may be smaller.
+
+    It can be used with any of the readers, for example::
+
+       for batch in read_event_batches(read_events(istream)):
+           ...
+    """
+    batch = EventBatch()
+    for event in events:
+        batch.append(event)
+        if len(batch) == size:
+            yield batch
+            batch = EventBatch()
+    if len(batch):
+        yield batch
+
+def _mysqlbinlog_command(host, port, user, passwd):
     command = ["mysqlbinlog", "--force", "--read-from-remote-server",
-               "--host=%s" % host]
+               "--host=%s" % host, "--port=%d" % port]
     if user:
         command.append("--user=%s" % user)
     if passwd:
         command.append("--password=%s" % passwd)
-        
+    return command
+
+def mysqlbinlog(files, user=None, passwd=None, host="localhost", port=3306):
+    """
+    Read binary log files from a server using mysqlbinlog and return
+    a generator for the events in the files.
+    """
+    command = _mysqlbinlog_command(host, port, user, passwd)
     proc = subprocess.Popen(command + files, stdout=subprocess.PIPE)
+    return read_events(proc.stdout)
+
+class BinlogTailer(object):
+    """
+    Follow the binary log of a server as it is being written.
+
+    The tailer reads the binary log of a server with ``mysqlbinlog
+    --stop-never``, which keeps the connection to the server open and
+    passes on events as they are written, also across rotations of
+    the binary log. The lines of mysqlbinlog are read as soon as they
+    are available, and the events that end a transaction, that is,
+    XID events and query events, are returned as soon as their last
+    line is read. Other events are returned when the next event
+    starts, which for the events inside a transaction is no later
+    than the end of the transaction.
+
+    The tailer keeps track of two positions: position is the position
+    following the last event returned, and resume_position is the
+    position following the last transaction returned. If the
+    connection is lost or mysqlbinlog terminates, a new mysqlbinlog
+    is started from resume_position after waiting retry_interval
+    seconds, so that the events of a transaction are read together
+    with the table maps and variables they depend on. Events up to
+    position are not returned again.
+
+    If mysqlbinlog fails max_retries times in a row without
+    returning any new event, for example because the replication
+    user is not accepted, TailerError is raised. If max_retries is
+    None, the tailer retries forever.
+
+    Events can be read by iterating over the tailer or passing a
+    callback to run(). Calling stop() ends the iteration. If an
+    EventFilter is given, only events matching it are returned, but
+    all events are read to keep track of the position.
+
+    If no position is given, the tailer starts at the current position
+    of the master, that is, it only returns new events.
+    """
+
+    def __init__(self, server, position=None, retry_interval=1.0,
+                 stop_never=True, event_filter=None, max_retries=5):
+        if position is None:
+            from . import fetch_master_pos
+            position = fetch_master_pos(server)
+        self.server = server
+        self.position = position
+        self.resume_position = position
+        self.retry_interval = retry_interval
+        self.stop_never = stop_never
+        self.event_filter = event_filter
+        self.max_retries = max_retries
+        self.__proc = None
+        self.__stopped = False
+        self.__in_transaction = False
+
+    def _spawn(self, position):
+        """Start mysqlbinlog to read the binary log starting at a
+        position and return the process."""
+        user = self.server.sql_user
+        command = _mysqlbinlog_command(self.server.host, self.server.port,
+                                       user.name, user.passwd)
+        if self.stop_never:
+            command.append("--stop-never")
+        command.append("--start-position=%d" % position.pos)
+        command.append(position.file)
+        return subprocess.Popen(command, stdout=subprocess.PIPE, bufsize=0)
+
+    def _ends_transaction(self, event):
+        """Keep track of whether the events are inside a transaction
+        and return True if the event ends a transaction or is a
+        statement outside of one."""
+        if isinstance(event, XidEvent):
+            self.__in_transaction = False
+            return True
+        if isinstance(event, QueryEvent):
+            query = str(event.query).strip().upper()
+            if query == "BEGIN":
+                self.__in_transaction = True
+                return False
+            if query in ("COMMIT", "ROLLBACK"):
+                self.__in_transaction = False
+                return True
+            return not self.__in_transaction
+        return False
+
+    def _update_position(self, event):
+        """Update the positions given an event and return True if the
+        event is a new event that should be returned."""
+        if isinstance(event, RotateEvent):
+            if not event.end_pos:
+                return False    # Rotate events sent on connect
+            self.position = common.Position(event.next_file, event.next_pos)
+            self.resume_position = self.position
+            self.__in_transaction = False
+            return True
+        position = common.Position(self.position.file, event.end_pos)
+        if self._ends_transaction(event) \
+                and event.end_pos > self.resume_position.pos:
+            self.resume_position = position
+        if event.end_pos <= self.position.pos:
+            # This is the format description event at the beginning
+            # of the file or an event that was already returned.
+            return False
+        self.position = position
+        return True
+
+    def __iter__(self):
+        failures = 0
+        while not self.__stopped:
+            self.__proc = self._spawn(self.resume_position)
+            self.__in_transaction = False
+            # Iterating over a pipe reads ahead, which would delay
+            # events until enough output has accumulated.
+            lines = iter(self.__proc.stdout.readline, '')
+            progress, error = False, None
+            try:
+                for event in read_events(lines, lazy=True):
+                    if self._update_position(event):
+                        progress = True
+                        if self._match(event):
+                            yield event
+                    if self.__stopped:
+                        break
+                else:
+                    # The output ended, so mysqlbinlog is exiting.
+                    self.__proc.wait()
+            except UnrecognizedFormatError, error:
+                pass            # Output cut off in the middle of an event
+            finally:
+                returncode = self._terminate()
+            if self.__stopped:
+                break
+            if progress:
+                failures = 0
+            elif error or returncode:
+                failures += 1
+                if self.max_retries is not None \
+                        and failures > self.max_retries:
+                    raise TailerError, "mysqlbinlog failed %d times " \
+                        "reading from %s: %s" % (
+                            failures, self.resume_position,
+                            error or "exit status %d" % returncode)
+            time.sleep(self.retry_interval)
+
+    def _match(self, event):
+        event_filter = self.event_filter
+        return event_filter is None or \
+            event_filter.match(event.event_type, event.start_pos,
+                               event.server_id, event.when)
+
+    def _terminate(self):
+        """Terminate mysqlbinlog if it is still running and return its
+        exit status, which is None if it was terminated here."""
+        proc, self.__proc = self.__proc, None
+        if proc is None:
+            return None
+        if proc.poll() is None:
+            proc.terminate()
+            proc.wait()
+            return None
+        return proc.returncode
+
+    def run(self, callback):
+        """Read events until stop() is called and pass each event to
+        the callback."""
+        for event in self:
+            callback(event)
+
+    def stop(self):
+        """Stop following the binary log."""
+        self.__stopped = True
+        proc = self.__proc
+        if proc and proc.poll() is None:
+            proc.terminate()
+
+
+
+# Binary log event type codes, together with the names mysqlbinlog
+# uses for them so that events read from the binary format have the
+# same event_type as events read from the textual format.
+START_EVENT_V3 = 1
+QUERY_EVENT = 2
+STOP_EVENT = 3
+ROTATE_EVENT = 4
+INTVAR_EVENT = 5
+RAND_EVENT = 13
+USER_VAR_EVENT = 14
+FORMAT_DESCRIPTION_EVENT = 15
+XID_EVENT = 16
+TABLE_MAP_EVENT = 19
+WRITE_ROWS_EVENT_V1 = 23
+UPDATE_ROWS_EVENT_V1 = 24
+DELETE_ROWS_EVENT_V1 = 25
+INCIDENT_EVENT = 26
+HEARTBEAT_EVENT = 27
+ROWS_QUERY_EVENT = 29
+WRITE_ROWS_EVENT = 30
+UPDATE_ROWS_EVENT = 31
+DELETE_ROWS_EVENT = 32
+GTID_EVENT = 33
+ANONYMOUS_GTID_EVENT = 34
+PREVIOUS_GTIDS_EVENT = 35
+
+_TYPE_NAME = {
+    START_EVENT_V3: "Start",
+    QUERY_EVENT: "Query",
+    STOP_EVENT: "Stop",
+    ROTATE_EVENT: "Rotate",
+    INTVAR_EVENT: "Intvar",
+    RAND_EVENT: "Rand",
+    USER_VAR_EVENT: "User_var",
+    FORMAT_DESCRIPTION_EVENT: "Start",
+    XID_EVENT: "Xid",
+    TABLE_MAP_EVENT: "Table_map",
+    WRITE_ROWS_EVENT_V1: "Write_rows",
+    UPDATE_ROWS_EVENT_V1: "Update_rows",
+    DELETE_ROWS_EVENT_V1: "Delete_rows",
+    INCIDENT_EVENT: "Incident",
+    HEARTBEAT_EVENT: "Heartbeat",
+    ROWS_QUERY_EVENT: "Rows_query",
+    WRITE_ROWS_EVENT: "Write_rows",
+    UPDATE_ROWS_EVENT: "Update_rows",
+    DELETE_ROWS_EVENT: "Delete_rows",
+    GTID_EVENT: "GTID",
+    ANONYMOUS_GTID_EVENT: "Anonymous_GTID",
+    PREVIOUS_GTIDS_EVENT: "Previous-GTIDs",
+}
+
+BINLOG_MAGIC = '\xfebin'
+
+# Common header of all version 4 events: timestamp, type code, server
+# id, event size, end log position, and flags.
+_HEADER = struct.Struct('<IBIIIH')
+_HEADER_LEN = _HEADER.size
+
+_QUERY_HEADER = struct.Struct('<IIBHH')
+_INTVAR_BODY = struct.Struct('<BQ')
+_START_BODY = struct.Struct('<H50sI')
+_UINT64 = struct.Struct('<Q')
+_INT64 = struct.Struct('<q')
+_DOUBLE = struct.Struct('<d')
+_UINT32 = struct.Struct('<I')
+_UINT16 = struct.Struct('<H')
+
+_INTVAR_NAME = { 1: 'LAST_INSERT_ID', 2: 'INSERT_ID' }
+
+# Result types of user variables
+_STRING_RESULT, _REAL_RESULT, _INT_RESULT = 0, 1, 2
+
+# Post-header lengths used until a format description event says
+# otherwise. These are the values used by MySQL 5.1.
+_DEFAULT_POST_HEADER_LEN = {
+    QUERY_EVENT: 13,
+    ROTATE_EVENT: 8,
+    TABLE_MAP_EVENT: 8,
+    WRITE_ROWS_EVENT_V1: 8,
+    UPDATE_ROWS_EVENT_V1: 8,
+    DELETE_ROWS_EVENT_V1: 8,
+    WRITE_ROWS_EVENT: 10,
+    UPDATE_ROWS_EVENT: 10,
+    DELETE_ROWS_EVENT: 10,
+}
+
+_CHECKSUM_VERSION = (5, 6, 1)   # First version with event checksums
+_CHECKSUM_ALG_CRC32 = 1
+
+
+def _unpack_packed_int(data, offset):
+    """Unpack a length-encoded integer and return the value and the
+    offset following it."""
+    first = ord(data[offset])
+    if first < 251:
+        return first, offset + 1
+    elif first == 252:
+        return _UINT16.unpack_from(data, offset + 1)[0], offset + 3
+    elif first == 253:
+        low = _UINT16.unpack_from(data, offset + 1)[0]
+        return low | (ord(data[offset + 3]) << 16), offset + 4
+    elif first == 254:
+        return _UINT64.unpack_from(data, offset + 1)[0], offset + 9
+    raise UnrecognizedFormatError, "bad packed integer at %d" % offset
+
+def _unpack_table_id(data, offset, post_header_len):
+    """Unpack a table id, which is 6 bytes except for very old
+    servers, where it is 4 bytes."""
+    if post_header_len == 6:
+        return _UINT32.unpack_from(data, offset)[0], offset + 4
+    low, high = _UINT32.unpack_from(data, offset)[0], \
+        _UINT16.unpack_from(data, offset + 4)[0]
+    return low | (high << 32), offset + 6
+
+def _parse_version(server_version):
+    mobj = re.match(r'(\d+)\.(\d+)\.(\d+)', server_version)
+    if not mobj:
+        return (0, 0, 0)
+    return tuple(int(part) for part in mobj.groups())
+
+class BinlogDecoder(object):
+    """
+    Decoder for events in the binary log format.
+
+    The decoder keeps track of the information in the format
+    description event (post-header lengths and whether events carry
+    a checksum) and decodes each event into an instance of one of the
+    LogEvent classes. Event types that are not handled are returned
+    as UnknownEvent instances.
+
+    If zero_copy is true, the query of query events and the rows of
+    rows events are returned as buffer objects referring to the data
+    passed to decode() instead of as copied strings.
+
+    If lazy is true, only the common header is decoded when an event
+    is read and the rest of the event is decoded when one of its
+    fields is first accessed. Start and format description events
+    are always decoded since they define how to decode later events.
+    """
+
+    def __init__(self, zero_copy=False, lazy=False):
+        self.zero_copy = zero_copy
+        self.lazy = lazy
+        self.post_header_len = dict(_DEFAULT_POST_HEADER_LEN)
+        self.checksum_len = 0
+        self.binlog_version = 4
+        self.server_version = None
+        self._decoder = {
+            START_EVENT_V3: self._decode_start,
+            FORMAT_DESCRIPTION_EVENT: self._decode_format_description,
+            QUERY_EVENT: self._decode_query,
+            ROTATE_EVENT: self._decode_rotate,
+            INTVAR_EVENT: self._decode_intvar,
+            USER_VAR_EVENT: self._decode_user_var,
+            XID_EVENT: self._decode_xid,
+            TABLE_MAP_EVENT: self._decode_table_map,
+            WRITE_ROWS_EVENT_V1: self._decode_rows,
+            UPDATE_ROWS_EVENT_V1: self._decode_rows,
+            DELETE_ROWS_EVENT_V1: self._decode_rows,
+            WRITE_ROWS_EVENT: self._decode_rows,
+            UPDATE_ROWS_EVENT: self._decode_rows,
+            DELETE_ROWS_EVENT: self._decode_rows,
+        }
+        self._lazy_class = {
+            QUERY_EVENT: QueryEvent,
+            ROTATE_EVENT: RotateEvent,
+            INTVAR_EVENT: IntvarEvent,
+            USER_VAR_EVENT: UservarEvent,
+            XID_EVENT: XidEvent,
+            TABLE_MAP_EVENT: TableMapEvent,
+            WRITE_ROWS_EVENT_V1: RowsEvent,
+            UPDATE_ROWS_EVENT_V1: RowsEvent,
+            DELETE_ROWS_EVENT_V1: RowsEvent,
+            WRITE_ROWS_EVENT: RowsEvent,
+            UPDATE_ROWS_EVENT: RowsEvent,
+            DELETE_ROWS_EVENT: RowsEvent,
+        }
 
-    read_events(proc.stdout)
+    def _payload(self, body, offset):
+        """Return the data in body starting at offset."""
+        if self.zero_copy:
+            return buffer(body, offset)
+        return str(body[offset:])
+
+    def decode(self, start_pos, header, body):
+        """Decode an event given the position of the event, the
+        unpacked common header, and the data following the header."""
+        when, type_code, server_id, size, log_pos, flags = header
+        end_pos = log_pos or start_pos + size
+        event_type = _TYPE_NAME.get(type_code, str(type_code))
+        decoder = self._decoder.get(type_code)
+        if decoder is None:
+            return UnknownEvent(event_type, start_pos, end_pos,
+                                when, server_id)
+        # The format description event defines whether there is a
+        # checksum, including for itself, so it strips its own
+        # checksum.
+        if type_code != FORMAT_DESCRIPTION_EVENT and self.checksum_len:
+            body = buffer(body, 0, len(body) - self.checksum_len)
+        # A format description event replaces the post-header lengths
+        # rather than changing them, so a lazy event decodes its body
+        # with the lengths in effect when it was read.
+        post_header_len = self.post_header_len
+        if self.lazy and type_code in self._lazy_class:
+            cls = self._lazy_class[type_code]
+            def fields():
+                event = decoder(type_code, event_type, start_pos, end_pos,
+                                when, server_id, body, post_header_len)
+                return [getattr(event, name) for name in cls.__slots__]
+            return _make_event(cls, event_type, start_pos, end_pos, when,
+                               server_id, fields, True)
+        return decoder(type_code, event_type, start_pos, end_pos,
+                       when, server_id, body, post_header_len)
+
+    def _decode_start(self, type_code, event_type, start_pos, end_pos,
+                      timestamp, server_id, body, post_header_len):
+        binlog_version, server_version, created \
+            = _START_BODY.unpack_from(body, 0)
+        server_version = server_version.rstrip('\0')
+        self.binlog_version = binlog_version
+        self.server_version = server_version
+        return StartEvent(event_type, start_pos, end_pos, timestamp,
+                          server_id, binlog_version, server_version)
+
+    def _decode_format_description(self, type_code, event_type, start_pos,
+                                   end_pos, timestamp, server_id, body,
+                                   post_header_len):
+        event = self._decode_start(type_code, event_type, start_pos,
+                                   end_pos, timestamp, server_id, body,
+                                   post_header_len)
+        # Skip the common header length, which is always 19 for
+        # version 4, and read the post-header lengths.
+        lengths = body[_START_BODY.size + 1:]
+        # From 5.6.1, the post-header lengths are followed by the
+        # checksum algorithm and the checksum of this event.
+        if _parse_version(self.server_version) >= _CHECKSUM_VERSION:
+            algorithm = ord(lengths[-5])
+            lengths = lengths[:-5]
+            self.checksum_len = 4 if algorithm == _CHECKSUM_ALG_CRC32 else 0
+        else:
+            self.checksum_len = 0
+        post_header_len = dict(post_header_len)
+        for index, length in enumerate(bytearray(lengths)):
+            post_header_len[index + 1] = length
+        self.post_header_len = post_header_len
+        return event
+
+    def _decode_query(self, type_code, event_type, start_pos, end_pos,
+                      timestamp, server_id, body, post_header_len):
+        thread_id, exec_time, db_len, error_code, status_len \
+            = _QUERY_HEADER.unpack_from(body, 0)
+        offset = post_header_len[QUERY_EVENT] + status_len + db_len + 1
+        return QueryEvent(event_type, start_pos, end_pos, server_id,
+                          timestamp, thread_id, exec_time, error_code,
+                          self._payload(body, offset))
+
+    def _decode_rotate(self, type_code, event_type, start_pos, end_pos,
+                       timestamp, server_id, body, post_header_len):
+        next_pos = _UINT64.unpack_from(body, 0)[0]
+        next_file = str(body[post_header_len[ROTATE_EVENT]:])
+        return RotateEvent(event_type, start_pos, end_pos, timestamp,
+                           server_id, next_file, next_pos)
+
+    def _decode_intvar(self, type_code, event_type, start_pos, end_pos,
+                       timestamp, server_id, body, post_header_len):
+        kind, value = _INTVAR_BODY.unpack_from(body, 0)
+        return IntvarEvent(event_type, start_pos, end_pos, timestamp,
+                           server_id, _INTVAR_NAME.get(kind, str(kind)),
+                           value)
+
+    def _decode_user_var(self, type_code, event_type, start_pos, end_pos,
+                         timestamp, server_id, body, post_header_len):
+        name_len = _UINT32.unpack_from(body, 0)[0]
+        offset = 4 + name_len
+        name = "@`%s`" % (str(body[4:offset]),)
+        if ord(body[offset]):
+            value = None
+        else:
+            result_type = ord(body[offset + 1])
+            value_len = _UINT32.unpack_from(body, offset + 6)[0]
+            offset += 10
+            if result_type == _INT_RESULT:
+                value = _INT64.unpack_from(body, offset)[0]
+            elif result_type == _REAL_RESULT:
+                value = _DOUBLE.unpack_from(body, offset)[0]
+            else:
+                value = str(body[offset:offset + value_len])
+        return UservarEvent(event_type, start_pos, end_pos, timestamp,
+                            server_id, name, value)
+
+    def _decode_xid(self, type_code, event_type, start_pos, end_pos,
+                    timestamp, server_id, body, post_header_len):
+        return XidEvent(event_type, start_pos, end_pos, timestamp,
+                        server_id, _UINT64.unpack_from(body, 0)[0])
+
+    def _decode_table_map(self, type_code, event_type, start_pos, end_pos,
+                          timestamp, server_id, body, post_header_len):
+        header_len = post_header_len[TABLE_MAP_EVENT]
+        table_id, offset = _unpack_table_id(body, 0, header_len)
+        flags = _UINT16.unpack_from(body, offset)[0]
+        offset = header_len
+        db_len = ord(body[offset])
+        db = str(body[offset + 1:offset + 1 + db_len])
+        offset += db_len + 2
+        table_len = ord(body[offset])
+        table = str(body[offset + 1:offset + 1 + table_len])
+        offset += table_len + 2
+        columns, offset = _unpack_packed_int(body, offset)
+        column_types = list(bytearray(body[offset:offset + columns]))
+        return TableMapEvent(event_type, start_pos, end_pos, timestamp,
+                             server_id, table_id, flags, db, table,
+                             column_types)
+
+    def _decode_rows(self, type_code, event_type, start_pos, end_pos,
+                     timestamp, server_id, body, post_header_len):
+        header_len = post_header_len[type_code]
+        table_id, offset = _unpack_table_id(body, 0, header_len)
+        flags = _UINT16.unpack_from(body, offset)[0]
+        if type_code in (WRITE_ROWS_EVENT, UPDATE_ROWS_EVENT,
+                         DELETE_ROWS_EVENT):
+            # Version 2 rows events end the post-header with the
+            # length of the extra data, which includes the length
+            # field itself.
+            extra_len = _UINT16.unpack_from(body, offset + 2)[0]
+            offset = header_len + extra_len - 2
+        else:
+            offset = header_len
+        width, offset = _unpack_packed_int(body, offset)
+        offset += (width + 7) / 8
+        if type_code in (UPDATE_ROWS_EVENT_V1, UPDATE_ROWS_EVENT):
+            offset += (width + 7) / 8
+        return RowsEvent(event_type, start_pos, end_pos, timestamp,
+                         server_id, table_id, flags, width,
+                         self._payload(body, offset))
+
+def read_binary_events(istream, lazy=False, event_filter=None):
+    """
+    Generator that reads a binary log file and yields a sequence of
+    events.
+
+    The stream should be opened in binary mode and be positioned at
+    the beginning of the binary log file, which is checked by reading
+    the magic number of the file. If lazy is true, events are decoded
+    on first access to a field that is not part of the header.
+
+    If an EventFilter is given, events not matching it are skipped
+    using only the common header of the event. Reading stops at the
+    first event at or after the stop position of the filter.
+    """
+
+    if istream.read(len(BINLOG_MAGIC)) != BINLOG_MAGIC:
+        raise UnrecognizedFormatError, "not a binary log file"
+
+    decoder = BinlogDecoder(lazy=lazy)
+    unpack_header = _HEADER.unpack
+    pos = len(BINLOG_MAGIC)
+    while True:
+        data = istream.read(_HEADER_LEN)
+        if len(data) < _HEADER_LEN:
+            return              # End of binlog file
+        header = unpack_header(data)
+        size = header[3]
+        if size < _HEADER_LEN:
+            raise UnrecognizedFormatError, "bad event size at %d" % pos
+        skip = event_filter and not event_filter.match_header(pos, header)
+        if skip:
+            if event_filter.stop_pos is not None \
+                    and pos >= event_filter.stop_pos:
+                return
+            # Start events are decoded even when skipped since they
+            # define the format of the following events.
+            if header[1] not in (FORMAT_DESCRIPTION_EVENT, START_EVENT_V3):
+                try:
+                    istream.seek(size - _HEADER_LEN, os.SEEK_CUR)
+                except (AttributeError, IOError):
+                    istream.read(size - _HEADER_LEN)
+                pos += size
+                continue
+        body = istream.read(size - _HEADER_LEN)
+        if len(body) < size - _HEADER_LEN:
+            return              # Event still being written
+        event = decoder.decode(pos, header, body)
+        if not skip:
+            yield event
+        pos += size
+
+def _map_binlog(path):
+    """Map a binary log file into memory and check the magic
+    number. An empty mapping is returned for an empty file."""
+    with open(path, 'rb') as binlog:
+        if not os.fstat(binlog.fileno()).st_size:
+            return ''
+        mapping = mmap.mmap(binlog.fileno(), 0, access=mmap.ACCESS_READ)
+    if mapping[:len(BINLOG_MAGIC)] != BINLOG_MAGIC:
+        raise UnrecognizedFormatError, "%s is not a binary log file" % path
+    return mapping
+
+def read_mapped_events(path, start_pos=None, lazy=False, event_filter=None):
+    """
+    Generator that maps a binary log file into memory and yields a
+    sequence of events.
+
+    The events are decoded directly from the mapping without copying
+    the payload: the query of query events and the rows of rows
+    events are buffer objects referring into the mapping, and the
+    start_pos and end_pos of each event are offsets into the
+    mapping. The mapping stays alive as long as any of these buffers
+    are referenced.
+
+    If start_pos is given, it has to be the position of an event and
+    reading starts at that event. The format description event at
+    the beginning of the file is always decoded, but only yielded if
+    reading starts at the beginning of the file.
+
+    If lazy is true, events are decoded on first access to a field
+    that is not part of the header.
+
+    If an EventFilter is given, events not matching it are skipped
+    using only the common header of the event. Reading stops at the
+    first event at or after the stop position of the filter.
+    """
+
+    mapping = _map_binlog(path)
+    decoder = BinlogDecoder(zero_copy=True, lazy=lazy)
+    unpack_header = _HEADER.unpack_from
+    pos, length = len(BINLOG_MAGIC), len(mapping)
+    if start_pos is not None and start_pos > pos \
+            and pos + _HEADER_LEN <= length:
+        header = unpack_header(mapping, pos)
+        decoder.decode(pos, header,
+                       buffer(mapping, pos + _HEADER_LEN,
+                              header[3] - _HEADER_LEN))
+        pos = start_pos
+    while pos + _HEADER_LEN <= length:
+        header = unpack_header(mapping, pos)
+        size = header[3]
+        if size < _HEADER_LEN:
+            raise UnrecognizedFormatError, "bad event size at %d" % pos
+        if pos + size > length:
+            return              # Event still being written
+        body = buffer(mapping, pos + _HEADER_LEN, size - _HEADER_LEN)
+        if event_filter and not event_filter.match_header(pos, header):
+            if event_filter.stop_pos is not None \
+                    and pos >= event_filter.stop_pos:
+                return
+            if header[1] in (FORMAT_DESCRIPTION_EVENT, START_EVENT_V3):
+                decoder.decode(pos, header, body)
+        else:
+            yield decoder.decode(pos, header, body)
+        pos += size
+
+# Index record: position, size, timestamp, server id, type code, and
+# XID (zero for all events except XID events).
+_INDEX_RECORD = struct.Struct('<QIIIBQ')
+
+class BinlogIndex(object):
+    """
+    Index of the events of a binary log file, stored in a sidecar
+    file next to the binary log file.
+
+    The index holds the position, size, timestamp, server id, type
+    code, and XID of each event and is used to find an event by
+    position, by time, or by XID without scanning the binary log. It
+    is created on first use and extended with events written to the
+    binary log file since it was last updated, so it can be kept up
+    to date for the active binary log by calling update().
+
+    Searching by time assumes that the timestamps in the binary log
+    are non-decreasing, which holds for the binary log of a server
+    but not necessarily for a relay log.
+    """
+
+    def __init__(self, path, index_path=None):
+        self.path = path
+        self.index_path = index_path or path + '.idx'
+        self.positions = array.array('L')
+        self.timestamps = array.array('I')
+        self.__records = []
+        self.__xids = {}
+        self.__load()
+        self.update()
+
+    def __len__(self):
+        return len(self.__records)
+
+    def __getitem__(self, index):
+        """Return the record for an event as a tuple of position,
+        size, timestamp, server id, type code, and XID."""
+        return self.__records[index]
+
+    def __add(self, record):
+        self.__records.append(record)
+        self.positions.append(record[0])
+        self.timestamps.append(record[2])
+        if record[4] == XID_EVENT:
+            self.__xids[record[5]] = record[0]
+
+    def __load(self):
+        try:
+            data = open(self.index_path, 'rb').read()
+        except IOError:
+            return
+        size = _INDEX_RECORD.size
+        length = len(data) - len(data) % size
+        if length < len(data):
+            # A record torn by a crash while updating the index. It is
+            # cut off, since update() appends to the end of the file.
+            index_file = open(self.index_path, 'r+b')
+            index_file.truncate(length)
+            index_file.close()
+        for offset in xrange(0, length, size):
+            self.__add(_INDEX_RECORD.unpack_from(data, offset))
+
+    def __reset(self):
+        self.positions = array.array('L')
+        self.timestamps = array.array('I')
+        self.__records = []
+        self.__xids = {}
+        open(self.index_path, 'wb').close()
+
+    def update(self):
+        """Add the events written to the binary log since the index
+        was last updated and return the number of new events.
+
+        If the binary log no longer matches the index, for example
+        because the file was replaced, the index is rebuilt."""
+        mapping = _map_binlog(self.path)
+        unpack_header = _HEADER.unpack_from
+        length = len(mapping)
+        pos = len(BINLOG_MAGIC)
+        if self.__records:
+            last_pos, last_size, last_when = self.__records[-1][:3]
+            if last_pos + last_size <= length:
+                header = unpack_header(mapping, last_pos)
+                if (header[0], header[3]) == (last_when, last_size):
+                    pos = last_pos + last_size
+            if pos == len(BINLOG_MAGIC):
+                self.__reset()
+
+        records = []
+        while pos + _HEADER_LEN <= length:
+            when, type_code, server_id, size = unpack_header(mapping, pos)[:4]
+            if size < _HEADER_LEN:
+                raise UnrecognizedFormatError, "bad event size at %d" % pos
+            if pos + size > length:
+                break           # Event still being written
+            xid = 0
+            if type_code == XID_EVENT:
+                xid = _UINT64.unpack_from(mapping, pos + _HEADER_LEN)[0]
+            records.append((pos, size, when, server_id, type_code, xid))
+            pos += size
+
+        if records:
+            output = open(self.index_path, 'ab')
+            output.write(''.join(_INDEX_RECORD.pack(*record)
+                                 for record in records))
+            output.close()
+            for record in records:
+                self.__add(record)
+        return len(records)
+
+    def seek_position(self, position):
+        """Return the position of the event containing a position,
+        which can be either a byte offset or a Position instance for
+        this binary log file."""
+        if hasattr(position, 'file'):
+            if position.file and \
+                    position.file != os.path.basename(self.path):
+                raise ValueError, "%r is not in %s" % (position, self.path)
+            position = position.pos
+        index = bisect.bisect_right(self.positions, position) - 1
+        if index < 0:
+            return None
+        pos, size = self.__records[index][:2]
+        if position >= pos + size:
+            return None
+        return pos
+
+    def seek_datetime(self, when):
+        """Return the position of the first event that was written at
+        or after a time, given as a datetime or as seconds since the
+        epoch, or None if there is no such event."""
+        if hasattr(when, 'timetuple'):
+            when = time.mktime(when.timetuple())
+        index = bisect.bisect_left(self.timestamps, when)
+        if index == len(self.timestamps):
+            return None
+        return self.positions[index]
+
+    def seek_xid(self, xid):
+        """Return the position of the XID event for a transaction, or
+        None if there is no such event in the binary log."""
+        return self.__xids.get(xid)
+
+    def read_events(self, start_pos=None):
+        """Read the events of the binary log starting at a position
+        found through one of the seek methods."""
+        return read_mapped_events(self.path, start_pos)
+
+def _event_extents(path, use_index):
+    """Return the position and size of each complete event of a
+    binary log file, either from the index of the file or by walking
+    the event headers in memory."""
+    if use_index:
+        return [record[:2] for record in BinlogIndex(path)]
+    mapping = _map_binlog(path)
+    unpack_header = _HEADER.unpack_from
+    extents, pos, length = [], len(BINLOG_MAGIC), len(mapping)
+    while pos + _HEADER_LEN <= length:
+        size = unpack_header(mapping, pos)[3]
+        if size < _HEADER_LEN:
+            raise UnrecognizedFormatError, "bad event size at %d" % pos
+        if pos + size > length:
+            break               # Event still being written
+        extents.append((pos, size))
+        pos += size
+    return extents
+
+def _chunk_binlog(path, chunk_size, use_index=False):
+    """Split a binary log file into chunks of approximately
+    chunk_size bytes at event boundaries and return a list of
+    (start, stop) pairs."""
+    chunks, start, total = [], len(BINLOG_MAGIC), 0
+    for pos, size in _event_extents(path, use_index):
+        if total >= chunk_size:
+            chunks.append((start, pos))
+            start, total = pos, 0
+        total += size
+    chunks.append((start, None))
+    return chunks
+
+def _scan_chunk(task):
+    """Worker function of scan_binlogs() that reads the events of a
+    chunk and passes them to the scan function."""
+    func, path, start, stop = task
+    events = read_mapped_events(path, start)
+    if stop is not None:
+        events = itertools.takewhile(lambda event: event.start_pos < stop,
+                                     events)
+    return func(events)
+
+def scan_binlogs(paths, func, processes=None, chunk_size=None,
+                 reducer=None, use_index=False):
+    """
+    Scan a set of binary log files in parallel using a pool of
+    processes.
+
+    The scan function is called in a worker process with an iterator
+    over the events of one binary log file, or one chunk of a file if
+    chunk_size is given, and whatever it returns is passed back. Since
+    the function and its return value are passed between processes,
+    both have to be picklable, so the function has to be defined at
+    module level.
+
+    Files are split into chunks of approximately chunk_size bytes at
+    event boundaries, which are found by reading the event headers of
+    each file. Chunks never split an event, but they may split a
+    transaction. If use_index is true, the boundaries are taken from
+    the BinlogIndex of each file instead, which writes the sidecar
+    index file next to the binary log file if it does not exist.
+
+    Without a reducer, the result is a list of (Position, result)
+    pairs, one for each file or chunk, ordered by the position of the
+    first event of the chunk. If a reducer is given, the results are
+    merged in position order by calling reducer(merged, result) for
+    each result after the first, as for the reduce() built-in, and
+    the merged result is returned.
+    """
 
+    tasks = []
+    for path in paths:
+        if chunk_size:
+            chunks = _chunk_binlog(path, chunk_size, use_index)
+        else:
+            chunks = [(len(BINLOG_MAGIC), None)]
+        for start, stop in chunks:
+            tasks.append((func, path, start, stop))
+    tasks.sort(key=lambda task: (os.path.basename(task[1]), task[2]))
 
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(_scan_chunk, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    if reducer is not None:
+        return reduce(reducer, results)
+    return [(common.Position(os.path.basename(task[1]), task[2]), result)
+            for task, result in zip(tasks, results)]
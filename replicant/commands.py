@@ -1,3 +1,7 @@
+import Queue
+import sys
+import time
+
 def flush_and_lock_database(server):
     """Flush all tables and lock the database"""
     server.sql("FLUSH TABLES WITH READ LOCK")
@@ -61,12 +65,118 @@ _MASTER_POS_WAIT = "SELECT MASTER_POS_WAIT(%s, %s)"
 def slave_wait_for_pos(slave, position):
     slave.sql(_MASTER_POS_WAIT, (position.file, position.pos))
 
-def slave_status_wait_until(server, field, pred):
-    while True:
-        row = server.sql("SHOW SLAVE STATUS")
-        value = row[field]
-        if pred(value):
-            return value
+def _fetch_slave_status(server):
+    """Fetch the row of SHOW SLAVE STATUS as a dictionary. This is
+    executed by the executor threads, so the connection is returned
+    to the pool at once."""
+    from . import NotSlaveError
+    try:
+        rows = list(server.sql("SHOW SLAVE STATUS"))
+    finally:
+        server.disconnect()
+    if not rows:
+        raise NotSlaveError
+    return rows[0]
+
+def slave_status_wait_for(conditions, timeout=None, min_interval=0.05,
+                          max_interval=2.0, backoff=2.0):
+    """Wait for several conditions on the slave status of servers.
+
+    Each condition is a tuple (server, field, pred), which is
+    satisfied when pred(value) is true for the value of the field in
+    the SHOW SLAVE STATUS row of the server. The function is a
+    generator that yields a tuple (server, field, value) as each
+    condition is satisfied, so the caller can act on the first slaves
+    to catch up while waiting for the rest:
+
+    conditions = [(slave, "Slave_SQL_Running", lambda v: v == "No")
+                  for slave in slaves]
+    for slave, field, value in slave_status_wait_for(conditions):
+        print slave.name, "stopped"
+
+    The servers are polled concurrently, with one SHOW SLAVE STATUS
+    per server for all the conditions on that server. Each server is
+    polled at once and then again after min_interval seconds, and the
+    interval grows by the backoff factor, up to max_interval seconds,
+    for each poll where none of the watched fields changed. When a
+    field changes, the interval drops back to min_interval, since the
+    slave is making progress.
+
+    If a timeout is given and some condition is not satisfied within
+    timeout seconds, TimeoutError is raised. Errors from polling a
+    server, for example NotSlaveError, are raised as well."""
+    from . import TimeoutError
+    from .parallel import default_executor
+
+    pending = {}                # Server -> [(field, pred)]
+    for server, field, pred in conditions:
+        pending.setdefault(server, []).append((field, pred))
+
+    now = time.time()
+    deadline = timeout is not None and now + timeout
+    interval = dict((server, min_interval) for server in pending)
+    due = dict((server, now) for server in pending)
+    seen = {}                   # Server -> watched values of last poll
+    polled = Queue.Queue()
+    in_flight = set()
+    executor = default_executor()
+
+    while pending:
+        now = time.time()
+        if deadline is not False and now >= deadline:
+            raise TimeoutError, "%d of %d servers did not reach " \
+                "the slave status in time: %s" % (
+                    len(pending), len(interval),
+                    ", ".join(server.name for server in pending))
+        wake = deadline or now + sys.maxint
+        for server in pending:
+            if server in in_flight:
+                continue
+            if due[server] <= now:
+                future = executor.submit(_fetch_slave_status, server)
+                future.add_done_callback(
+                    lambda future, server=server: polled.put((server, future)))
+                in_flight.add(server)
+            else:
+                wake = min(wake, due[server])
+
+        try:
+            server, future = polled.get(True, max(wake - time.time(), 0))
+        except Queue.Empty:
+            continue
+
+        in_flight.discard(server)
+        row = future.result()
+        remaining = []
+        for field, pred in pending[server]:
+            value = row[field]
+            if pred(value):
+                yield server, field, value
+            else:
+                remaining.append((field, pred))
+        if not remaining:
+            del pending[server]
+            continue
+        pending[server] = remaining
+        values = [row[field] for field, pred in remaining]
+        if values != seen.get(server):
+            interval[server] = min_interval
+        else:
+            interval[server] = min(interval[server] * backoff, max_interval)
+        seen[server] = values
+        due[server] = time.time() + interval[server]
+
+def slave_status_wait_until(server, field, pred, timeout=None,
+                            min_interval=0.05, max_interval=2.0):
+    """Wait until pred(value) is true for the value of field in the
+    SHOW SLAVE STATUS row of the server and return the value.
+
+    The server is polled with a growing interval as described for
+    slave_status_wait_for(). If a timeout is given, TimeoutError is
+    raised if the condition is not satisfied in time."""
+    for server, field, value in slave_status_wait_for(
+            [(server, field, pred)], timeout, min_interval, max_interval):
+        return value
 
 def slave_wait_and_stop(slave, position):
     """Set up replication so that it will wait for the position to be
@@ -76,22 +186,46 @@ def slave_wait_and_stop(slave, position):
     slave.sql(_START_SLAVE_UNTIL, (position.file, position.pos))
     slave.sql(_MASTER_POS_WAIT, (position.file, position.pos))
     
-def slave_wait_for_empty_relay_log(slave):
-    "Wait until the relay log is empty and return."
-    result = server.sql("SHOW SLAVE STATUS");
-    file = result["Master_Log_File"]
-    pos = result["Read_Master_Log_Pos"]
-    if server.sql(_MASTER_POS_WAIT, (file, pos)) is None:
+_MASTER_POS_WAIT_TIMEOUT = \
+    "SELECT MASTER_POS_WAIT(%s, %s, %s) AS events"
+
+def slave_wait_for_empty_relay_log(slave, timeout=None):
+    """Wait until the slave has executed all of its relay log and
+    return.
+
+    If a timeout is given, TimeoutError is raised if the relay log is
+    not executed within timeout seconds."""
+    from . import EmptyRowError, NotSlaveError, SlaveNotRunningError
+    from . import TimeoutError
+    result = slave.sql("SHOW SLAVE STATUS");
+    try:
+        file = result["Master_Log_File"]
+        pos = result["Read_Master_Log_Pos"]
+    except EmptyRowError:
+        raise NotSlaveError
+    events = slave.sql(_MASTER_POS_WAIT_TIMEOUT,
+                       (file, pos, timeout or 0))["events"]
+    if events is None:
         raise SlaveNotRunningError
+    if events == -1:
+        raise TimeoutError, "relay log of %s not executed within %s " \
+            "seconds" % (slave.name, timeout)
 
 def fetch_binlog(server, binlog_files=None,
-                 start_datetime=None, stop_datetime=None):
+                 start_datetime=None, stop_datetime=None,
+                 start_position=None, stop_position=None, server_id=None):
     """Fetch the lines of a binary log remotely using the
     ``mysqlbinlog`` program.
 
     If no binlog file names are given, a connection to the server is
     made and a ``SHOW BINARY LOGS`` is executed to get a full list of
     the binary logs, which is then used.
+
+    The datetime, position, and server id options are passed to
+    ``mysqlbinlog`` so that events outside the range or from other
+    servers are never sent. Note that ``mysqlbinlog`` applies the
+    start position to the first file and the stop position to the
+    last file only.
     """
     from subprocess import Popen, PIPE
     if not binlog_files:
@@ -109,6 +243,12 @@ def fetch_binlog(server, binlog_files=None,
         command.append("--start-datetime=%s" % (start_datetime))
     if stop_datetime:
         command.append("--stop-datetime=%s" % (stop_datetime))
+    if start_position is not None:
+        command.append("--start-position=%d" % (start_position))
+    if stop_position is not None:
+        command.append("--stop-position=%d" % (stop_position))
+    if server_id is not None:
+        command.append("--server-id=%d" % (server_id))
     return iter(Popen(command + binlog_files, stdout=PIPE).stdout)
 
 def clone(slave, source, master = None):
@@ -133,6 +273,148 @@ def clone(slave, source, master = None):
         change_master(slave, master, position)
     slave.sql("START SLAVE")
 
+class Failover(object):
+    """The outcome of a failover.
+
+    candidate is the slave that was promoted to master and position
+    is the position in its binary log where the other slaves were
+    connected. The slave positions and repoint outcome of each slave
+    are held in the Results objects positions and repointed.
+    ineligible lists the slaves that were passed over as candidate
+    because they cannot act as a master. lagging lists the slaves that
+    were not at the position of the candidate, which were stopped
+    instead of repointed, with the outcome of stopping them in the
+    Results object stopped. timings gives the time in seconds spent
+    in each phase."""
+
+    def __init__(self, positions):
+        self.positions = positions
+        self.candidate = None
+        self.ineligible = []
+        self.position = None
+        self.repointed = None
+        self.stopped = None
+        self.lagging = []
+        self.timings = []
+
+    @property
+    def errors(self):
+        """Errors of the slaves that could not be collected,
+        repointed, or stopped, keyed by slave."""
+        errors = dict(self.positions.errors)
+        for results in (self.repointed, self.stopped):
+            if results is not None:
+                errors.update(results.errors)
+        return errors
+
+def _drain_relay_log(slave, timeout):
+    slave_wait_for_empty_relay_log(slave, timeout)
+    return fetch_slave_pos(slave)
+
+def _stop_slave(slave):
+    slave.sql("STOP SLAVE")
+
+def _can_be_master(slave):
+    """Check that the slave has a replication user and the binary log
+    enabled, without changing anything on it."""
+    from . import NotMasterError
+    if not hasattr(slave, 'repl_user'):
+        return False
+    try:
+        fetch_master_pos(slave)
+    except NotMasterError:
+        return False
+    finally:
+        slave.disconnect()
+    return True
+
+def failover(master, slaves, timeout=None, executor=None):
+    """Promote the most advanced slave of a failed master and make it
+    the master of the remaining slaves.
+
+    The failover runs in three phases, each of which operates on all
+    slaves concurrently:
+
+    collect
+
+       Each slave executes what remains of its relay log and reports
+       the position in the binary log of the failed master where it
+       stopped. Slaves that fail or do not finish within timeout
+       seconds are left out of the failover.
+
+    promote
+
+       The candidate is the slave with the highest position that can
+       act as a master, that is, has the binary log enabled and a
+       replication user, which is the case for a slave imbued with
+       the Relay role, for example. Slaves are checked from the
+       highest position down before anything is changed on them, and
+       those that fail the check are reported in the ineligible
+       attribute of the result. The candidate is then stopped,
+       disconnected from the failed master with RESET SLAVE, and the
+       position of its own binary log is fetched.
+
+    repoint
+
+       The slaves that reached the same position as the candidate
+       are connected to the candidate at that position using
+       change_master().
+
+    Slaves that were behind the candidate would miss the events
+    between their position and the position of the candidate, since
+    they are not in the binary log of the candidate after the
+    promotion, and ineligible slaves ahead of the candidate would
+    execute some events twice. They are stopped instead of
+    repointed, so that they do not serve reads from a diverged copy
+    of the data, and are reported in the lagging attribute of the
+    result. They have to be cloned from the new master.
+
+    The function returns a Failover object with the result."""
+    from . import NotMasterError, NotSlaveError
+    from .parallel import run_on_servers
+
+    slaves = [slave for slave in slaves if slave is not master]
+    start = time.time()
+    positions = run_on_servers(slaves, _drain_relay_log, (timeout,),
+                               timeout, executor)
+    result = Failover(positions)
+    result.timings.append(("collect", time.time() - start))
+    if not positions.results:
+        raise NotSlaveError, "no slave of %s is available" % (master.name)
+
+    start = time.time()
+    candidate = None
+    for slave, pos in sorted(positions.items(), key=lambda item: item[1],
+                             reverse=True):
+        if _can_be_master(slave):
+            candidate, best = slave, pos
+            break
+        result.ineligible.append(slave)
+    if candidate is None:
+        raise NotMasterError, \
+            "no slave of %s can act as a master" % (master.name)
+    candidate.sql("STOP SLAVE")
+    candidate.sql("RESET SLAVE")
+    result.candidate = candidate
+    result.position = fetch_master_pos(candidate)
+    candidate.disconnect()
+    result.timings.append(("promote", time.time() - start))
+
+    start = time.time()
+    others = [slave for slave, pos in positions.items()
+              if slave is not candidate]
+    result.lagging = [slave for slave in others
+                      if positions.results[slave] != best]
+    current = [slave for slave in others
+               if positions.results[slave] == best]
+    result.repointed = run_on_servers(current, change_master,
+                                      (candidate, result.position),
+                                      timeout, executor)
+    result.stopped = run_on_servers(result.lagging, _stop_slave, (),
+                                    timeout, executor)
+    result.timings.append(("repoint", time.time() - start))
+    return result
+
 _START_SLAVE_UNTIL = "START SLAVE UNTIL MASTER_LOG_FILE=%s, MASTER_LOG_POS=%s"
 _MASTER_POS_WAIT = "SELECT MASTER_POS_WAIT(%s,%s)"
 
@@ -2,9 +2,113 @@
 # Configuration manager class
 #
 
+class ConfigUpdate(object):
+    """The outcome of updating the configuration of a set of servers.
+
+    diffs holds the changes needed for each server that was fetched,
+    as a list of (option, old, new) tuples, where ConfigManager.ABSENT
+    stands for an option that is not present. Servers that already
+    have the options have an empty list. The outcome of fetching and
+    replacing the configurations are held in the Results objects
+    fetched and replaced."""
+
+    def __init__(self, fetched):
+        self.fetched = fetched
+        self.diffs = {}
+        self.replaced = None
+
+    @property
+    def changed(self):
+        """The servers whose configuration differed, in server
+        order."""
+        return [server for server in self.fetched if self.diffs.get(server)]
+
+    @property
+    def errors(self):
+        """Errors of the servers whose configuration could not be
+        fetched or replaced, keyed by server."""
+        errors = dict(self.fetched.errors)
+        if self.replaced is not None:
+            errors.update(self.replaced.errors)
+        return errors
+
 class ConfigManager(object):
     "Base class for all configuration managers."
 
+    # Marker for options missing from a configuration
+    ABSENT = object()
+
     class Config(object):
         "Base class for all configuration implementations."
         pass
+
+    def update_config(self, servers, options=None, remove=(),
+                      max_workers=16, timeout=None, dry_run=False):
+        """Set and remove options in the configuration of many
+        servers.
+
+        options is a dictionary of options to set, where None gives an
+        option without a value, and remove is a list of options to
+        remove. The configurations of all servers are fetched
+        concurrently, and the servers where the configuration differs
+        from the desired one are then replaced concurrently. At most
+        max_workers servers are handled at the same time, and servers
+        that do not finish within timeout seconds get a TimeoutError.
+        If dry_run is true, the differences are computed but nothing
+        is replaced.
+
+        The configurations are fetched and replaced through the
+        methods of each server, so each server uses its own
+        configuration manager and the operations are instrumented.
+        The servers are not restarted, so the changes take effect the
+        next time each server is started. The function returns a
+        ConfigUpdate object with the differences and errors."""
+        from .parallel import Executor, run_on_servers
+
+        options = options or {}
+        executor = Executor(max_workers)
+        try:
+            fetched = run_on_servers(servers,
+                                     lambda server: server.fetch_config(),
+                                     timeout=timeout, executor=executor)
+            update = ConfigUpdate(fetched)
+            for server, config in fetched.items():
+                update.diffs[server] = self._diff(config, options, remove)
+            if dry_run:
+                return update
+
+            def _replace(server):
+                config = fetched.results[server]
+                for option, value in options.items():
+                    config.set(option, value)
+                for option in remove:
+                    config.remove(option)
+                server.replace_config(config)
+            update.replaced = run_on_servers(update.changed, _replace,
+                                             timeout=timeout,
+                                             executor=executor)
+            return update
+        finally:
+            executor.shutdown(wait=False)
+
+    def _diff(self, config, options, remove):
+        """Return the (option, old, new) changes needed to set and
+        remove the options in the configuration."""
+        from .exception import NoOptionError
+        def _get(option):
+            try:
+                return config.get(option)
+            except NoOptionError:
+                return ConfigManager.ABSENT
+        changes = []
+        for option in sorted(options):
+            old, new = _get(option), options[option]
+            if new is not None:
+                new = str(new)
+            if old != new:
+                changes.append((option, old, new))
+        for option in remove:
+            old = _get(option)
+            if old is not ConfigManager.ABSENT:
+                changes.append((option, old, ConfigManager.ABSENT))
+        return changes
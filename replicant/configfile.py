@@ -1,143 +1,311 @@
 from configbase import *
 
-import os, shutil, re, tempfile, subprocess, ConfigParser
+import os, re, tempfile, subprocess
+import hashlib, threading, time
+import remote
 
-_NONE_MARKER = "<>"
+_SECTION_CRE = re.compile(r"\s*\[\s*([^\]]*?)\s*\]\s*(?:[#;].*)?$")
+_DIRECTIVE_CRE = re.compile(r"\s*!(include|includedir)\s+(.*?)\s*$")
+_OPTION_CRE = re.compile(r"\s*([^=\s]+)\s*(?:=(.*)|#.*)?$", re.DOTALL)
+_DIRECTIVES = ('!include', '!includedir')
+
+def _option_name(option):
+    """Normalize an option name. The server treats dashes and
+    underscores in option names as the same character."""
+    return option.strip().lower().replace('_', '-')
+
+def _option_value(text):
+    """Extract the value from the text after the equal sign, removing
+    quotes and comments. Returns None for options without a value."""
+    if text is None:
+        return None
+    text = text.strip()
+    if text[:1] in ('"', "'"):
+        end = text.find(text[0], 1)
+        if end > 0:
+            return text[1:end]
+    # A comment starts at a hash at the start of the value or after
+    # white space.
+    m = re.search(r"(^|\s)#", text)
+    if m:
+        text = text[:m.start()]
+    return text.rstrip()
+
+def _format_option(name, value):
+    if value is None:
+        return name
+    if value != value.strip() or '#' in value:
+        return '%s = "%s"' % (name, value)
+    return "%s = %s" % (name, value)
 
 def _fetch_file(host, user, filename):
-    """Function to fetch a file from the server and copy it to the
-    local machine. A temporary file name is created for """
-    
-    handle, tmpfile = tempfile.mkstemp(text=True)
-    os.close(handle)
+    """Function to fetch the contents of a file from the server. A
+    remote file is copied to a temporary file on the local machine,
+    which is removed once it is read."""
 
-    if host != "localhost":
+    if host == "localhost":
+        return _read_file(filename)
+    handle, tmpfile = tempfile.mkstemp()
+    os.close(handle)
+    try:
         source = user + "@" + host + ":" + filename
-        subprocess.check_call(["scp", "-qB", source, tmpfile])
-    else:
-        shutil.copyfile(filename, tmpfile)
-    return tmpfile
+        subprocess.check_call(remote.scp_command(source, tmpfile, ["-qB"]))
+        return _read_file(tmpfile)
+    finally:
+        os.remove(tmpfile)
 
-def _replace_file(host, user, filename, source):
-    if host != "localhost":
+def _replace_file(host, user, filename, text):
+    """Function to replace the contents of a file on the server."""
+    if host == "localhost":
+        _write_file(filename, text)
+        return
+    handle, tmpfile = tempfile.mkstemp()
+    os.close(handle)
+    try:
+        _write_file(tmpfile, text)
         target = user + "@" + host + ":" + filename
-        subprocess.check_call(["scp", "-qB", source, target])
-    else:
-        shutil.copyfile(source, filename)
+        subprocess.check_call(remote.scp_command(tmpfile, target, ["-qB"]))
+    finally:
+        os.remove(tmpfile)
+
+def _read_file(path):
+    input = file(path, 'rb')
+    try:
+        return input.read()
+    finally:
+        input.close()
+
+def _write_file(path, text):
+    output = file(path, 'wb')
+    try:
+        output.write(text)
+    finally:
+        output.close()
 
 class ConfigManagerFile(ConfigManager):
     "Configuration manager that fetches and restores files directly."
 
     class Config(ConfigManager.Config):
-        """Class for handling server configuration files."""
-    
+        """Class for handling server configuration files.
+
+        The file is kept as a list of lines, so that it is written
+        back exactly as it was read, except for the lines of options
+        that were changed. Comments, blank lines, the order of
+        options, and !include and !includedir directives are kept as
+        they are. Included files are not read.
+
+        Option names are compared the way the server does, so
+        'log_bin' and 'log-bin' is the same option. If an option is
+        given more than once in the section, the last one is used.
+
+        The changed attribute is true if options have been set to new
+        values or removed since the configuration was read, and origin
+        is (host, path, section) for a configuration fetched from a
+        server."""
+
         def __init__(self, path=None, section=None):
-            self.__config = None
             self.__section = section or 'mysqld'
+            self.__lines = []   # (text, section, name, value)
+            self.changed = False
+            self.origin = None
             if path:
                 self.read(path)
 
-        def _clean_config_file(self, fname):
-            input = file(fname, 'r')
-            lines = input.readlines()
-            input.close()
-
-            output = file(fname, 'w')
-            for line in lines:
-                if re.match("#.*|\[\w+\]|[\w\d_-]+\s*=\s*.*", line):
-                    pass
-                elif re.match("\s*[\w\d_-]+\s*", line):
-                    line = ''.join([line.rstrip("\n"), " = ", _NONE_MARKER, "\n"])
-                else:
-                    line = "#!#" + line
-                output.write(line)
-            output.close()
-
-        def _unclean_config_file(self, filename):
-            input = file(filename, 'r')
-            lines = input.readlines()
-            input.close()
-
-            output = file(filename, 'w')
-            for line in lines:
-                m = re.match("([\w\d_-]+)\s*=\s*(.*)", line)
-                if m and m.group(2) == _NONE_MARKER:
-                    output.write(m.group(1) + "\n")
+        def copy(self):
+            """Return an unchanged copy of the configuration."""
+            config = ConfigManagerFile.Config(section=self.__section)
+            config.origin = self.origin
+            config.__lines = list(self.__lines)
+            return config
+
+        def parse(self, text):
+            """Parse the contents of a configuration file."""
+            from . import ConfigParsingError
+            lines = []
+            section = None
+            for number, line in enumerate(text.splitlines(True)):
+                stripped = line.strip()
+                if not stripped or stripped[0] in '#;':
+                    lines.append((line, section, None, None))
+                    continue
+                m = _SECTION_CRE.match(line)
+                if m:
+                    section = m.group(1)
+                    lines.append((line, section, None, None))
                     continue
-                if re.match("#!#.*", line):
-                    output.write(line[3:])
+                m = _DIRECTIVE_CRE.match(line)
+                if m:
+                    lines.append((line, section, "!" + m.group(1),
+                                  m.group(2)))
                     continue
-                output.write(line)
-            output.close()
+                m = _OPTION_CRE.match(line)
+                if not m or section is None:
+                    raise ConfigParsingError, \
+                        "line %d: %s" % (number + 1, stripped)
+                lines.append((line, section, _option_name(m.group(1)),
+                              _option_value(m.group(2))))
+            self.__lines = lines
+            self.changed = False
+
+        def text(self):
+            """Return the contents of the configuration file."""
+            return ''.join(line[0] for line in self.__lines)
 
         def read(self, path):
             """Read configuration from a file."""
-            # We use ConfigParser, but since it cannot read
-            # configuration files we options without values, we have
-            # to clean the output once it is fetched before calling
-            # ConfigParser
-
-            handle, file = tempfile.mkstemp(text=True)
-            os.close(handle)
-            shutil.copy(path, file)
-            self._clean_config_file(file)
-
-            self.__config = ConfigParser.SafeConfigParser()
-            self.__config.read(file)
+            self.parse(_read_file(path))
 
         def write(self, path):
             """Write the configuration to a file."""
-            output = file(path, 'w')
-            self.__config.write(output)
-            # Since ConfigParser cannot handle options without values
-            # (yet), we have to unclean the file before replacing it.
-            output.close()
-            self._unclean_config_file(path)
+            _write_file(path, self.text())
+
+        def includes(self):
+            """Return the !include and !includedir directives of the
+            file as a list of (directive, path) pairs."""
+            return [(name[1:], value) for text, section, name, value
+                    in self.__lines if name in _DIRECTIVES]
+
+        def _find(self, option):
+            """Return the index of the line holding the option in the
+            section, or None if it is not present."""
+            name = _option_name(option)
+            for index in xrange(len(self.__lines) - 1, -1, -1):
+                text, section, key, value = self.__lines[index]
+                if key == name and section == self.__section:
+                    return index
+            return None
 
         def get(self, option):
             """Method to get the value of an option."""
-            value = self.__config.get(self.__section, option)
-            if value == _NONE_MARKER:
-                value = None
-            return value
+            from . import NoOptionError
+            index = self._find(option)
+            if index is None:
+                raise NoOptionError, option
+            return self.__lines[index][3]
 
         def set(self, option, value=None):
             """Method to set the value of an option. If set to None,
             the option is created but will not be given a value."""
-            if value is None:
-                value = _NONE_MARKER
-            self.__config.set(self.__section, option, str(value))
+            if value is not None:
+                value = str(value)
+            index = self._find(option)
+            if index is not None:
+                text, section, name, old = self.__lines[index]
+                if old == value:
+                    return
+                key = _OPTION_CRE.match(text).group(1)
+                ending = text[len(text.rstrip("\r\n")):] or "\n"
+                self.__lines[index] = (_format_option(key, value) + ending,
+                                       section, name, value)
+            else:
+                line = _format_option(option, value) + "\n"
+                self._insert(line, _option_name(option), value)
+            self.changed = True
 
+        def _insert(self, line, name, value):
+            """Insert a new option line after the last option or
+            directive of the section, so that it overrides options
+            from included files, adding the section at the end if it
+            is missing."""
+            lines = self.__lines
+            position = None
+            for index, (text, section, key, _) in enumerate(lines):
+                if section == self.__section and (key or position is None):
+                    position = index + 1
+            if position is None:
+                if lines and not lines[-1][0].endswith("\n"):
+                    lines[-1] = (lines[-1][0] + "\n",) + lines[-1][1:]
+                header = "[%s]\n" % (self.__section)
+                lines.append((header, self.__section, None, None))
+                position = len(lines)
+            previous = lines[position - 1]
+            if not previous[0].endswith("\n"):
+                lines[position - 1] = (previous[0] + "\n",) + previous[1:]
+            lines.insert(position, (line, self.__section, name, value))
 
         def remove(self, option):
             """Method to remove the option from the configuration
             entirely."""
-            self.__config.remove_option(self.__section, option)
-    
+            name = _option_name(option)
+            lines = [line for line in self.__lines
+                     if line[2] != name or line[1] != self.__section]
+            if len(lines) != len(self.__lines):
+                self.__lines = lines
+                self.changed = True
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        # (host, path, section) -> (signature, digest, config)
+        self.__cache = {}
+
+    def _signature(self, server, path):
+        """Return the modification time and size of a configuration
+        file, or None if they cannot be read. Remote files are checked
+        with stat over ssh, which is much cheaper than copying the
+        file."""
+        try:
+            if server.host == "localhost":
+                stat = os.stat(path)
+                return (stat.st_mtime, stat.st_size)
+            output = server.ssh(["stat", "-c", "%Y:%s", path])
+            mtime, size = output[0].split(":")
+            return (float(mtime), int(size))
+        except (OSError, ValueError):
+            return None
+
     def fetch_config(self, server, path=None):
         """Method to fetch the configuration options from the server
         into memory.
 
-        The method operates by creating a temporary file to which it
-        copies the settings. Once the config settings are replaced,
-        the temporary file is removed and to edit the options again,
-        it is necessary to fetch the file again."""
+        The configuration of each file is cached. If the modification
+        time and size of the file are the same as when it was last
+        fetched, a copy of the cached configuration is returned
+        without copying the file. Otherwise, the file is copied, and
+        it is only parsed again if the contents are different.
+
+        A file that was modified within a couple of seconds of being
+        fetched could be modified again without the signature
+        changing, so such files are always copied."""
         
         if not path:
             path = server.defaults_file
-        tmpfile = _fetch_file(server.host, server.ssh_user.name, path)
-        return ConfigManagerFile.Config(tmpfile, server.config_section)
+        key = (server.host, path, server.config_section)
+        signature = self._signature(server, path)
+        with self.__lock:
+            cached = self.__cache.get(key)
+        if cached and signature is not None and cached[0] == signature:
+            return cached[2].copy()
+
+        text = _fetch_file(server.host, server.ssh_user.name, path)
+        digest = hashlib.md5(text).hexdigest()
+        if cached and cached[1] == digest:
+            config = cached[2]
+        else:
+            config = ConfigManagerFile.Config(section=server.config_section)
+            config.parse(text)
+            config.origin = key
+
+        if signature is not None and signature[0] > time.time() - 2:
+            signature = None
+        with self.__lock:
+            self.__cache[key] = (signature, digest, config)
+        return config.copy()
 
     def replace_config(self, server, config, path=None):
         """Method to replace the configuration file with the options
-        in this object."""
+        in this object.
+
+        If the configuration was fetched from the same file and has
+        not been changed since, nothing is written."""
         
         if not path:
             path = server.defaults_file
+        key = (server.host, path, server.config_section)
+        if config.origin == key and not config.changed:
+            return
 
-        handle, tmpfile = tempfile.mkstemp(text=True)
-        os.close(handle)
-        config.write(tmpfile)
-
-        _replace_file(server.host, server.ssh_user.name, path, tmpfile)
-
+        _replace_file(server.host, server.ssh_user.name, path, config.text())
+        with self.__lock:
+            self.__cache.pop(key, None)
+        config.origin = key
+        config.changed = False
@@ -51,6 +51,10 @@ class NoOptionError(Error):
     "Exception raised when ConfigManager does not find the option"
     pass
 
+class ConfigParsingError(Error):
+    "Exception raised when a configuration file cannot be parsed"
+    pass
+
 class SlaveNotRunningError(Error):
     "Exception raised when slave is not running but were expected to run"
     pass
@@ -65,3 +69,18 @@ class NotSlaveError(Error):
     operation is illegal."""
     pass
 
+
+class TimeoutError(Error):
+    """Exception raised when an operation on a server did not finish
+    within the allotted time."""
+    pass
+
+class CommandError(Error):
+    """Exception raised when a shell command on a server exits with a
+    non-zero status."""
+    pass
+
+class ServerDownError(Error):
+    """Exception raised when a server was stopped and could not be
+    started again."""
+    pass
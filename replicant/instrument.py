@@ -0,0 +1,214 @@
+# Copyright (c) 2010, Mats Kindahl, Charles Bell, and Lars Thalmann
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials
+#       provided with the distribution.
+#
+#     * Neither the name of Sun Microsystems nor the names of its
+#       contributors may be used to endorse or promote products
+#       derived from this software without specific prior written
+#       permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL SUN
+# MICROSYSTEMS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+"""
+Module for instrumenting the operations on servers.
+
+Operations on servers, such as executing SQL statements or shell
+commands and fetching or replacing configuration files, call the
+hooks added with add_hook() when they finish. A hook is called as:
+
+  hook(server, operation, seconds, error, size)
+
+where operation is the name of the operation, for example "sql" or
+"fetch_config", seconds is the time the operation took, error is the
+exception raised by the operation or None, and size is the number of
+bytes transferred, or None if it is not known. For SQL statements,
+the size is only the length of the statements sent: the rows
+returned are not measured, since a streamed result is still being
+read when the hooks are called. For shell commands, the size is the
+length of the output. Hooks are called in the thread that executed
+the operation. A hook that raises an exception is logged with the
+logging module and does not affect the operation.
+
+The Metrics class collects counts, errors, bytes, and latency
+histograms per server and operation:
+
+  metrics = Metrics()
+  add_hook(metrics.record)
+  master.imbue(Master(repl_user))
+  for stats in metrics.stats(server=master):
+      print stats
+
+When no hooks are added, the only cost of the instrumentation is an
+extra function call for each operation.
+"""
+
+import bisect
+import functools
+import logging
+import threading
+import time
+
+_log = logging.getLogger(__name__)
+
+_hooks = ()
+_hooks_lock = threading.Lock()
+
+def add_hook(hook):
+    """Add a hook that is called after each operation on a server."""
+    global _hooks
+    with _hooks_lock:
+        _hooks = _hooks + (hook,)
+
+def remove_hook(hook):
+    """Remove a hook added with add_hook()."""
+    global _hooks
+    with _hooks_lock:
+        hooks = list(_hooks)
+        hooks.remove(hook)
+        _hooks = tuple(hooks)
+
+def _call_hooks(hooks, server, operation, seconds, error, size):
+    # A failing hook is logged and skipped, so that it can neither
+    # replace the result of the operation nor mask its error.
+    for hook in hooks:
+        try:
+            hook(server, operation, seconds, error, size)
+        except Exception:
+            _log.exception("Instrumentation hook %r failed for %s on %s",
+                           hook, operation, server)
+
+def instrumented(operation, size=None):
+    """Decorator for a server method that calls the hooks when the
+    method finishes. If size is given, it is called with the result
+    followed by the arguments of the method to compute the number of
+    bytes transferred. Exceptions raised by the hooks or by size are
+    logged and otherwise ignored."""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(server, *args, **kwargs):
+            hooks = _hooks
+            if not hooks:
+                return method(server, *args, **kwargs)
+            start = time.time()
+            try:
+                result = method(server, *args, **kwargs)
+            except Exception, error:
+                seconds = time.time() - start
+                _call_hooks(hooks, server, operation, seconds, error, None)
+                raise
+            seconds = time.time() - start
+            try:
+                nbytes = size and size(result, *args, **kwargs)
+            except Exception:
+                _log.exception("Computing the size of %s on %s failed",
+                               operation, server)
+                nbytes = None
+            _call_hooks(hooks, server, operation, seconds, None, nbytes)
+            return result
+        return wrapper
+    return decorator
+
+# Upper bounds in seconds of the latency histogram buckets, doubling
+# from 100 microseconds to about 14 minutes. The last bucket holds
+# everything slower.
+LATENCY_BUCKETS = tuple(0.0001 * 2 ** i for i in range(24))
+
+class OperationStats(object):
+    """Statistics for one operation on one server."""
+
+    def __init__(self, server, operation):
+        self.server = server
+        self.operation = operation
+        self.count = 0
+        self.errors = 0
+        self.bytes = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def add(self, seconds, error, size):
+        self.count += 1
+        if error is not None:
+            self.errors += 1
+        if size:
+            self.bytes += size
+        self.total_time += seconds
+        self.max_time = max(self.max_time, seconds)
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    @property
+    def error_rate(self):
+        return self.count and float(self.errors) / self.count
+
+    @property
+    def mean_time(self):
+        return self.count and self.total_time / self.count
+
+    def percentile(self, percent):
+        """Return an upper bound of the given latency percentile,
+        that is, the upper bound of the histogram bucket holding
+        it."""
+        rank = self.count * percent / 100.0
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max_time
+
+    def __repr__(self):
+        return "<%s %s: %d calls, %d errors, %d bytes, " \
+            "mean %.4fs, p99 %.4fs>" % (
+            self.server, self.operation, self.count, self.errors,
+            self.bytes, self.mean_time, self.percentile(99))
+
+class Metrics(object):
+    """A registry of statistics per server and operation. The record
+    method is a hook to be added with add_hook(). Servers are
+    identified by name."""
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__stats = {}
+
+    def record(self, server, operation, seconds, error, size):
+        key = (server.name, operation)
+        with self.__lock:
+            stats = self.__stats.get(key)
+            if stats is None:
+                stats = self.__stats[key] = OperationStats(*key)
+            stats.add(seconds, error, size)
+
+    def stats(self, server=None, operation=None):
+        """Return the statistics, sorted by server and operation,
+        optionally only for one server or one operation."""
+        with self.__lock:
+            return [stats for key, stats in sorted(self.__stats.items())
+                    if (server is None or key[0] == server.name)
+                    and (operation is None or key[1] == operation)]
+
+    def reset(self):
+        with self.__lock:
+            self.__stats.clear()
@@ -0,0 +1,378 @@
+# Copyright (c) 2010, Mats Kindahl, Charles Bell, and Lars Thalmann
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials
+#       provided with the distribution.
+#
+#     * Neither the name of Sun Microsystems nor the names of its
+#       contributors may be used to endorse or promote products
+#       derived from this software without specific prior written
+#       permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL SUN
+# MICROSYSTEMS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+"""
+Module for executing operations on many servers concurrently.
+"""
+
+import Queue
+import sys
+import threading
+import time
+
+from . import exception
+
+class Future(object):
+    """The result of a call that is executed by an Executor.
+
+    The result of the call is fetched using result(), which waits for
+    the call to finish and either returns the value of the call or
+    re-raises the exception that the call raised."""
+
+    def __init__(self):
+        self.__done = threading.Event()
+        self.__lock = threading.Lock()
+        self.__state = 'PENDING'
+        self.__value = None
+        self.__exc_info = None
+        self.__callbacks = []
+
+    def cancel(self):
+        """Cancel the call unless it has already started. Returns
+        True if the call was cancelled."""
+        with self.__lock:
+            if self.__state != 'PENDING':
+                return self.__state == 'CANCELLED'
+            self.__state = 'CANCELLED'
+        self._finish()
+        return True
+
+    def cancelled(self):
+        return self.__state == 'CANCELLED'
+
+    def running(self):
+        return self.__state == 'RUNNING'
+
+    def done(self):
+        return self.__done.is_set()
+
+    def wait(self, timeout=None):
+        """Wait for the call to finish, for at most timeout seconds if
+        a timeout is given. Returns True if the call is finished."""
+        self.__done.wait(timeout)
+        return self.__done.is_set()
+
+    def result(self, timeout=None):
+        """Return the value of the call, waiting at most timeout
+        seconds for it to finish."""
+        if not self.wait(timeout):
+            raise exception.TimeoutError, "call did not finish in time"
+        if self.__state == 'CANCELLED':
+            raise exception.Error, "call was cancelled"
+        if self.__exc_info:
+            exc_type, exc_value, exc_tb = self.__exc_info
+            raise exc_type, exc_value, exc_tb
+        return self.__value
+
+    def exception(self, timeout=None):
+        """Return the exception raised by the call, or None if the
+        call finished normally."""
+        if not self.wait(timeout):
+            raise exception.TimeoutError, "call did not finish in time"
+        return self.__exc_info and self.__exc_info[1]
+
+    def add_done_callback(self, func):
+        """Call func with the future as argument when the call is
+        finished. If it is already finished, func is called at once."""
+        with self.__lock:
+            if not self.__done.is_set():
+                self.__callbacks.append(func)
+                return
+        func(self)
+
+    def _run(self, func, args, kwargs):
+        with self.__lock:
+            if self.__state != 'PENDING':
+                return
+            self.__state = 'RUNNING'
+        try:
+            self.__value = func(*args, **kwargs)
+        except:
+            self.__exc_info = sys.exc_info()
+        self.__state = 'FINISHED'
+        self._finish()
+
+    def _finish(self):
+        with self.__lock:
+            self.__done.set()
+            callbacks, self.__callbacks = self.__callbacks, []
+        for func in callbacks:
+            func(self)
+
+class Executor(object):
+    """A pool of worker threads executing calls.
+
+    Worker threads are started as calls are submitted, until there
+    are max_workers threads, and then wait for more calls until the
+    executor is shut down. The threads are daemon threads, so a call
+    that never returns does not keep the program from exiting."""
+
+    def __init__(self, max_workers=32):
+        self.max_workers = max_workers
+        self.__queue = Queue.Queue()
+        self.__lock = threading.Lock()
+        self.__threads = []
+        self.__idle = 0
+        self.__shutdown = False
+
+    def submit(self, func, *args, **kwargs):
+        """Schedule func(*args, **kwargs) for execution and return a
+        Future for the result."""
+        future = Future()
+        with self.__lock:
+            if self.__shutdown:
+                raise exception.Error, "executor is shut down"
+            self.__queue.put((future, func, args, kwargs))
+            if self.__idle == 0 and len(self.__threads) < self.max_workers:
+                thread = threading.Thread(target=self._worker)
+                thread.daemon = True
+                thread.start()
+                self.__threads.append(thread)
+            elif self.__idle > 0:
+                self.__idle -= 1
+        return future
+
+    def shutdown(self, wait=True):
+        """Stop the worker threads once all submitted calls are
+        executed. If wait is true, wait for the threads to finish."""
+        with self.__lock:
+            self.__shutdown = True
+            threads = list(self.__threads)
+        for thread in threads:
+            self.__queue.put(None)
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    def _worker(self):
+        while True:
+            work = self.__queue.get()
+            if work is None:
+                return
+            future, func, args, kwargs = work
+            future._run(func, args, kwargs)
+            del future, func, args, kwargs, work
+            with self.__lock:
+                self.__idle += 1
+
+_default_executor = None
+_default_executor_lock = threading.Lock()
+
+def default_executor():
+    """Return the executor shared by the asynchronous server
+    operations, creating it on first use."""
+    global _default_executor
+    with _default_executor_lock:
+        if _default_executor is None:
+            _default_executor = Executor(64)
+        return _default_executor
+
+def as_completed(futures, timeout=None):
+    """Iterate over the futures in the order they finish. If not all
+    futures have finished within timeout seconds, TimeoutError is
+    raised."""
+    finished = Queue.Queue()
+    futures = list(futures)
+    for future in futures:
+        future.add_done_callback(finished.put)
+    deadline = timeout is not None and time.time() + timeout
+    for i in xrange(len(futures)):
+        try:
+            if deadline is False:
+                # Waiting without timeout cannot be interrupted
+                yield finished.get(True, sys.maxint)
+            else:
+                yield finished.get(True, max(deadline - time.time(), 0))
+        except Queue.Empty:
+            raise exception.TimeoutError, \
+                "%d of %d calls did not finish in time" \
+                % (len(futures) - i, len(futures))
+
+class Results(object):
+    """The results of executing an operation on a set of servers.
+
+    Servers where the operation succeeded are found in the results
+    dictionary, and servers where it raised an exception (including
+    TimeoutError if it did not finish in time) in the errors
+    dictionary, both keyed by server. Indexing with a server returns
+    the result for the server or raises the error of the server.
+    Iterating gives the servers in the order they were given."""
+
+    def __init__(self, servers):
+        self.servers = list(servers)
+        self.results = {}
+        self.errors = {}
+
+    def __len__(self):
+        return len(self.servers)
+
+    def __iter__(self):
+        return iter(self.servers)
+
+    def __getitem__(self, server):
+        if server in self.errors:
+            raise self.errors[server]
+        return self.results[server]
+
+    @property
+    def ok(self):
+        """True if the operation succeeded on all servers."""
+        return not self.errors
+
+    def items(self):
+        """Return a list of (server, result) pairs for the servers
+        where the operation succeeded, in server order."""
+        return [(server, self.results[server])
+                for server in self.servers if server in self.results]
+
+    def raise_errors(self):
+        """Raise the error of the first server that failed, if any."""
+        for server in self.servers:
+            if server in self.errors:
+                raise self.errors[server]
+        return self
+
+def _call(server, func, args):
+    """Call func for server in a worker thread. The connection that
+    the worker thread used is returned to the connection pool of the
+    server afterwards, since worker threads move between servers."""
+    try:
+        return func(server, *args)
+    finally:
+        server.disconnect()
+
+def run_on_servers(servers, func, args=(), timeout=None, executor=None):
+    """Call func(server, *args) for each server concurrently and
+    collect the results in a Results object.
+
+    If a timeout is given, any server that has not finished within
+    timeout seconds from the start of the call gets a TimeoutError
+    instead of a result. The call that timed out is not interrupted,
+    but it is left running in the background. If no executor is
+    given, a thread is used for each server."""
+    results = Results(servers)
+    own_executor = executor is None
+    if own_executor:
+        executor = Executor(max(len(results.servers), 1))
+    try:
+        futures = [(server, executor.submit(_call, server, func, args))
+                   for server in results.servers]
+        deadline = timeout is not None and time.time() + timeout
+        for server, future in futures:
+            if deadline is False:
+                future.wait()
+            elif not future.wait(max(deadline - time.time(), 0)):
+                future.cancel()
+                results.errors[server] = exception.TimeoutError(
+                    "%s did not finish within %s seconds"
+                    % (server.name, timeout))
+                continue
+            error = future.exception()
+            if error is None:
+                results.results[server] = future.result()
+            else:
+                results.errors[server] = error
+    finally:
+        if own_executor:
+            executor.shutdown(wait=False)
+    return results
+
+class Deployment(object):
+    """A set of servers that are operated on concurrently.
+
+    Each operation is executed on all servers of the deployment at
+    the same time, using at most max_workers threads, and returns a
+    Results object with the result or error for each server. The
+    timeout, which can be given for the deployment or for each
+    operation, is the number of seconds to wait for each server.
+
+    deployment = Deployment(slaves, timeout=5)
+    for server, pos in deployment.fetch_slave_pos().items():
+        print server.name, pos"""
+
+    def __init__(self, servers, max_workers=32, timeout=None):
+        self.servers = list(servers)
+        self.timeout = timeout
+        self.__executor = Executor(max_workers)
+
+    def __iter__(self):
+        return iter(self.servers)
+
+    def __len__(self):
+        return len(self.servers)
+
+    def close(self):
+        """Stop the worker threads of the deployment."""
+        self.__executor.shutdown(wait=False)
+
+    def run(self, func, args=(), timeout=None):
+        """Call func(server, *args) for each server of the
+        deployment."""
+        if timeout is None:
+            timeout = self.timeout
+        return run_on_servers(self.servers, func, args, timeout,
+                              self.__executor)
+
+    def sql(self, command, args=None, db='', timeout=None):
+        """Execute an SQL statement on each server of the deployment.
+        The result for each server is a list of the rows."""
+        def _sql(server):
+            return list(server.sql(command, args, db))
+        return self.run(_sql, timeout=timeout)
+
+    def ssh(self, command, timeout=None):
+        """Execute a shell command on each server of the deployment."""
+        return self.run(lambda server: server.ssh(command),
+                        timeout=timeout)
+
+    def fetch_master_pos(self, timeout=None):
+        from .commands import fetch_master_pos
+        return self.run(fetch_master_pos, timeout=timeout)
+
+    def fetch_slave_pos(self, timeout=None):
+        from .commands import fetch_slave_pos
+        return self.run(fetch_slave_pos, timeout=timeout)
+
+    def slave_status(self, timeout=None):
+        """Fetch the row of SHOW SLAVE STATUS for each server. The
+        result is None for servers that are not slaves."""
+        def _slave_status(server):
+            rows = list(server.sql("SHOW SLAVE STATUS"))
+            return rows and rows[0] or None
+        return self.run(_slave_status, timeout=timeout)
+
+    def stop_slave(self, timeout=None):
+        return self.sql("STOP SLAVE", timeout=timeout)
+
+    def start_slave(self, timeout=None):
+        return self.sql("START SLAVE", timeout=timeout)
@@ -0,0 +1,207 @@
+# Copyright (c) 2010, Mats Kindahl, Charles Bell, and Lars Thalmann
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials
+#       provided with the distribution.
+#
+#     * Neither the name of Sun Microsystems nor the names of its
+#       contributors may be used to endorse or promote products
+#       derived from this software without specific prior written
+#       permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL SUN
+# MICROSYSTEMS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+"""
+Module holding a pool of database connections.
+"""
+
+import collections
+import threading
+import time
+
+from . import exception
+
+class PoolExhaustedError(exception.Error):
+    """Exception raised when no connection could be checked out from
+    the pool before the timeout."""
+    pass
+
+class ConnectionPool(object):
+    """A thread-safe pool of database connections.
+
+    Connections are created by calling the connect function given to
+    the constructor when needed, and at most max_size connections are
+    open at the same time. A thread that checks out a connection when
+    all max_size connections are in use waits until one is released,
+    for at most timeout seconds if a timeout is given.
+
+    Connections that have been idle for more than idle_timeout seconds
+    are closed, but min_size connections are always kept open. Before
+    a connection that has been idle for more than ping_after seconds is
+    handed out, it is pinged, and it is replaced with a new connection
+    if the ping fails, for example because the server was restarted.
+    """
+
+    def __init__(self, connect, min_size=0, max_size=8, idle_timeout=300,
+                 ping_after=0, timeout=None):
+        if max_size < 1 or min_size > max_size:
+            raise ValueError, "bad pool size %d-%d" % (min_size, max_size)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.ping_after = ping_after
+        self.timeout = timeout
+        self.__connect = connect
+        self.__cond = threading.Condition()
+        self.__idle = collections.deque()     # (connection, released at)
+        self.__size = 0                       # Open connections
+
+    @property
+    def size(self):
+        """Number of connections currently open, idle or checked out."""
+        return self.__size
+
+    @property
+    def idle(self):
+        """Number of idle connections."""
+        return len(self.__idle)
+
+    def checkout(self, timeout=None):
+        """Check out a connection from the pool, creating a new one if
+        there are no idle connections and the pool is not full."""
+        if timeout is None:
+            timeout = self.timeout
+        deadline = timeout is not None and time.time() + timeout
+        self.__cond.acquire()
+        try:
+            self._evict_idle()
+            while not self.__idle and self.__size >= self.max_size:
+                if deadline is False:
+                    self.__cond.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise PoolExhaustedError, "all %d connections " \
+                            "in use for %s seconds" % (self.max_size,
+                                                       timeout)
+                    self.__cond.wait(remaining)
+            if self.__idle:
+                conn, released = self.__idle.pop()
+            else:
+                conn, released = None, None
+                self.__size += 1
+        finally:
+            self.__cond.release()
+
+        # Talking to the server is done without holding the lock.
+        try:
+            if conn is None:
+                return self.__connect()
+            if time.time() - released >= self.ping_after:
+                try:
+                    conn.ping()
+                except Exception:
+                    self._close(conn)
+                    return self.__connect()
+            return conn
+        except:
+            self._forget()
+            raise
+
+    def release(self, conn):
+        """Return a connection to the pool."""
+        self.__cond.acquire()
+        try:
+            self.__idle.append((conn, time.time()))
+            self._evict_idle()
+            self.__cond.notify()
+        finally:
+            self.__cond.release()
+
+    def discard(self, conn):
+        """Close a checked out connection that is no longer usable
+        instead of returning it to the pool."""
+        self._close(conn)
+        self._forget()
+
+    def close(self):
+        """Close all idle connections."""
+        self.__cond.acquire()
+        try:
+            while self.__idle:
+                conn, released = self.__idle.popleft()
+                self._close(conn)
+                self.__size -= 1
+            self.__cond.notify_all()
+        finally:
+            self.__cond.release()
+
+    def _forget(self):
+        self.__cond.acquire()
+        try:
+            self.__size -= 1
+            self.__cond.notify()
+        finally:
+            self.__cond.release()
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass            # The connection is already broken
+
+    def _evict_idle(self):
+        """Close connections idle for more than idle_timeout. Must be
+        called with the lock held. The idle connections are ordered
+        by release time, so the oldest are at the left end."""
+        limit = time.time() - self.idle_timeout
+        while self.__idle and self.__size > self.min_size \
+                and self.__idle[0][1] < limit:
+            conn, released = self.__idle.popleft()
+            self._close(conn)
+            self.__size -= 1
+
+class Lease(object):
+    """A connection checked out from a pool and held by a thread.
+
+    The dirty attribute records whether the session of the connection
+    was changed, so that it cannot be reused by others. If the lease
+    is dropped while it still holds the connection, for example
+    because it is kept in thread-local data and the thread ends
+    without returning the connection, the connection is discarded so
+    that the pool does not run out of connections."""
+
+    def __init__(self, pool, conn):
+        self.pool = pool
+        self.conn = conn
+        self.dirty = False
+
+    def take(self):
+        """Take the connection out of the lease, after which the lease
+        no longer discards it."""
+        conn, self.conn = self.conn, None
+        return conn
+
+    def __del__(self):
+        if self.conn is not None:
+            self.pool.discard(self.conn)
@@ -0,0 +1,218 @@
+# Copyright (c) 2010, Mats Kindahl, Charles Bell, and Lars Thalmann
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials
+#       provided with the distribution.
+#
+#     * Neither the name of Sun Microsystems nor the names of its
+#       contributors may be used to endorse or promote products
+#       derived from this software without specific prior written
+#       permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL SUN
+# MICROSYSTEMS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+"""
+Module for executing commands and copying files on remote hosts.
+
+All ssh and scp commands are started with options that make them
+share one connection per user and host: the first command to a host
+becomes the control master, and later commands run as new sessions
+over its connection instead of doing a full handshake. The control
+master stays open for CONTROL_PERSIST seconds after the last session
+ends, and all control masters are closed when the program exits.
+"""
+
+import atexit
+import os
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+
+from . import exception
+
+# Seconds to keep an idle connection to a host open
+CONTROL_PERSIST = 300
+
+# Seconds a cancelled command has to exit before it is killed
+CANCEL_GRACE = 5
+
+_control_dir = None
+_control_lock = threading.Lock()
+_registered = False
+
+def _control_path():
+    global _control_dir, _registered
+    with _control_lock:
+        if _control_dir is None:
+            _control_dir = tempfile.mkdtemp(prefix="replicant-ssh-")
+            if not _registered:
+                atexit.register(close_connections)
+                _registered = True
+        return os.path.join(_control_dir, "%r@%h:%p")
+
+def control_options():
+    """Return the ssh options for sharing connections."""
+    return ["-o", "ControlMaster=auto",
+            "-o", "ControlPath=" + _control_path(),
+            "-o", "ControlPersist=%d" % (CONTROL_PERSIST)]
+
+def ssh_command(user, host, command, options=()):
+    """Return the argument list to execute a shell command on a host
+    as a user over the shared connection."""
+    return ["ssh"] + control_options() + list(options) \
+        + [user + "@" + host, command]
+
+def scp_command(source, target, options=()):
+    """Return the argument list to copy a file over the shared
+    connection. Remote files are given as user@host:path."""
+    return ["scp"] + control_options() + list(options) + [source, target]
+
+def close_connections():
+    """Close the connections to all hosts. Commands started later
+    open new connections."""
+    global _control_dir
+    with _control_lock:
+        directory, _control_dir = _control_dir, None
+    if directory is None:
+        return
+    devnull = open(os.devnull, 'w')
+    try:
+        for name in os.listdir(directory):
+            # The host is only used to expand the control path, which
+            # is given explicitly.
+            subprocess.call(["ssh", "-o",
+                             "ControlPath=" + os.path.join(directory, name),
+                             "-O", "exit", "localhost"],
+                            stdout=devnull, stderr=devnull)
+    finally:
+        devnull.close()
+    shutil.rmtree(directory, ignore_errors=True)
+
+class RemoteProcess(object):
+    """A command running on a remote host, whose output is read as it
+    arrives.
+
+    Iterating over the object gives the lines of output, without line
+    endings, and chunks() gives blocks of raw output. When all output
+    has been read, the exit status of the command is in returncode.
+
+    If a timeout is given, the command is killed when it has run for
+    timeout seconds, and TimeoutError is raised when the output ends
+    or wait() is called."""
+
+    def __init__(self, process, timeout=None):
+        self.process = process
+        self.timeout = timeout
+        self.errors = None
+        self.__timed_out = False
+        self.__timer = None
+        self.__kill_timer = None
+        self.__finished = False
+        self.__lock = threading.Lock()
+        if timeout is not None:
+            self.__timer = threading.Timer(timeout, self._expire)
+            self.__timer.daemon = True
+            self.__timer.start()
+
+    @property
+    def returncode(self):
+        return self.process.returncode
+
+    def __iter__(self):
+        for line in iter(self.process.stdout.readline, ''):
+            yield line.rstrip("\n")
+        self.wait()
+
+    def chunks(self, size=65536):
+        """Iterate over the output in blocks of at most size bytes, as
+        they arrive."""
+        fd = self.process.stdout.fileno()
+        while True:
+            chunk = os.read(fd, size)
+            if not chunk:
+                break
+            yield chunk
+        self.wait()
+
+    def cancel(self):
+        """Stop the command.
+
+        If the process leads a process group, as the processes started
+        by Server.ssh_stream() do, the whole group is signalled.
+        SIGTERM is sent first, which sudo passes on to the command it
+        runs as another user, and SIGKILL follows if the process has
+        not exited after CANCEL_GRACE seconds. For a command on
+        another host this ends the ssh session, and the remote command
+        is stopped by SIGPIPE when it next writes output."""
+        self._signal(signal.SIGTERM)
+        with self.__lock:
+            if self.__kill_timer is None and not self.__finished:
+                self.__kill_timer = threading.Timer(
+                    CANCEL_GRACE, self._signal, [signal.SIGKILL])
+                self.__kill_timer.daemon = True
+                self.__kill_timer.start()
+
+    def _signal(self, signum):
+        if self.process.returncode is not None:
+            return              # Already reaped
+        pid = self.process.pid
+        try:
+            if os.getpgid(pid) == pid:
+                os.killpg(pid, signum)
+            else:
+                os.kill(pid, signum)
+        except OSError:
+            pass            # Already finished
+
+    def wait(self, size=65536):
+        """Wait for the command to finish and return the exit status.
+        Output that has not been read is discarded, reading at most
+        size bytes at a time. If the standard error is a separate
+        pipe, it is collected in errors."""
+        stdout, stderr = self.process.stdout, self.process.stderr
+        if stdout is not None and not stdout.closed:
+            fd = stdout.fileno()
+            while os.read(fd, size):
+                pass
+            stdout.close()
+        if stderr is not None and not stderr.closed:
+            self.errors = stderr.read()
+            stderr.close()
+        self.process.wait()
+        with self.__lock:
+            self.__finished = True
+            timers = [timer for timer in (self.__timer, self.__kill_timer)
+                      if timer is not None]
+        for timer in timers:
+            timer.cancel()
+            timer.join()
+        if self.__timed_out:
+            raise exception.TimeoutError, \
+                "command did not finish within %s seconds" % (self.timeout)
+        return self.process.returncode
+
+    def _expire(self):
+        self.__timed_out = True
+        self.cancel()
@@ -1,4 +1,4 @@
-import MySQLdb, ConfigParser
+from .exception import NoOptionError, ConfigParsingError
 
 class Role(object):
     """Base class for representing a server role.
@@ -23,7 +23,7 @@ class Role(object):
         what the configuration file says."""
         try:
             server.server_id = config.get('server-id')
-        except ConfigParser.NoOptionError:
+        except NoOptionError:
             config.set('server-id', server.server_id)
 
         
@@ -34,40 +34,32 @@ class Role(object):
         The replication user will then be set as an attribute of the
         server so that it is available for slaves connecting to the
         server."""
-        try:
-            server.sql("DROP USER %s", (user.name))
-            server.sql("CREATE USER %s IDENTIFIED BY %s",
-                       (user.name, user.passwd))
-        except MySQLdb.OperationalError:
-            pass                # It is OK if this one fails
-        finally:
-            server.sql("GRANT REPLICATION SLAVE ON *.* TO %s",
-                       (user.name))
-
-    def _enable_binlog(self, server):
+        batch = server.sql_batch(
+            [("DROP USER %s", (user.name)),
+             ("CREATE USER %s IDENTIFIED BY %s", (user.name, user.passwd)),
+             ("GRANT REPLICATION SLAVE ON *.* TO %s", (user.name))],
+            stop_on_error=False)
+        # It is OK if dropping or creating the user fails
+        if batch[-1].error:
+            raise batch[-1].error
+
+    def _enable_binlog(self, server, config):
         """Enable the binlog by setting the value of the log-bin
-        option and log-bin-index. The values of these options will
-        only be set if there were no value previously set for log-bin;
-        if log-bin is already set, it is assumed that it is correctly
-        set and information is fetched."""
-        config = server.fetch_config()
+        option and log-bin-index in the configuration. The values of
+        these options will only be set if there were no value
+        previously set for log-bin; if log-bin is already set, it is
+        assumed that it is correctly set."""
         try:
             config.get('log-bin')
-        except ConfigParser.NoOptionError:
+        except NoOptionError:
             config.set('log-bin', server.name + '-bin')
             config.set('log-bin-index', server.name + '-bin.index')
-            server.replace_config(config)
 
-    def _disable_binlog(self, server):
+    def _disable_binlog(self, server, config):
         """Disable the binary log by removing the log-bin option and
-        the log-bin-index option."""
-        config = server.fetch_config()
-        try:
-            config.remove('log-bin')
-            config.remove('log-bin-index')
-            server.replace_config(config)
-        except ConfigParser.NoOptionError:
-            pass
+        the log-bin-index option from the configuration."""
+        config.remove('log-bin')
+        config.remove('log-bin-index')
 
     def imbue(self, server):
         pass
@@ -112,13 +104,12 @@ class Master(Role):
         try:
             config = server.fetch_config()
             self._set_server_id(server, config)
-            self._enable_binlog(server)
-
+            self._enable_binlog(server, config)
 
             # Put the new configuration file in place
             server.stop().replace_config(config)
 
-        except ConfigParser.ParsingError:
+        except ConfigParsingError:
             pass                # Didn't manage to update config file
         except IOError:
             pass
@@ -142,37 +133,116 @@ class Final(Role):
         # Fetch and update the configuration file
         config = server.fetch_config()
         self._set_server_id(server, config)
-        self._disable_binlog(server)
+        self._disable_binlog(server, config)
 
         # Put the new configuration in place
         server.stop().replace_config(config).start()
 
         server.repl_user = self.__master.repl_user
 
+_CONVERTIBLE_TABLES = """SELECT TABLE_SCHEMA, TABLE_NAME,
+       IFNULL(DATA_LENGTH, 0) + IFNULL(INDEX_LENGTH, 0) AS size
+  FROM information_schema.TABLES
+ WHERE TABLE_TYPE = 'BASE TABLE'
+   AND TABLE_SCHEMA NOT IN ('information_schema', 'mysql',
+                            'performance_schema')
+   AND ENGINE <> 'BLACKHOLE'
+ ORDER BY size DESC"""
+
+def _quote(name):
+    return "`" + name.replace("`", "``") + "`"
+
 class Relay(Role):
     """A relay server is a server whose sole purpose is to forward
     events from the binary log to slaves that are able to answer
     queries.  The server has a binary log and also writes events
     executed by the slave thread to the binary log.  Since it is not
     necessary to be able to answer queries, all tables use the
-    BLACKHOLE engine."""
-
-    def __init__(self, master):
-        pass
+    BLACKHOLE engine.
+
+    The tables are converted by worker threads, each using its own
+    connection from the pool of the server, with the largest tables
+    first so that no worker is left with a big table at the end.
+    Tables smaller than small_table bytes are converted batch_size at
+    a time. Tables that already use the BLACKHOLE engine are skipped,
+    so an interrupted conversion continues where it stopped when the
+    role is imbued again.
+
+    If progress is given, it is called as progress(server, done,
+    total) from the worker threads each time tables are converted."""
+
+    def __init__(self, master, workers=4, progress=None,
+                 small_table=1 << 20, batch_size=100):
+        self.workers = workers
+        self.progress = progress
+        self.small_table = small_table
+        self.batch_size = batch_size
 
     def imbue(self, server):
         config = server.fetch_config()
         self._set_server_id(server, config)
-        self._enable_binlog(server)
+        self._enable_binlog(server, config)
         config.set('log-slave-updates')
         server.stop().replace_config(config).start()
-        server.sql("SET SQL_LOG_BIN = 0")
-        for row in server.sql("SHOW DATABASES"):
-            db = row["Database"]
-            if db in ('information_schema', 'mysql'):
-                continue
-            for table in server.sql("SHOW TABLES FROM %s" % (db)):
-                server.sql("ALTER TABLE %s.%s ENGINE=BLACKHOLE" %
-                           (db, table["Tables_in_" + db]))
-        server.sql("SET SQL_LOG_BIN = 1")
-        
+        self._convert_tables(server)
+
+    def _convert_tables(self, server):
+        """Convert all tables of the server to the BLACKHOLE engine."""
+        import Queue, threading
+        from .parallel import Executor
+
+        work = Queue.Queue()
+        small = []
+        total = 0
+        for db, table, size in server.sql(_CONVERTIBLE_TABLES, stream=True,
+                                          tuples=True):
+            alter = "ALTER TABLE %s.%s ENGINE=BLACKHOLE" % (_quote(db),
+                                                            _quote(table))
+            total += 1
+            if size >= self.small_table:
+                work.put([alter])
+            else:
+                small.append(alter)
+                if len(small) == self.batch_size:
+                    work.put(small)
+                    small = []
+        if small:
+            work.put(small)
+
+        lock = threading.Lock()
+        state = {'done': 0, 'failed': False}
+
+        def _worker():
+            # Each worker thread has its own connection, so the binary
+            # log is disabled for each of them.
+            server.sql("SET SQL_LOG_BIN = 0")
+            try:
+                while not state['failed']:
+                    try:
+                        batch = work.get_nowait()
+                    except Queue.Empty:
+                        return
+                    try:
+                        server.sql_batch(batch).raise_errors()
+                    except:
+                        state['failed'] = True
+                        raise
+                    with lock:
+                        state['done'] += len(batch)
+                        done = state['done']
+                    if self.progress:
+                        self.progress(server, done, total)
+            finally:
+                server.sql("SET SQL_LOG_BIN = 1")
+                server.disconnect()
+
+        executor = Executor(self.workers)
+        try:
+            futures = [executor.submit(_worker)
+                       for i in xrange(min(self.workers, work.qsize()))]
+            for future in futures:
+                future.exception()
+            for future in futures:
+                future.result()
+        finally:
+            executor.shutdown(wait=False)
@@ -0,0 +1,286 @@
+# Copyright (c) 2010, Mats Kindahl, Charles Bell, and Lars Thalmann
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials
+#       provided with the distribution.
+#
+#     * Neither the name of Sun Microsystems nor the names of its
+#       contributors may be used to endorse or promote products
+#       derived from this software without specific prior written
+#       permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL SUN
+# MICROSYSTEMS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+"""
+Module for restarting many servers without losing read capacity.
+"""
+
+import MySQLdb
+import Queue
+import sys
+import time
+
+from . import commands, common, exception, parallel
+
+# Seconds a restarted slave has by default to catch up with its master
+CATCH_UP_TIMEOUT = 3600
+
+class RollingRestart(object):
+    """The outcome of a rolling restart.
+
+    results is a Results object with the outcome for each server that
+    was restarted, timings holds the time in seconds spent in each
+    phase for each server as a list of (phase, seconds) pairs,
+    skipped lists the servers that were not restarted because an
+    earlier restart failed, and discovery and elapsed are the time
+    spent discovering the replication topology and the total time of
+    the restart."""
+
+    def __init__(self, servers):
+        self.results = parallel.Results(servers)
+        self.timings = {}
+        self.skipped = []
+        self.discovery = None
+        self.elapsed = None
+
+    @property
+    def errors(self):
+        return self.results.errors
+
+def _master_address(server):
+    """Return the (host, port) of the master of the server, or None if
+    the server is not a slave."""
+    for row in server.sql("SHOW SLAVE STATUS"):
+        return (row["Master_Host"], int(row["Master_Port"]))
+    return None
+
+def _wait_for_catch_up(slave, master, timeout, min_interval=0.1,
+                       max_interval=5.0):
+    """Wait until the slave has executed everything the master had
+    written to its binary log when the wait started. If the master is
+    not known, wait until the slave reports no lag instead.
+
+    SlaveNotRunningError is raised if a replication thread of the
+    slave is not running, since the slave then does not catch up. A
+    server that cannot be connected to yet is assumed to be starting
+    and is polled again."""
+    deadline = timeout is not None and time.time() + timeout
+    interval = min_interval
+    target = None
+    while True:
+        try:
+            status = slave.sql("SHOW SLAVE STATUS")
+            running = (status["Slave_IO_Running"],
+                       status["Slave_SQL_Running"])
+        except exception.EmptyRowError:
+            raise exception.NotSlaveError
+        except MySQLdb.OperationalError:
+            # The server may still be starting, so try again
+            slave.disconnect()
+            status = None
+        if status is not None:
+            if "No" in running:
+                raise exception.SlaveNotRunningError, \
+                    "%s: Slave_IO_Running is %s and Slave_SQL_Running " \
+                    "is %s" % ((slave.name,) + running)
+            if master is None:
+                if status["Seconds_Behind_Master"] == 0:
+                    return
+            else:
+                if target is None:
+                    target = commands.fetch_master_pos(master)
+                position = common.Position(status["Relay_Master_Log_File"],
+                                           status["Exec_Master_Log_Pos"])
+                if position >= target:
+                    return
+        if deadline is not False and time.time() + interval > deadline:
+            raise exception.TimeoutError, \
+                "%s did not catch up within %s seconds" % (slave.name, timeout)
+        time.sleep(interval)
+        interval = min(interval * 2, max_interval)
+
+def _restart(server, master, action, catch_up_timeout, timings):
+    """Restart a server, recording the time of each phase. The master
+    is False for servers that are not slaves.
+
+    If the action or the start fails after the server was stopped,
+    the server is started again and the error is raised. If that
+    start fails as well, ServerDownError is raised instead."""
+    phases = timings[server] = []
+    try:
+        start = time.time()
+        server.stop()
+        phases.append(("stop", time.time() - start))
+        try:
+            if action is not None:
+                start = time.time()
+                action(server)
+                phases.append(("action", time.time() - start))
+            start = time.time()
+            server.start()
+            phases.append(("start", time.time() - start))
+        except Exception, error:
+            exc_info = sys.exc_info()
+            try:
+                server.start()
+            except Exception, start_error:
+                raise exception.ServerDownError, \
+                    "%s is down: %s, and starting it again failed: %s" % (
+                    server.name, error, start_error)
+            raise exc_info[0], exc_info[1], exc_info[2]
+        if master is not False:
+            start = time.time()
+            _wait_for_catch_up(server, master, catch_up_timeout)
+            phases.append(("catch_up", time.time() - start))
+    finally:
+        server.disconnect()
+
+def rolling_restart(servers, masters=(), max_in_flight=4, per_master=1,
+                    action=None, catch_up_timeout=CATCH_UP_TIMEOUT,
+                    stop_on_error=True):
+    """Restart a set of servers, a few at a time.
+
+    The replication topology is first discovered by asking each
+    server for its slave status. Then the servers are restarted,
+    with at most max_in_flight servers down at the same time and at
+    most per_master slaves of the same master down at the same time,
+    so that each master keeps most of its read capacity. Servers that
+    are not slaves are restarted last, one at a time and only when no
+    other server is down, since their slaves are affected as well.
+
+    For each server, the phases are:
+
+    stop
+
+       The server is stopped.
+
+    action
+
+       If an action is given, it is called with the server while the
+       server is stopped, for example to replace the configuration.
+
+    start
+
+       The server is started.
+
+    catch_up
+
+       For a slave, the position of the master is fetched and the
+       slot is not released until the slave has executed up to that
+       position. The master is looked up by host and port among the
+       servers and masters given. If it is not found, the slave is
+       instead waited on until it reports no lag. If the slave has
+       not caught up within catch_up_timeout seconds, it fails with
+       TimeoutError, and a catch_up_timeout of None waits without
+       limit. If a replication thread of the slave is not running, it
+       fails with SlaveNotRunningError.
+
+    If the action or the start fails, the server is started again
+    before the error is reported, or ServerDownError is reported if
+    the server could not be started.
+
+    If a restart fails and stop_on_error is true, no more restarts are
+    started, and the servers that remain are listed as skipped.
+
+    The function returns a RollingRestart object with the outcome and
+    the timings."""
+    if max_in_flight < 1 or per_master < 1:
+        raise ValueError, "at least one server has to be restarted at a time"
+    started = time.time()
+    servers = list(servers)
+    result = RollingRestart(servers)
+    known = dict(((server.host, server.port), server)
+                 for server in list(masters) + servers)
+
+    discovered = parallel.run_on_servers(servers, _master_address)
+    result.results.errors.update(discovered.errors)
+    result.discovery = time.time() - started
+
+    # Slaves of each master are interleaved with the slaves of other
+    # masters, so that several masters are worked on at the same time.
+    groups = {}
+    others = []
+    for server, address in discovered.items():
+        if address is None:
+            others.append(server)
+        else:
+            groups.setdefault(address, []).append(server)
+    pending = []
+    while groups:
+        for address in sorted(groups):
+            pending.append((groups[address].pop(0), address))
+            if not groups[address]:
+                del groups[address]
+    pending += [(server, None) for server in others]
+
+    executor = parallel.Executor(max_in_flight)
+    finished = Queue.Queue()
+    in_flight = {}              # Group -> number of servers down
+    total = 0
+    failed = False
+    try:
+        while pending or total:
+            # Start as many restarts as the limits allow
+            index = 0
+            while not failed and index < len(pending) \
+                    and total < max_in_flight:
+                server, address = pending[index]
+                if address is None:
+                    allowed = total == 0
+                else:
+                    allowed = in_flight.get(address, 0) < per_master
+                if not allowed:
+                    index += 1
+                    continue
+                del pending[index]
+                if address is None:
+                    master = False
+                else:
+                    master = known.get(address)
+                future = executor.submit(_restart, server, master, action,
+                                         catch_up_timeout, result.timings)
+                future.add_done_callback(
+                    lambda future, server=server, address=address:
+                        finished.put((server, address, future)))
+                in_flight[address] = in_flight.get(address, 0) + 1
+                total += 1
+                if address is None:
+                    break
+            if failed and not total:
+                break
+
+            # Waiting without timeout cannot be interrupted
+            server, address, future = finished.get(True, sys.maxint)
+            in_flight[address] -= 1
+            total -= 1
+            error = future.exception()
+            if error is None:
+                result.results.results[server] = None
+            else:
+                result.results.errors[server] = error
+                failed = failed or stop_on_error
+    finally:
+        executor.shutdown(wait=False)
+    result.skipped = [left for left, group in pending]
+    result.elapsed = time.time() - started
+    return result
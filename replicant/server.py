@@ -35,11 +35,32 @@
 Module holding server definitions
 """
 
-from . import configfile, roles
+from . import configfile, roles, pool, remote
+from .instrument import instrumented
 
 import MySQLdb
+import os
+import re
+import threading
 import warnings
 
+# Client errors meaning that the connection to the server is lost
+_CONNECTION_LOST = (2006, 2013)
+
+# Statements changing the session of a connection beyond the current
+# transaction, after which the connection is not returned to the pool.
+_SESSION_CRE = re.compile(r'\s*(?:SET|USE|LOCK|FLUSH\s+TABLES?\s+WITH|'
+                          r'CREATE\s+TEMPORARY)\b', re.IGNORECASE)
+
+def _interpolate(conn, command, args):
+    """Substitute the arguments into a statement the way
+    cursor.execute() does. Each argument is quoted on its own, since
+    literal() of a sequence gives a single string in mysqlclient."""
+    if isinstance(args, dict):
+        return command % dict((key, conn.literal(value))
+                              for key, value in args.items())
+    return command % tuple(conn.literal(arg) for arg in args)
+
 class Server(object):
     """A representation of a MySQL server.
 
@@ -50,41 +71,130 @@ class Server(object):
     class Row(object):
         """Class to represent a row (iterator) returned when executing
         an SQL statement. For statements that return a single row, the
-        object can be treated as a row as well."""
-        def __init__(self, cursor):
+        object can be treated as a row as well.
+
+        If the rows are streamed from the server, the connection is
+        returned to the pool when the last row is read or the object
+        is closed, which the with statement does on leaving the block:
+
+        with server.sql("SELECT * FROM t1", stream=True) as rows:
+            for row in rows:
+                ...
+
+        Treating a streamed result as a single row, by indexing it or
+        converting it to a string, reads no further rows and returns
+        the connection at once, so iterating over it afterwards only
+        gives the first row."""
+        def __init__(self, cursor, done=None):
             self.__cursor = cursor
-            self.__row = cursor.fetchone()
+            self.__done = done
+            self.__row = self._fetch()
 
         def __iter__(self):
             return self
 
+        def __enter__(self):
+            return self
+
+        def __exit__(self, exc_type, exc_value, traceback):
+            self.close()
+
+        def __del__(self):
+            # The unread rows are not read here, so the connection is
+            # closed rather than returned to the pool.
+            self._finish(True)
+
         def next(self):
             row = self.__row
             if row is None:
                 raise StopIteration
             else:
-                self.__row = self.__cursor.fetchone()
+                self.__row = self._fetch()
                 return row
         
         def __getitem__(self, key):
             from . import EmptyRowError
             if self.__row is not None:
+                self._finish(False)
                 return self.__row[key]
             else:
                 raise EmptyRowError
 
         def __str__(self):
-            if len(self.__row) == 1:
-                return str(self.__row.values()[0])
+            from . import EmptyRowError
+            if self.__row is not None and len(self.__row) == 1:
+                self._finish(False)
+                if isinstance(self.__row, dict):
+                    return str(self.__row.values()[0])
+                return str(self.__row[0])
             else:
                 raise EmptyRowError
+
+        def close(self):
+            """Stop reading rows. Rows that have not been read are
+            skipped."""
+            self.__row = None
+            self._finish(False)
+
+        def _fetch(self):
+            if self.__cursor is None:
+                return None
+            try:
+                row = self.__cursor.fetchone()
+            except:
+                self._finish(True)
+                raise
+            if row is None:
+                self._finish(False)
+            return row
+
+        def _finish(self, broken):
+            """Stop reading a streamed result and return or, if it is
+            broken, discard the connection. Nothing is done for a
+            result that is not streamed."""
+            done, self.__done = self.__done, None
+            if done is not None:
+                if not broken:
+                    self.__cursor.close()
+                self.__cursor = None
+                done(broken)
     
+    class Outcome(object):
+        """The outcome of executing one statement of a batch.
+
+        If the statement was executed, rowcount is the number of rows
+        affected or returned and rows holds the rows of the result,
+        if any. If the statement failed, error holds the exception."""
+        def __init__(self, statement):
+            self.statement = statement
+            self.executed = False
+            self.rowcount = None
+            self.rows = None
+            self.error = None
+
+    class Batch(list):
+        """The outcomes of a batch of statements, in statement
+        order."""
+
+        @property
+        def errors(self):
+            return [outcome for outcome in self if outcome.error]
+
+        def raise_errors(self):
+            """Raise the error of the first statement that failed, if
+            any."""
+            for outcome in self:
+                if outcome.error:
+                    raise outcome.error
+            return self
+
     def __init__(self, name, sql_user, ssh_user, machine,
                  config_manager=configfile.ConfigManagerFile(),
                  role=roles.Vagabond(), 
                  server_id=None, host='localhost', port=3306,
                  socket='/tmp/mysqld.sock', defaults_file=None,
-                 config_section='mysqld'):
+                 config_section='mysqld', min_connections=0,
+                 max_connections=8, idle_timeout=300, pool_timeout=60):
         """Initialize the server object with data.
 
         If a configuration file path is provided, it will be used to
@@ -139,6 +249,16 @@ class Server(object):
            fetched from the configuration file. If the configuration
            files does not contain a server ID, no server ID is
            assigned.
+
+        min_connections, max_connections, idle_timeout
+
+           Connections to the server are kept in a connection pool
+           shared by all threads using the server object. The pool
+           keeps min_connections open even when idle, opens at most
+           max_connections, and closes other connections that have
+           been idle for idle_timeout seconds. A thread waits at most
+           pool_timeout seconds for a connection when all of them are
+           in use, after which PoolExhaustedError is raised.
         """
 
         if not defaults_file:
@@ -161,25 +281,67 @@ class Server(object):
 
         self.__machine = machine
         self.__config_manager = config_manager
-        self.__conn = None
+        self.__pool = pool.ConnectionPool(self._new_connection,
+                                          min_connections, max_connections,
+                                          idle_timeout, timeout=pool_timeout)
+        self.__local = threading.local()
         self.__config = None
         self.__tmpfile = None
 
         self.__role = role
         self.imbue(role)
             
-    def _connect(self, db=''):
+    def _new_connection(self):
+        """Open a new connection to the server."""
+        return MySQLdb.connect(host=self.host, port=self.port,
+                               unix_socket=self.socket,
+                               user=self.sql_user.name,
+                               passwd=self.sql_user.passwd)
+
+    def _connect(self, db='', commands=()):
         """Method to connect to the server, preparing for execution of
-        SQL statements.  If a connection is already established, this
-        function does nothing."""
-        if not self.__conn:
-            self.__conn = MySQLdb.connect(host=self.host, port=self.port,
-                                          unix_socket=self.socket, db=db,
-                                          user=self.sql_user.name,
-                                          passwd=self.sql_user.passwd)
-        elif db:
-            self.__conn.select_db(db)
+        SQL statements.
+
+        Each thread checks out its own connection from the connection
+        pool and keeps it, and the session state that goes with it,
+        until it calls disconnect(). If the thread already has a
+        connection, this function only changes the database. If one
+        of the commands about to be executed changes the session, the
+        connection is marked so that it is not reused by others."""
+        lease = getattr(self.__local, 'lease', None)
+        if lease is None:
+            lease = pool.Lease(self.__pool, self.__pool.checkout())
+            self.__local.lease = lease
+        if db:
+            lease.conn.select_db(db)
+            lease.dirty = True
+        for command in commands:
+            if _SESSION_CRE.match(command):
+                lease.dirty = True
+        return lease.conn
+
+    def _lost(self):
+        """Discard the connection of the calling thread after the
+        connection to the server was lost."""
+        lease, self.__local.lease = self.__local.lease, None
+        self.__pool.discard(lease.take())
+
+    def _release(self, conn, dirty):
+        """Return a connection to the pool after rolling back the open
+        transaction, if any. There is no way to reset the session of a
+        connection short of reconnecting, so a connection whose
+        session was changed is closed instead."""
+        if not dirty:
+            try:
+                conn.rollback()
+            except MySQLdb.Error:
+                dirty = True
+        if dirty:
+            self.__pool.discard(conn)
+        else:
+            self.__pool.release(conn)
                                       
+    @instrumented("imbue")
     def imbue(self, role):
         """Imbue a server with a new role."""
         self.__role.unimbue(self)
@@ -187,11 +349,41 @@ class Server(object):
         self.__role.imbue(self)
         
     def disconnect(self):
-        """Method to disconnect from the server."""
-        self.__conn = None
+        """Method to disconnect from the server.
+
+        The connection of the calling thread is returned to the
+        connection pool so that it can be reused without connecting
+        again. Any open transaction is rolled back. If a database was
+        selected or the session was changed, for example by setting
+        a session variable or locking tables, the connection is
+        closed instead.
+
+        A thread that ends without calling disconnect() does not
+        leak its connection, since it is discarded when the data of
+        the thread is cleared."""
+        lease = getattr(self.__local, 'lease', None)
+        if lease is not None:
+            self.__local.lease = None
+            self._release(lease.take(), lease.dirty)
         return self
+
+    @property
+    def pool(self):
+        """The connection pool of the server."""
+        return self.__pool
                                       
-    def sql(self, command, args=None, db=''):
+    _CURSOR_CLASS = {
+        (False, False): MySQLdb.cursors.DictCursor,
+        (False, True): MySQLdb.cursors.Cursor,
+        (True, False): MySQLdb.cursors.SSDictCursor,
+        (True, True): MySQLdb.cursors.SSCursor,
+        }
+
+    # The size reported for sql is the length of the statement only;
+    # the rows returned are not measured since a streamed result is
+    # still unread when the hooks run.
+    @instrumented("sql", lambda result, command, *args, **kwargs: len(command))
+    def sql(self, command, args=None, db='', stream=False, tuples=False):
         """Execute a SQL command on the server. This first requires a
         connection to the server.
 
@@ -200,15 +392,177 @@ class Server(object):
         used in the following way:
 
         for db in server.sql("SHOW DATABASES")
-            print db["Database"]"""
-
-        self._connect(db)
-        c = self.__conn.cursor(MySQLdb.cursors.DictCursor)
+            print db["Database"]
+
+        Rows are dictionaries keyed by column name, unless tuples is
+        true, in which case they are tuples. Normally the entire
+        result is read before the function returns. If stream is true,
+        rows are instead read from the server as they are iterated
+        over, so that large results are handled in constant memory.
+        Since the connection is busy until the last row has been read,
+        a streamed statement is executed on a separate connection
+        from the pool, which is returned to the pool when the last
+        row is read or the result is closed. This means that session
+        variables set on the connection of the thread do not apply
+        to streamed statements."""
+
+        if stream:
+            conn = self.__pool.checkout()
+            dirty = bool(db) or bool(_SESSION_CRE.match(command))
+            try:
+                if db:
+                    conn.select_db(db)
+            except:
+                self.__pool.discard(conn)
+                raise
+        else:
+            conn = self._connect(db, [command])
+        c = conn.cursor(Server._CURSOR_CLASS[stream, tuples])
         with warnings.catch_warnings(record=True) as w:
-            c.execute(command, args)
+            try:
+                c.execute(command, args)
+            except MySQLdb.OperationalError, error:
+                if error.args and error.args[0] in _CONNECTION_LOST:
+                    if stream:
+                        self.__pool.discard(conn)
+                    else:
+                        self._lost()
+                elif stream:
+                    self._release(conn, dirty)
+                raise
+            except:
+                if stream:
+                    self._release(conn, dirty)
+                raise
             self.__warnings = w
+        if stream:
+            return Server.Row(c, self._stream_done(conn, dirty))
         return Server.Row(c)
 
+    def _stream_done(self, conn, dirty):
+        def _done(broken):
+            if broken:
+                self.__pool.discard(conn)
+            else:
+                self._release(conn, dirty)
+        return _done
+
+    @instrumented("sql_batch", lambda result, *args, **kwargs:
+                  sum(len(outcome.statement) for outcome in result))
+    def sql_batch(self, statements, db='', batch_size=100,
+                  stop_on_error=True):
+        """Execute a list of SQL statements on the server using as
+        few round trips as possible.
+
+        Each statement is either a string or a (command, args) tuple,
+        where the arguments are escaped and substituted in the same
+        way as for sql(). The statements are sent batch_size at a time
+        as a single multi-statement query, so statements must not
+        contain semicolons outside of quoted strings.
+
+        The function returns a Server.Batch with one Server.Outcome
+        for each statement. When a statement fails, the server skips
+        the rest of its batch. If stop_on_error is true, no more
+        statements are executed, otherwise execution continues with
+        the statement after the one that failed:
+
+        batch = server.sql_batch(["ALTER TABLE %s ENGINE=BLACKHOLE" % t
+                                  for t in tables])
+        batch.raise_errors()"""
+        statements = [(statement, None)
+                      if isinstance(statement, basestring) else statement
+                      for statement in statements]
+        conn = self._connect(db, [command for command, args in statements])
+        batch = Server.Batch()
+        for command, args in statements:
+            if args is not None:
+                command = _interpolate(conn, command, args)
+            batch.append(Server.Outcome(command))
+
+        start = 0
+        with warnings.catch_warnings(record=True) as w:
+            while start < len(batch):
+                end = min(start + batch_size, len(batch))
+                failed = self._execute_batch(conn, batch[start:end])
+                if failed is None:
+                    start = end
+                elif stop_on_error:
+                    break
+                else:
+                    start += failed + 1
+            self.__warnings = w
+        return batch
+
+    def _execute_batch(self, conn, outcomes):
+        """Send the statements of the outcomes as one query and record
+        the result of each. Returns the index of the statement that
+        failed, or None if all succeeded."""
+        c = conn.cursor(MySQLdb.cursors.DictCursor)
+        index = 0
+        try:
+            c.execute(";\n".join(o.statement for o in outcomes))
+            while True:
+                outcome = outcomes[index]
+                outcome.executed = True
+                outcome.rowcount = c.rowcount
+                if c.description:
+                    outcome.rows = list(c.fetchall())
+                index += 1
+                if not c.nextset():
+                    return None
+        except MySQLdb.Error, error:
+            if error.args and error.args[0] in _CONNECTION_LOST:
+                self._lost()
+                raise
+            outcomes[index].error = error
+            return index
+        finally:
+            c.close()
+
+    @instrumented("sql_many")
+    def sql_many(self, command, args_list, db=''):
+        """Execute a parameterised SQL statement once for each tuple
+        of arguments and return the number of affected rows.
+
+        For INSERT statements, the rows are sent as one multi-row
+        INSERT, so inserting many rows takes a single round trip."""
+        conn = self._connect(db, [command])
+        c = conn.cursor()
+        with warnings.catch_warnings(record=True) as w:
+            try:
+                return c.executemany(command, args_list)
+            except MySQLdb.OperationalError, error:
+                if error.args and error.args[0] in _CONNECTION_LOST:
+                    self._lost()
+                raise
+            finally:
+                self.__warnings = w
+                c.close()
+
+    def _ssh_process(self, command, stdout=None, stderr=None, group=False):
+        """Start a shell command on the server, returning the process.
+        Unless other files are given, stdout and stderr are both
+        connected to a pipe.
+
+        The remote ssh is not put in the background (-f), since the
+        process then exits before the command has finished. If group
+        is true, the process is started in a process group of its
+        own, so that RemoteProcess.cancel() also reaches the command
+        run by sudo. Otherwise it stays in the foreground group, so
+        that sudo or ssh can prompt for a password on the terminal."""
+        from subprocess import Popen, PIPE, STDOUT
+
+        if stdout is None:
+            stdout, stderr = PIPE, STDOUT
+        if self.host == "localhost":
+            cmd = ["sudo", "-u" + self.ssh_user.name] + command
+        else:
+            cmd = remote.ssh_command(self.ssh_user.name, self.host,
+                                     ' '.join(command), ["-nqTx"])
+        return Popen(cmd, stdout=stdout, stderr=stderr,
+                     preexec_fn=group and os.setpgrp or None)
+
+    @instrumented("ssh", lambda result, command: len("\n".join(result)))
     def ssh(self, command):
         """Execute a shell command on the server.
 
@@ -222,29 +576,96 @@ class Server(object):
 
         For remote commands we do not allow X11 forwarding, and the
         stdin will be redirected to /dev/null."""
-        from subprocess import Popen, PIPE, STDOUT
-
-        if self.host == "localhost":
-            cmd = ["sudo", "-u" + self.ssh_user.name] + command
-            process = Popen(cmd, stdout=PIPE, stderr=STDOUT)
-        else:
-            fullname = self.ssh_user.name + "@" + self.host
-            process = Popen(["ssh", "-fqTx", fullname, ' '.join(command)],
-                            stdout=PIPE, stderr=STDOUT)
-        output = process.communicate()[0]
+        output = self._ssh_process(command).communicate()[0]
         return output.split("\n")
 
+    def ssh_stream(self, command, timeout=None, output=None):
+        """Start a shell command on the server and return a
+        RemoteProcess for reading the output as it arrives.
+
+        Iterating over the process gives the lines of output, and
+        chunks() gives blocks of raw output, so the output is never
+        held in memory at once:
+
+        for line in server.ssh_stream(["du", "-a", datadir]):
+            print line
+
+        If output is a file object, the standard output of the
+        command is written directly to it, and the standard error is
+        collected in the errors attribute of the process. Use this to
+        pipe the output into a local file or the stdin of another
+        process, and call wait() to wait for the command to finish.
+
+        If a timeout is given, the command is killed after timeout
+        seconds and TimeoutError is raised. The command can also be
+        stopped with cancel()."""
+        from subprocess import PIPE
+        if output is None:
+            process = self._ssh_process(command, group=True)
+        else:
+            process = self._ssh_process(command, output, PIPE, group=True)
+        return remote.RemoteProcess(process, timeout)
+
+    def sql_async(self, command, args=None, db=''):
+        """Execute a SQL command on the server without waiting for it
+        to finish.
+
+        The statement is executed by a thread of the shared executor,
+        and a Future is returned, whose result is the rows of the
+        result as returned by sql(). Any number of statements, on the
+        same or on different servers, can be in progress at the same
+        time:
+
+        futures = [server.sql_async("SHOW SLAVE STATUS")
+                   for server in servers]
+        for future in as_completed(futures):
+            print future.result()["Seconds_Behind_Master"]
+
+        The executor threads are shared by all servers, so the
+        connection is returned to the pool as soon as the statement
+        has executed. The rows are read in full before that, so
+        results cannot be streamed, and session state does not carry
+        over from one call to the next."""
+        from .parallel import default_executor
+        return default_executor().submit(self._sql_and_release,
+                                         command, args, db)
+
+    def _sql_and_release(self, command, args, db):
+        # The result has to be buffered, since the connection is
+        # released before the rows are read.
+        try:
+            return self.sql(command, args, db, stream=False)
+        finally:
+            self.disconnect()
+
+    def ssh_async(self, command):
+        """Execute a shell command on the server without waiting for
+        it to finish.
+
+        A Future is returned, whose result is the lines of output as
+        returned by ssh(). The command is started by a thread of the
+        shared executor, which reads the output while the command
+        runs, so no more commands run at the same time than there are
+        executor threads, and a command never blocks on a full pipe
+        while waiting for a thread."""
+        from .parallel import default_executor
+        return default_executor().submit(self.ssh, command)
+
+    @instrumented("fetch_config")
     def fetch_config(self, path=None):
         return self.__config_manager.fetch_config(self, path)
 
+    @instrumented("replace_config")
     def replace_config(self, config, path=None):
         self.__config_manager.replace_config(self, config, path)
         return self
 
+    @instrumented("stop")
     def stop(self):
         self.__machine.stop_server(self)
         return self
 
+    @instrumented("start")
     def start(self):
         self.__machine.start_server(self)
         return self
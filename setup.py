@@ -47,6 +47,9 @@ class TestCommand(distutils.core.Command):
 
         import tests.config, tests.basic, tests.server, tests.roles
         import tests.commands, tests.backup, tests.binlog_reader
+        import tests.pool, tests.parallel, tests.instrument, tests.remote
+        import tests.rolling, tests.slave_status, tests.failover
+        import tests.batch, tests.stream, tests.relay
 
         suite = unittest.TestSuite()
         suite.addTest(tests.config.suite())
@@ -56,6 +59,16 @@ class TestCommand(distutils.core.Command):
         suite.addTest(tests.commands.suite())
         suite.addTest(tests.backup.suite())
         suite.addTest(tests.binlog_reader.suite())
+        suite.addTest(tests.pool.suite())
+        suite.addTest(tests.parallel.suite())
+        suite.addTest(tests.instrument.suite())
+        suite.addTest(tests.remote.suite())
+        suite.addTest(tests.rolling.suite())
+        suite.addTest(tests.slave_status.suite())
+        suite.addTest(tests.failover.suite())
+        suite.addTest(tests.batch.suite())
+        suite.addTest(tests.stream.suite())
+        suite.addTest(tests.relay.suite())
         runner = unittest.TextTestRunner(verbosity=1)
         runner.run(suite)
 
@@ -0,0 +1,133 @@
+# Copyright (c) 2010, Mats Kindahl, Charles Bell, and Lars Thalmann
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials
+#       provided with the distribution.
+#
+#     * Neither the name of Sun Microsystems nor the names of its
+#       contributors may be used to endorse or promote products
+#       derived from this software without specific prior written
+#       permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL SUN
+# MICROSYSTEMS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+import sys, os.path
+here = os.path.dirname(os.path.abspath(__file__))
+rootpath = os.path.split(here)[0]
+sys.path.append(rootpath)
+
+import unittest
+
+import MySQLdb
+import replicant
+
+from fixtures import Connection, Cursor, Machine
+
+class _Cursor(Cursor):
+    """Cursor stand-in executing multi-statement queries where each
+    statement is either SELECT, which returns one row, or FAIL, which
+    fails."""
+
+    def execute(self, query, args=None):
+        self.results = query.split(";\n")
+        self.conn.log.append(len(self.results))
+        self.nextset()
+
+    def nextset(self):
+        if not self.results:
+            return None
+        statement = self.results.pop(0)
+        if statement.startswith("FAIL"):
+            self.results = []
+            raise MySQLdb.ProgrammingError(1064, statement)
+        if statement.startswith("SELECT"):
+            self.description = (("value",),)
+            self.rows = [{"value": statement[7:]}]
+        else:
+            self.description = None
+            self.rows = []
+        self.rowcount = len(self.rows)
+        return 1
+
+class _Connection(Connection):
+    "Connection stand-in logging the number of statements per query"
+
+    cursor_class = _Cursor
+
+    def __init__(self):
+        Connection.__init__(self)
+        self.log = []
+
+class _BatchServer(replicant.Server):
+    def _new_connection(self):
+        return _Connection()
+
+class TestServerBatch(unittest.TestCase):
+    """Test case for executing batches of statements, using a stand-in
+    for the connection."""
+
+    def setUp(self):
+        self.server = _BatchServer("batch", replicant.User("user"),
+                                   replicant.User("user"), Machine())
+
+    def testOutcomes(self):
+        batch = self.server.sql_batch(["SELECT 1",
+                                       ("SELECT %s", ("two",)),
+                                       "DO 0"])
+        self.assert_(batch.raise_errors() is batch)
+        self.assertEqual([o.statement for o in batch],
+                         ["SELECT 1", "SELECT 'two'", "DO 0"])
+        self.assertEqual([o.rows for o in batch],
+                         [[{"value": "1"}], [{"value": "'two'"}], None])
+        self.assertEqual([o.executed for o in batch], [True] * 3)
+
+    def testArguments(self):
+        batch = self.server.sql_batch(
+            [("CREATE USER %s IDENTIFIED BY %s", ("repl", "xyzzy")),
+             ("SELECT %(name)s", {"name": "one"})])
+        self.assertEqual([o.statement for o in batch],
+                         ["CREATE USER 'repl' IDENTIFIED BY 'xyzzy'",
+                          "SELECT 'one'"])
+
+    def testBatchSize(self):
+        batch = self.server.sql_batch(["DO %d" % i for i in range(250)])
+        self.assertEqual(self.server._connect().log, [100, 100, 50])
+        self.assertEqual(batch.errors, [])
+
+    def testErrors(self):
+        statements = ["DO 1", "FAIL 2", "DO 3", "FAIL 4", "DO 5"]
+        batch = self.server.sql_batch(statements)
+        self.assertEqual([o.executed for o in batch],
+                         [True, False, False, False, False])
+        self.assertEqual(batch.errors, [batch[1]])
+        self.assertRaises(MySQLdb.ProgrammingError, batch.raise_errors)
+        batch = self.server.sql_batch(statements, stop_on_error=False)
+        self.assertEqual([o.executed for o in batch],
+                         [True, False, True, False, True])
+        self.assertEqual(self.server._connect().log, [5, 5, 3, 1])
+
+def suite():
+    return unittest.makeSuite(TestServerBatch, 'test')
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
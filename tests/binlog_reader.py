@@ -42,8 +42,72 @@ sys.path.append(_ROOTPATH)
 
 import unittest
 import glob
+import time
+import tempfile
+import struct
+import zlib
+from StringIO import StringIO
 
 import replicant
+from replicant import binlog
+
+def _post_header_lengths():
+    lengths = [0] * 35
+    for type_code, length in [(binlog.QUERY_EVENT, 13),
+                              (binlog.ROTATE_EVENT, 8),
+                              (binlog.TABLE_MAP_EVENT, 8),
+                              (binlog.WRITE_ROWS_EVENT_V1, 8),
+                              (binlog.UPDATE_ROWS_EVENT_V1, 8),
+                              (binlog.DELETE_ROWS_EVENT_V1, 8),
+                              (binlog.WRITE_ROWS_EVENT, 10),
+                              (binlog.UPDATE_ROWS_EVENT, 10),
+                              (binlog.DELETE_ROWS_EVENT, 10)]:
+        lengths[type_code - 1] = length
+    return ''.join(chr(length) for length in lengths)
+
+class BinlogWriter(object):
+    """
+    Helper class to build binary log files in memory.
+    """
+
+    def __init__(self, server_version, checksum=False, when=1278882445):
+        self.data = [binlog.BINLOG_MAGIC]
+        self.pos = len(binlog.BINLOG_MAGIC)
+        self.when = when
+        body = struct.pack('<H50sIB', 4, server_version, when, 19)
+        body += _post_header_lengths()
+        if checksum:
+            body += chr(1)
+        self.checksum = checksum
+        self.event(binlog.FORMAT_DESCRIPTION_EVENT, body)
+
+    def event(self, type_code, body, server_id=1):
+        """Add an event with the given body and return its position."""
+        start = self.pos
+        size = 19 + len(body) + (4 if self.checksum else 0)
+        header = struct.pack('<IBIIIH', self.when, type_code, server_id,
+                             size, start + size, 0)
+        data = header + body
+        if self.checksum:
+            data += struct.pack('<I', zlib.crc32(data) & 0xffffffff)
+        self.data.append(data)
+        self.pos += size
+        return start
+
+    def query(self, query, db='test', thread_id=5, error_code=0):
+        status = '\x00\x00\x00\x00\x00'
+        body = struct.pack('<IIBHH', thread_id, 0, len(db), error_code,
+                           len(status))
+        return self.event(binlog.QUERY_EVENT,
+                          body + status + db + '\0' + query)
+
+    def stream(self):
+        return StringIO(''.join(self.data))
+
+    def write(self, path):
+        output = open(path, 'wb')
+        output.write(''.join(self.data))
+        output.close()
 
 class TestBinlogReader(unittest.TestCase):
     """
@@ -64,11 +128,623 @@ class TestBinlogReader(unittest.TestCase):
                 self.assertEqual(event.start_pos, current_pos)
                 current_pos = event.end_pos
 
+    def test_event_fields(self):
+        """
+        Test that the header fields of events are stored in the right
+        attributes and that events do not carry an instance dictionary.
+        """
+        istream = open(os.path.join(_HERE, "data/mysqld-bin.000011.txt"))
+        for event in replicant.binlog.read_events(istream):
+            self.assertEqual(event.server_id, 1)
+            self.assertEqual(event.timestamp[:3], (2010, 7, 11))
+            self.assertEqual(time.mktime(event.timestamp), event.when)
+            self.assertFalse(hasattr(event, '__dict__'))
+
+        istream = open(os.path.join(_HERE, "data/mysqld-bin.000012.txt"))
+        xids = [event.xid for event in replicant.binlog.read_events(istream)
+                if isinstance(event, replicant.XidEvent)]
+        self.assertEqual(xids, [43])
+
+    def test_lazy(self):
+        """
+        Test that lazily read events are equal to eagerly read events
+        and that they are not parsed until needed.
+        """
+        for fname in glob.iglob(os.path.join(_HERE, "data/mysqld-bin.*.txt")):
+            events = replicant.binlog.read_events(open(fname))
+            lazy_events = replicant.binlog.read_events(open(fname), lazy=True)
+            for event, lazy_event in zip(events, lazy_events):
+                self.assertEqual(lazy_event.end_pos, event.end_pos)
+                self.assertEqual(lazy_event.event_type, event.event_type)
+                if type(event).__slots__:
+                    self.assertNotEqual(lazy_event._loader, None)
+                self.assertEqual(lazy_event.__getstate__(),
+                                 event.__getstate__())
+                self.assertEqual(lazy_event._loader, None)
+
+    def test_filter(self):
+        """
+        Test that events not matching the filter are skipped.
+        """
+        fname = os.path.join(_HERE, "data/mysqld-bin.000011.txt")
+        events = list(replicant.binlog.read_events(open(fname)))
+        for event_filter, pred in [
+            (replicant.EventFilter(event_types=["Query"]),
+             lambda event: event.event_type == "Query"),
+            (replicant.EventFilter(server_ids=[2]), lambda event: False),
+            (replicant.EventFilter(start_pos=200, stop_pos=500),
+             lambda event: 200 <= event.start_pos < 500),
+            (replicant.EventFilter(start_time=events[3].when),
+             lambda event: event.when >= events[3].when),
+            ]:
+            filtered = replicant.binlog.read_events(open(fname),
+                                                    event_filter=event_filter)
+            self.assertEqual([event.start_pos for event in filtered],
+                             [event.start_pos for event in events
+                              if pred(event)])
+
+    def test_batches(self):
+        """
+        Test that batches hold the same information as the events.
+        """
+        fname = os.path.join(_HERE, "data/mysqld-bin.000011.txt")
+        events = list(replicant.binlog.read_events(open(fname)))
+        batches = list(replicant.read_event_batches(
+                replicant.binlog.read_events(open(fname)), 5))
+        self.assertEqual([len(batch) for batch in batches[:-1]],
+                         [5] * (len(batches) - 1))
+        self.assertEqual(sum(len(batch) for batch in batches), len(events))
+        for number, event in enumerate(events):
+            batch, index = batches[number / 5], number % 5
+            self.assertEqual(batch.event_types[index], event.event_type)
+            self.assertEqual(batch.start_positions[index], event.start_pos)
+            self.assertEqual(batch.end_positions[index], event.end_pos)
+            self.assertEqual(batch.server_ids[index], event.server_id)
+            self.assertEqual(batch.timestamps[index], event.when)
+            self.assertEqual(batch.queries[index],
+                             getattr(event, 'query', None))
+
+class TestBinaryBinlogReader(unittest.TestCase):
+    """
+    Unit test for decoding binary log files directly. The binary log
+    files are built in memory using the BinlogWriter above.
+    """
+
+    def _check_events(self, writer):
+        events = list(replicant.read_binary_events(writer.stream()))
+        current_pos = 4
+        for event in events:
+            self.assertEqual(event.start_pos, current_pos)
+            current_pos = event.end_pos
+        self.assertEqual(current_pos, writer.pos)
+        return events
+
+    def test_statement_events(self):
+        """
+        Test that statement-based events are decoded into the same
+        event classes as produced from the mysqlbinlog output.
+        """
+        for version, checksum in [('5.1.41-log', False),
+                                  ('5.6.10-log', True)]:
+            writer = BinlogWriter(version, checksum)
+            writer.event(binlog.USER_VAR_EVENT,
+                         struct.pack('<I', 3) + 'foo' +
+                         struct.pack('<BBII', 0, 2, 8, 8) +
+                         struct.pack('<q', 32) + '\0')
+            writer.event(binlog.INTVAR_EVENT, struct.pack('<BQ', 2, 17))
+            writer.query("INSERT INTO t1 VALUES (NULL)")
+            writer.event(binlog.XID_EVENT, struct.pack('<Q', 4711))
+            writer.event(binlog.ROTATE_EVENT,
+                         struct.pack('<Q', 4) + 'mysqld1-bin.000012')
+            start, uservar, intvar, query, xid, rotate \
+                = self._check_events(writer)
+
+            self.assert_(isinstance(start, replicant.StartEvent))
+            self.assertEqual(start.server_version, version)
+            self.assertEqual(start.event_type, "Start")
+            self.assertEqual((uservar.name, uservar.value), ("@`foo`", 32))
+            self.assertEqual((intvar.name, intvar.value), ("INSERT_ID", 17))
+            self.assertEqual(query.event_type, "Query")
+            self.assertEqual(query.query, "INSERT INTO t1 VALUES (NULL)")
+            self.assertEqual(query.thread_id, 5)
+            self.assertEqual(xid.xid, 4711)
+            self.assertEqual((rotate.next_file, rotate.next_pos),
+                             ("mysqld1-bin.000012", 4))
+
+    def test_lazy(self):
+        """
+        Test that lazily decoded events are equal to eagerly decoded
+        events.
+        """
+        writer = BinlogWriter('5.6.10-log', True)
+        writer.query("INSERT INTO t1 VALUES (NULL)")
+        writer.event(binlog.INTVAR_EVENT, struct.pack('<BQ', 2, 17))
+        writer.event(binlog.XID_EVENT, struct.pack('<Q', 4711))
+        events = replicant.read_binary_events(writer.stream())
+        lazy_events = replicant.read_binary_events(writer.stream(), lazy=True)
+        for event, lazy_event in zip(events, lazy_events):
+            self.assertEqual(type(lazy_event), type(event))
+            self.assertEqual(lazy_event.start_pos, event.start_pos)
+            self.assertEqual(lazy_event.__getstate__(), event.__getstate__())
+
+    def test_lazy_format_change(self):
+        """
+        Test that a lazy event is decoded with the post-header lengths
+        in effect when it was read, even if a later format description
+        event changes them.
+        """
+        writer = BinlogWriter('5.1.41-log')
+        writer.query("INSERT INTO t1 VALUES (1)")
+        lengths = _post_header_lengths()
+        index = binlog.QUERY_EVENT - 1
+        lengths = lengths[:index] + chr(20) + lengths[index + 1:]
+        writer.event(binlog.FORMAT_DESCRIPTION_EVENT,
+                     struct.pack('<H50sIB', 4, '5.1.41-log', writer.when, 19)
+                     + lengths)
+        events = list(replicant.read_binary_events(writer.stream(),
+                                                   lazy=True))
+        self.assertEqual(events[1].query, "INSERT INTO t1 VALUES (1)")
+
+    def test_filter(self):
+        """
+        Test that events not matching the filter are skipped, also
+        when reading a mapped file.
+        """
+        writer = BinlogWriter('5.6.10-log', True)
+        for number in range(10):
+            writer.query("INSERT INTO t1 VALUES (%d)" % number,
+                         thread_id=number)
+            writer.event(binlog.XID_EVENT, struct.pack('<Q', number),
+                         server_id=number % 2 + 1)
+        handle, path = tempfile.mkstemp()
+        os.close(handle)
+        try:
+            writer.write(path)
+            def read(event_filter):
+                return [
+                    replicant.read_binary_events(writer.stream(),
+                                                 event_filter=event_filter),
+                    replicant.read_mapped_events(path,
+                                                 event_filter=event_filter),
+                ]
+
+            event_filter = replicant.EventFilter(event_types=["Xid"],
+                                                 server_ids=[2])
+            for events in read(event_filter):
+                self.assertEqual([event.xid for event in events],
+                                 [1, 3, 5, 7, 9])
+
+            events = list(replicant.read_binary_events(writer.stream()))
+            event_filter = replicant.EventFilter(
+                start_pos=events[3].start_pos, stop_pos=events[7].start_pos)
+            for events in read(event_filter):
+                self.assertEqual([event.event_type for event in events],
+                                 ["Query", "Xid", "Query", "Xid"])
+        finally:
+            os.remove(path)
+
+    def test_row_events(self):
+        """
+        Test that table map and rows events are decoded.
+        """
+        writer = BinlogWriter('5.6.10-log', True)
+        writer.event(binlog.TABLE_MAP_EVENT,
+                     struct.pack('<IHH', 17, 0, 1) +
+                     '\x04test\x00\x02t1\x00\x02\x03\x0f' +
+                     '\x02\x20\x00\x02')
+        writer.event(binlog.WRITE_ROWS_EVENT,
+                     struct.pack('<IHHH', 17, 0, 1, 2) +
+                     '\x02\x03\xfc\x01\x00\x00\x00\x01a')
+        writer.event(binlog.UPDATE_ROWS_EVENT_V1,
+                     struct.pack('<IHH', 17, 0, 1) + '\x01\x01\x01' +
+                     '\xfe\x01\x00\x00\x00\xfe\x02\x00\x00\x00')
+        start, table_map, write_rows, update_rows \
+            = self._check_events(writer)
+        self.assertEqual(table_map.table_id, 17)
+        self.assertEqual((table_map.db, table_map.table), ("test", "t1"))
+        self.assertEqual(table_map.column_types, [3, 15])
+        self.assertEqual(write_rows.event_type, "Write_rows")
+        self.assertEqual(write_rows.width, 2)
+        self.assertEqual(write_rows.rows, '\xfc\x01\x00\x00\x00\x01a')
+        self.assertEqual(update_rows.event_type, "Update_rows")
+        self.assertEqual(update_rows.rows,
+                         '\xfe\x01\x00\x00\x00\xfe\x02\x00\x00\x00')
+
+    def test_unknown_event(self):
+        """
+        Test that events without a decoder are returned as unknown
+        events and do not stop the reader.
+        """
+        writer = BinlogWriter('5.1.41-log')
+        writer.event(binlog.RAND_EVENT, struct.pack('<QQ', 1, 2))
+        writer.event(binlog.XID_EVENT, struct.pack('<Q', 12))
+        start, rand, xid = self._check_events(writer)
+        self.assert_(isinstance(rand, replicant.UnknownEvent))
+        self.assertEqual(rand.event_type, "Rand")
+        self.assertEqual(xid.xid, 12)
+
+    def test_bad_magic(self):
+        "Test that a file that is not a binary log is rejected"
+        self.assertRaises(replicant.UnrecognizedFormatError, list,
+                          replicant.read_binary_events(StringIO("# at 4")))
+
+class TestMappedBinlogReader(unittest.TestCase):
+    """
+    Unit test for reading memory-mapped binary log files.
+    """
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp()
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_zero_copy(self):
+        """
+        Test that the mapped reader gives the same events as the
+        stream reader, but with payloads referring into the mapping.
+        """
+        writer = BinlogWriter('5.6.10-log', True)
+        writer.query("CREATE TABLE t1 (a INT)")
+        writer.event(binlog.XID_EVENT, struct.pack('<Q', 4711))
+        writer.query("INSERT INTO t1 VALUES (1)")
+        writer.write(self.path)
+
+        expected = list(replicant.read_binary_events(writer.stream()))
+        events = list(replicant.read_mapped_events(self.path))
+        self.assertEqual(len(events), len(expected))
+        for event, other in zip(events, expected):
+            self.assertEqual(event.event_type, other.event_type)
+            self.assertEqual((event.start_pos, event.end_pos),
+                             (other.start_pos, other.end_pos))
+        self.assert_(isinstance(events[1].query, buffer))
+        self.assertEqual(str(events[1].query), "CREATE TABLE t1 (a INT)")
+        self.assertEqual(str(events[3].query), "INSERT INTO t1 VALUES (1)")
+        self.assertEqual(events[2].xid, 4711)
+
+    def test_truncated(self):
+        "Test that a partially written event at the end is not read"
+        writer = BinlogWriter('5.1.41-log')
+        writer.query("CREATE TABLE t1 (a INT)")
+        writer.data[-1] = writer.data[-1][:-3]
+        writer.write(self.path)
+        events = list(replicant.read_mapped_events(self.path))
+        self.assertEqual(len(events), 1)
+
+class TestBinlogIndex(unittest.TestCase):
+    """
+    Unit test for the binary log index.
+    """
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp()
+        os.close(handle)
+        self.writer = BinlogWriter('5.1.41-log', when=1278882445)
+        self.queries = {}
+        for number in range(10):
+            self.writer.when += 10
+            query = "INSERT INTO t1 VALUES (%d)" % number
+            self.queries[self.writer.query(query)] = query
+            self.writer.event(binlog.XID_EVENT, struct.pack('<Q', number))
+        self.writer.write(self.path)
+
+    def tearDown(self):
+        os.remove(self.path)
+        if os.path.exists(self.path + '.idx'):
+            os.remove(self.path + '.idx')
+
+    def test_seek(self):
+        "Test seeking by position, time, and XID"
+        index = replicant.BinlogIndex(self.path)
+        self.assertEqual(len(index), 21)
+        for pos, query in self.queries.items():
+            self.assertEqual(index.seek_position(pos), pos)
+            self.assertEqual(index.seek_position(pos + 10), pos)
+            event = index.read_events(pos).next()
+            self.assertEqual(str(event.query), query)
+        name = os.path.basename(self.path)
+        pos = min(self.queries)
+        self.assertEqual(index.seek_position(replicant.Position(name, pos)),
+                         pos)
+        self.assertRaises(ValueError, index.seek_position,
+                          replicant.Position('other-bin.000001', pos))
+        self.assertEqual(index.seek_position(self.writer.pos), None)
+
+        pos = index.seek_datetime(1278882445 + 35)
+        self.assertEqual(self.queries[pos], "INSERT INTO t1 VALUES (3)")
+        self.assertEqual(index.seek_datetime(1278882445 + 200), None)
+
+        event = index.read_events(index.seek_xid(7)).next()
+        self.assertEqual(event.xid, 7)
+        self.assertEqual(index.seek_xid(4711), None)
+
+    def test_update(self):
+        "Test that the index is extended when the binary log grows"
+        index = replicant.BinlogIndex(self.path)
+        self.assertEqual(index.update(), 0)
+        pos = self.writer.query("INSERT INTO t1 VALUES (4711)")
+        self.writer.event(binlog.XID_EVENT, struct.pack('<Q', 4711))
+        self.writer.write(self.path)
+        self.assertEqual(index.update(), 2)
+        self.assertEqual(index.seek_xid(4711), pos + index[-2][1])
+
+        # A new index object should pick up the persisted index
+        index = replicant.BinlogIndex(self.path)
+        self.assertEqual(len(index), 23)
+        self.assertEqual(index.seek_position(pos), pos)
+
+    def test_torn_record(self):
+        "Test that a torn record at the end of the index is cut off"
+        replicant.BinlogIndex(self.path)
+        index_file = open(self.path + '.idx', 'ab')
+        index_file.write('\0' * 7)
+        index_file.close()
+        index = replicant.BinlogIndex(self.path)
+        self.assertEqual(len(index), 21)
+        self.assertEqual(os.path.getsize(self.path + '.idx') % 29, 0)
+        pos = self.writer.query("INSERT INTO t1 VALUES (4711)")
+        self.writer.write(self.path)
+        self.assertEqual(index.update(), 1)
+        index = replicant.BinlogIndex(self.path)
+        self.assertEqual(len(index), 22)
+        self.assertEqual(index[-1][0], pos)
+
+    def test_rebuild(self):
+        "Test that the index is rebuilt if the binary log is replaced"
+        replicant.BinlogIndex(self.path)
+        writer = BinlogWriter('5.1.41-log', when=1278890000)
+        writer.query("INSERT INTO t1 VALUES (1)")
+        writer.write(self.path)
+        index = replicant.BinlogIndex(self.path)
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index.seek_datetime(1278882445), 4)
+
+def _count_queries(events):
+    """Scan function counting the query events and collecting the
+    XIDs."""
+    queries, xids = 0, []
+    for event in events:
+        if isinstance(event, replicant.QueryEvent):
+            queries += 1
+        elif isinstance(event, replicant.XidEvent):
+            xids.append(event.xid)
+    return queries, xids
+
+class TestScanBinlogs(unittest.TestCase):
+    """
+    Unit test for scanning binary log files in parallel.
+    """
+
+    def setUp(self):
+        self.paths = []
+        directory = tempfile.mkdtemp()
+        xid = 0
+        for number in range(1, 4):
+            writer = BinlogWriter('5.1.41-log')
+            for row in range(20):
+                writer.query("INSERT INTO t1 VALUES (%d)" % row)
+                writer.event(binlog.XID_EVENT, struct.pack('<Q', xid))
+                xid += 1
+            path = os.path.join(directory, "mysqld-bin.%06d" % number)
+            writer.write(path)
+            self.paths.append(path)
+        self.directory = directory
+
+    def tearDown(self):
+        for name in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, name))
+        os.rmdir(self.directory)
+
+    def test_files(self):
+        "Test scanning one file per worker"
+        results = replicant.scan_binlogs(reversed(self.paths),
+                                         _count_queries, processes=2)
+        self.assertEqual([pos for pos, result in results],
+                         [replicant.Position("mysqld-bin.%06d" % n, 4)
+                          for n in range(1, 4)])
+        self.assertEqual([result[0] for pos, result in results], [20] * 3)
+        xids = sum([result[1] for pos, result in results], [])
+        self.assertEqual(xids, range(60))
+
+    def test_chunks(self):
+        "Test scanning files split into chunks"
+        results = replicant.scan_binlogs(self.paths, _count_queries,
+                                         processes=3, chunk_size=500)
+        self.assert_(len(results) > 3)
+        self.assertEqual(sorted(pos for pos, result in results),
+                         [pos for pos, result in results])
+        self.assertEqual(sum(result[0] for pos, result in results), 60)
+        xids = sum([result[1] for pos, result in results], [])
+        self.assertEqual(xids, range(60))
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         [os.path.basename(path) for path in self.paths])
+
+    def test_index(self):
+        "Test splitting files into chunks using the binary log index"
+        results = replicant.scan_binlogs(self.paths, _count_queries,
+                                         processes=3, chunk_size=500,
+                                         use_index=True)
+        self.assertEqual(sum(result[0] for pos, result in results), 60)
+        for path in self.paths:
+            self.assert_(os.path.exists(path + '.idx'))
+
+    def test_reducer(self):
+        "Test merging the results of the chunks in position order"
+        def merge(merged, result):
+            return merged[0] + result[0], merged[1] + result[1]
+        queries, xids = replicant.scan_binlogs(self.paths, _count_queries,
+                                               processes=3, chunk_size=500,
+                                               reducer=merge)
+        self.assertEqual(queries, 60)
+        self.assertEqual(xids, range(60))
+
+class _Server(object):
+    "Server stand-in holding what the tailer needs to start mysqlbinlog"
+    host, port = "localhost", 3307
+    sql_user = replicant.User("mysql_replicant")
+
+class _FileTailer(replicant.BinlogTailer):
+    """
+    Tailer reading the mysqlbinlog output in the data directory
+    instead of starting mysqlbinlog.
+    """
+
+    def __init__(self, position):
+        replicant.BinlogTailer.__init__(self, _Server(), position,
+                                        retry_interval=0)
+        self.spawned = []
+
+    def _spawn(self, position):
+        from subprocess import Popen, PIPE
+        self.spawned.append(position)
+        fname = os.path.join(_HERE, "data",
+                             position.file.replace("mysqld1", "mysqld")
+                             + ".txt")
+        if not os.path.exists(fname):
+            self.stop()
+            return Popen(["true"], stdout=PIPE)
+        return Popen(["cat", fname], stdout=PIPE)
+
+class _ShellTailer(replicant.BinlogTailer):
+    """
+    Tailer running a shell command for each mysqlbinlog it would
+    start. The tailer is stopped when the commands run out.
+    """
+
+    def __init__(self, position, commands, max_retries=5):
+        replicant.BinlogTailer.__init__(self, _Server(), position,
+                                        retry_interval=0,
+                                        max_retries=max_retries)
+        self.commands = list(commands)
+        self.spawned = []
+
+    def _spawn(self, position):
+        from subprocess import Popen, PIPE
+        self.spawned.append(position)
+        if not self.commands:
+            self.stop()
+            return Popen(["true"], stdout=PIPE)
+        return Popen(["sh", "-c", self.commands.pop(0)], stdout=PIPE)
+
+class TestBinlogTailer(unittest.TestCase):
+    """
+    Unit test for following a binary log across rotations.
+    """
+
+    def test_rotate(self):
+        "Test that the tailer follows rotations to the next file"
+        tailer = _FileTailer(replicant.Position("mysqld1-bin.000011", 4))
+        events = list(tailer)
+        self.assertEqual(tailer.spawned,
+                         [replicant.Position("mysqld1-bin.000011", 4),
+                          replicant.Position("mysqld1-bin.000012", 4),
+                          replicant.Position("mysqld1-bin.000013", 4)])
+        self.assertEqual(len(events), 21)
+        self.assertEqual(events[9].event_type, "Rotate")
+        self.assertEqual(events[9].next_file, "mysqld1-bin.000012")
+        self.assertEqual(tailer.position,
+                         replicant.Position("mysqld1-bin.000013", 4))
+
+    def test_resume(self):
+        "Test that only events after the position are returned"
+        tailer = _FileTailer(replicant.Position("mysqld1-bin.000012", 299))
+        events = list(tailer)
+        self.assertEqual(events[0].start_pos, 299)
+        self.assertEqual(events[-1].next_file, "mysqld1-bin.000013")
+
+    def test_stop(self):
+        "Test that the tailer can be stopped from a callback"
+        tailer = _FileTailer(replicant.Position("mysqld1-bin.000011", 4))
+        events = []
+        def callback(event):
+            events.append(event)
+            if len(events) == 3:
+                tailer.stop()
+        tailer.run(callback)
+        self.assertEqual(len(events), 3)
+        self.assertEqual(len(tailer.spawned), 1)
+        self.assertEqual(tailer.position.pos, events[-1].end_pos)
+
+class TestBinlogTailerStream(unittest.TestCase):
+    """
+    Unit test for following a binary log that is still being written,
+    using shell commands in place of mysqlbinlog.
+    """
+
+    def setUp(self):
+        fname = os.path.join(_HERE, "data", "mysqld-bin.000012.txt")
+        self.fname = fname
+        self.lines = open(fname).readlines()
+        self.paths = []
+
+    def tearDown(self):
+        for path in self.paths:
+            os.remove(path)
+
+    def _head(self, count):
+        "Write the first lines of the binary log to a file"
+        handle, path = tempfile.mkstemp()
+        os.write(handle, ''.join(self.lines[:count]))
+        os.close(handle)
+        self.paths.append(path)
+        return path
+
+    def test_latency(self):
+        "Test that a commit is returned before the next event is written"
+        # The output ends with the COMMIT line of the XID event, and
+        # mysqlbinlog then waits for the next event.
+        path = self._head(self.lines.index("COMMIT/*!*/;\n") + 1)
+        tailer = _ShellTailer(replicant.Position("mysqld1-bin.000012", 4),
+                              ["cat %s; exec sleep 10" % path])
+        events = []
+        def callback(event):
+            events.append(event)
+            if isinstance(event, replicant.XidEvent):
+                tailer.stop()
+        start = time.time()
+        tailer.run(callback)
+        self.assert_(time.time() - start < 5)
+        self.assertEqual(events[-1].xid, 43)
+        self.assertEqual(tailer.position.pos, 456)
+        self.assertEqual(tailer.resume_position.pos, 456)
+
+    def test_resume_transaction(self):
+        "Test that a lost connection is resumed at a transaction boundary"
+        # The output is cut off inside the transaction that starts at
+        # position 203, after the Intvar event at 271.
+        path = self._head(self.lines.index("# at 299\n") + 1)
+        tailer = _ShellTailer(replicant.Position("mysqld1-bin.000012", 4),
+                              ["cat %s; exit 1" % path, "cat " + self.fname])
+        events = list(tailer)
+        self.assertEqual(tailer.spawned,
+                         [replicant.Position("mysqld1-bin.000012", 4),
+                          replicant.Position("mysqld1-bin.000012", 203),
+                          replicant.Position("mysqld1-bin.000013", 4)])
+        positions = [event.start_pos for event in events]
+        self.assertEqual(positions, sorted(set(positions)))
+        self.assertEqual(len(events), 11)
+
+    def test_retries(self):
+        "Test that the tailer gives up when mysqlbinlog keeps failing"
+        tailer = _ShellTailer(replicant.Position("mysqld1-bin.000012", 4),
+                              ["exit 1"] * 5, max_retries=2)
+        self.assertRaises(replicant.TailerError, list, tailer)
+        self.assertEqual(len(tailer.spawned), 3)
+
 def suite():
     """
     Create a test suite for the binary log reader.
     """
-    return unittest.makeSuite(TestBinlogReader, 'test')
+    return unittest.TestSuite([
+        unittest.makeSuite(TestBinlogReader, 'test'),
+        unittest.makeSuite(TestBinaryBinlogReader, 'test'),
+        unittest.makeSuite(TestMappedBinlogReader, 'test'),
+        unittest.makeSuite(TestBinlogIndex, 'test'),
+        unittest.makeSuite(TestScanBinlogs, 'test'),
+        unittest.makeSuite(TestBinlogTailer, 'test'),
+        unittest.makeSuite(TestBinlogTailerStream, 'test'),
+    ])
 
 if __name__ == '__main__':
     unittest.main(defaultTest='suite')
@@ -78,15 +78,248 @@ class TestConfigFile(unittest.TestCase):
         config.write(os.path.join(here, 'test-new.cnf'))
         lines1 = file(config_file('test.cnf')).readlines()
         lines2 = file(os.path.join(here, 'test-new.cnf')).readlines()
-        lines1 += ["\n", "no-value\n", "with-int-value = 4711\n",
+        lines1 += ["no-value\n", "with-int-value = 4711\n",
                    "with-string-value = Careful with that axe, Eugene!\n"]
-        lines1.sort()
-        lines2.sort()
         self.assertEqual(lines1, lines2)
         os.remove(os.path.join(here, 'test-new.cnf'))
 
+_OPTION_FILE = """\
+# Options for the servers
+!include /etc/mysql/common.cnf
+
+[client]
+port = 3306
+
+[mysqld]
+server_id=1     # Changed by the roles
+log-bin
+datadir = "/var/lib/mysql # 1"
+  ; Indented comment
+user = mysql
+user = root\r
+!includedir /etc/mysql/conf.d/
+[mysqldump]
+quick"""
+
+class TestOptionFile(unittest.TestCase):
+    "Test case for parsing and writing option files"
+
+    def setUp(self):
+        self.config = replicant.ConfigManagerFile.Config()
+        self.config.parse(_OPTION_FILE)
+
+    def testRoundTrip(self):
+        self.assertEqual(self.config.text(), _OPTION_FILE)
+        self.assertEqual(self.config.includes(),
+                         [("include", "/etc/mysql/common.cnf"),
+                          ("includedir", "/etc/mysql/conf.d/")])
+
+    def testGet(self):
+        self.assertEqual(self.config.get('server-id'), '1')
+        self.assertEqual(self.config.get('log_bin'), None)
+        self.assertEqual(self.config.get('datadir'), '/var/lib/mysql # 1')
+        self.assertEqual(self.config.get('user'), 'root')
+        self.assertRaises(replicant.NoOptionError, self.config.get, 'port')
+        self.assertRaises(replicant.NoOptionError, self.config.get, 'quick')
+
+    def testSet(self):
+        self.config.set('server-id', 1)
+        self.assert_(not self.config.changed)
+        self.config.set('server-id', 2)
+        self.config.set('user', 'mysql')
+        self.config.set('log-slave-updates')
+        self.assert_(self.config.changed)
+        lines = _OPTION_FILE.splitlines(True)
+        lines[7] = "server_id = 2\n"
+        lines[12] = "user = mysql\r\n"
+        lines.insert(14, "log-slave-updates\n")
+        self.assertEqual(self.config.text(), ''.join(lines))
+
+    def testRemove(self):
+        self.config.remove('user')
+        self.config.remove('no-such-option')
+        self.assertRaises(replicant.NoOptionError, self.config.get, 'user')
+        self.assertEqual(self.config.text(),
+                         _OPTION_FILE.replace("user = mysql\n", "")
+                         .replace("user = root\r\n", ""))
+
+    def testNewSection(self):
+        config = replicant.ConfigManagerFile.Config(section='mysqld2')
+        config.parse(_OPTION_FILE)
+        config.set('port', 3308)
+        self.assertEqual(config.text(),
+                         _OPTION_FILE + "\n[mysqld2]\nport = 3308\n")
+        config = replicant.ConfigManagerFile.Config(section='mysqldump')
+        config.parse(_OPTION_FILE)
+        config.set('max_allowed_packet', '16M')
+        self.assertEqual(config.text(),
+                         _OPTION_FILE + "\nmax_allowed_packet = 16M\n")
+
+    def testInlineComment(self):
+        config = replicant.ConfigManagerFile.Config()
+        config.parse("[mysqld]\nskip-networking   # No TCP\n"
+                     "log-bin\t#binary log\n")
+        self.assertEqual(config.get('skip_networking'), None)
+        self.assertEqual(config.get('log-bin'), None)
+        config.set('log-bin', 'master-bin')
+        self.assertEqual(config.text(),
+                         "[mysqld]\nskip-networking   # No TCP\n"
+                         "log-bin = master-bin\n")
+
+    def testParsingError(self):
+        config = replicant.ConfigManagerFile.Config()
+        self.assertRaises(replicant.ConfigParsingError, config.parse,
+                          "user = mysql\n[mysqld]\n")
+
+class _Server(object):
+    "Server stand-in for a server on the local machine"
+
+    def __init__(self, defaults_file):
+        self.name = os.path.basename(defaults_file)
+        self.host = "localhost"
+        self.ssh_user = replicant.User("mysql")
+        self.defaults_file = defaults_file
+        self.config_section = "mysqld1"
+
+    def disconnect(self):
+        pass
+
+class TestConfigManagerFile(unittest.TestCase):
+    "Test case for fetching and replacing configuration files"
+
+    def setUp(self):
+        import shutil
+        self.path = os.path.join(here, 'test-cache.cnf')
+        shutil.copy(config_file('test.cnf'), self.path)
+        # Make the file old enough for the signature to be trusted
+        os.utime(self.path, (1000000000, 1000000000))
+        self.server = _Server(self.path)
+        self.manager = replicant.ConfigManagerFile()
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def testCache(self):
+        "Test that unchanged files are not fetched again"
+        import replicant.configfile
+        config1 = self.manager.fetch_config(self.server)
+        fetch_file = replicant.configfile._fetch_file
+        def _fail(*args):
+            self.fail("file fetched again")
+        replicant.configfile._fetch_file = _fail
+        try:
+            config2 = self.manager.fetch_config(self.server)
+        finally:
+            replicant.configfile._fetch_file = fetch_file
+        self.assert_(config1 is not config2)
+        config1.set('user', 'root')
+        self.assertEqual(config2.get('user'), 'mysql')
+
+        output = file(self.path, 'a')
+        output.write("port = 3307\n")
+        output.close()
+        os.utime(self.path, (1000000001, 1000000001))
+        self.assertEqual(self.manager.fetch_config(self.server).get('port'),
+                         '3307')
+
+    def testChanged(self):
+        "Test that only changed configurations are written"
+        config = self.manager.fetch_config(self.server)
+        config.set('user', 'mysql')
+        config.remove('no-such-option')
+        self.assert_(not config.changed)
+        self.manager.replace_config(self.server, config)
+        self.assertEqual(os.stat(self.path).st_mtime, 1000000000)
+
+        config.set('user', 'root')
+        self.assert_(config.changed)
+        self.manager.replace_config(self.server, config)
+        self.assert_(not config.changed)
+        self.assertNotEqual(os.stat(self.path).st_mtime, 1000000000)
+        self.assertEqual(self.manager.fetch_config(self.server).get('user'),
+                         'root')
+
+class TestUpdateConfig(unittest.TestCase):
+    "Test case for updating the configuration of many servers"
+
+    def setUp(self):
+        self.servers = []
+        for i, extra in enumerate(["", "log-slave-updates\n"] * 2):
+            path = os.path.join(here, 'test-update%d.cnf' % i)
+            output = file(path, 'w')
+            output.write(file(config_file('test.cnf')).read() + extra)
+            output.close()
+            self.servers.append(path)
+        self.servers.append(os.path.join(here, 'no-such-file.cnf'))
+        self.manager = replicant.ConfigManagerFile()
+        self.servers = [replicant.Server(os.path.basename(path),
+                                         replicant.User("user"),
+                                         replicant.User("mysql"), None,
+                                         config_manager=self.manager,
+                                         defaults_file=path,
+                                         config_section="mysqld1")
+                        for path in self.servers]
+
+    def tearDown(self):
+        for server in self.servers[:-1]:
+            os.remove(server.defaults_file)
+
+    def _read(self, server):
+        return file(server.defaults_file).read()
+
+    def testUpdate(self):
+        before = [self._read(server) for server in self.servers[:-1]]
+        update = self.manager.update_config(
+            self.servers, {'log-slave-updates': None}, ['slave-skip-start'],
+            max_workers=2)
+        absent = replicant.ConfigManager.ABSENT
+        self.assertEqual(update.diffs[self.servers[0]],
+                         [('log-slave-updates', absent, None),
+                          ('slave-skip-start', None, absent)])
+        self.assertEqual(update.diffs[self.servers[1]],
+                         [('slave-skip-start', None, absent)])
+        self.assertEqual(update.changed, self.servers[:-1])
+        self.assertEqual(update.errors.keys(), [self.servers[-1]])
+        after = [self._read(server) for server in self.servers[:-1]]
+        self.assertEqual(after[0], after[1])
+        self.assertEqual(after[1], before[1].replace("slave-skip-start\n", ""))
+
+        update = self.manager.update_config(
+            self.servers[:-1], {'log-slave-updates': None})
+        self.assertEqual(update.changed, [])
+        self.assertEqual(update.replaced.results, {})
+
+    def testServerMethods(self):
+        operations = []
+        def hook(server, operation, seconds, error, size):
+            operations.append(operation)
+        replicant.add_hook(hook)
+        try:
+            replicant.ConfigManager().update_config(self.servers[:-1],
+                                                    {'server-id': 5})
+        finally:
+            replicant.remove_hook(hook)
+        self.assertEqual(sorted(operations),
+                         ["fetch_config"] * 4 + ["replace_config"] * 4)
+        self.assertEqual([server.fetch_config().get('server-id')
+                          for server in self.servers[:-1]], ['5'] * 4)
+
+    def testDryRun(self):
+        before = [self._read(server) for server in self.servers[:-1]]
+        update = self.manager.update_config(self.servers[:-1],
+                                            {'server-id': 5}, dry_run=True)
+        self.assertEqual(len(update.changed), 4)
+        self.assertEqual(update.replaced, None)
+        self.assertEqual([self._read(server) for server in self.servers[:-1]],
+                         before)
+
 def suite():
-    return unittest.makeSuite(TestConfigFile, 'test')
+    return unittest.TestSuite([
+        unittest.makeSuite(TestConfigFile, 'test'),
+        unittest.makeSuite(TestOptionFile, 'test'),
+        unittest.makeSuite(TestConfigManagerFile, 'test'),
+        unittest.makeSuite(TestUpdateConfig, 'test'),
+        ])
 
 if __name__ == '__main__':
     unittest.main(defaultTest='suite')
@@ -0,0 +1,139 @@
+# Copyright (c) 2010, Mats Kindahl, Charles Bell, and Lars Thalmann
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials
+#       provided with the distribution.
+#
+#     * Neither the name of Sun Microsystems nor the names of its
+#       contributors may be used to endorse or promote products
+#       derived from this software without specific prior written
+#       permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL SUN
+# MICROSYSTEMS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+import sys, os.path
+here = os.path.dirname(os.path.abspath(__file__))
+rootpath = os.path.split(here)[0]
+sys.path.append(rootpath)
+
+import unittest
+
+import replicant
+
+from fixtures import Rows
+
+class _SlaveServer(object):
+    """Slave stand-in answering the statements used by failover and
+    recording the statements executed."""
+
+    def __init__(self, name, pos, fail=False):
+        self.name = name
+        self.host, self.port = name, 3306
+        self.repl_user = replicant.User("repl_user", "xyzzy")
+        self.pos = pos
+        self.fail = fail
+        self.log_bin = True
+        self.statements = []
+
+    def sql(self, command, args=None, db=''):
+        if self.fail:
+            raise replicant.SlaveNotRunningError
+        statement = command.split()[0:2]
+        self.statements.append(' '.join(statement))
+        if statement == ["SHOW", "SLAVE"]:
+            if "RESET SLAVE" in self.statements:
+                return Rows()
+            return Rows([{"Master_Log_File": "master-bin.000001",
+                           "Read_Master_Log_Pos": self.pos,
+                           "Relay_Master_Log_File": "master-bin.000001",
+                           "Exec_Master_Log_Pos": self.pos}])
+        elif statement == ["SELECT", "MASTER_POS_WAIT(%s,"]:
+            return Rows([{"events": 0}])
+        elif statement == ["SHOW", "MASTER"]:
+            if not self.log_bin:
+                return Rows()
+            return Rows([{"File": self.name + "-bin.000002",
+                           "Position": 106}])
+        elif statement == ["CHANGE", "MASTER"]:
+            self.master = args
+        return Rows()
+
+    def disconnect(self):
+        pass
+
+class TestFailover(unittest.TestCase):
+    "Test case for failover, using stand-ins for the servers"
+
+    def testFailover(self):
+        master = _SlaveServer("master", 0)
+        slaves = [_SlaveServer("slave1", 300), _SlaveServer("slave2", 500),
+                  _SlaveServer("slave3", 500), _SlaveServer("slave4", 0, True)]
+        result = replicant.failover(master, [master] + slaves, timeout=5)
+        self.assert_(result.candidate is slaves[1])
+        self.assertEqual(result.position,
+                         replicant.Position("slave2-bin.000002", 106))
+        self.assertEqual(slaves[1].statements[-3:],
+                         ["STOP SLAVE", "RESET SLAVE", "SHOW MASTER"])
+        self.assertEqual(slaves[2].master[0], "slave2")
+        self.assertEqual(slaves[2].master[-2:], ("slave2-bin.000002", 106))
+        self.assertEqual(result.repointed.results.keys(), [slaves[2]])
+        self.assertEqual(result.lagging, [slaves[0]])
+        self.assertEqual(result.stopped.results.keys(), [slaves[0]])
+        self.assertFalse(hasattr(slaves[0], "master"))
+        self.assertEqual(slaves[0].statements[-1], "STOP SLAVE")
+        self.assertEqual(result.errors.keys(), [slaves[3]])
+        self.assertEqual([phase for phase, seconds in result.timings],
+                         ["collect", "promote", "repoint"])
+        self.assertEqual(master.statements, [])
+
+    def testIneligible(self):
+        master = _SlaveServer("master", 0)
+        slaves = [_SlaveServer("slave1", 300), _SlaveServer("slave2", 500),
+                  _SlaveServer("slave3", 500), _SlaveServer("slave4", 200)]
+        slaves[1].log_bin = False
+        del slaves[2].repl_user
+        result = replicant.failover(master, slaves, timeout=5)
+        self.assert_(result.candidate is slaves[0])
+        self.assertEqual(set(result.ineligible), set(slaves[1:3]))
+        self.assertEqual(set(result.lagging), set(slaves[1:]))
+        for slave in slaves[1:]:
+            self.assertEqual(slave.statements[-1], "STOP SLAVE")
+            self.assert_("RESET SLAVE" not in slave.statements)
+        self.assertEqual(result.errors, {})
+
+    def testNoCandidate(self):
+        master = _SlaveServer("master", 0)
+        slaves = [_SlaveServer("slave1", 300), _SlaveServer("slave2", 500)]
+        for slave in slaves:
+            slave.log_bin = False
+        self.assertRaises(replicant.NotMasterError, replicant.failover,
+                          master, slaves, timeout=5)
+        for slave in slaves:
+            self.assert_("STOP SLAVE" not in slave.statements)
+            self.assert_("RESET SLAVE" not in slave.statements)
+
+def suite():
+    return unittest.makeSuite(TestFailover, 'test')
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
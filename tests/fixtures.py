@@ -0,0 +1,116 @@
+# Copyright (c) 2010, Mats Kindahl, Charles Bell, and Lars Thalmann
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials
+#       provided with the distribution.
+#
+#     * Neither the name of Sun Microsystems nor the names of its
+#       contributors may be used to endorse or promote products
+#       derived from this software without specific prior written
+#       permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL SUN
+# MICROSYSTEMS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+"""Stand-ins for the connections, cursors, and results of servers,
+shared by the tests that do not need a live deployment."""
+
+import sys, os.path
+here = os.path.dirname(os.path.abspath(__file__))
+rootpath = os.path.split(here)[0]
+sys.path.append(rootpath)
+
+import replicant
+
+class Rows(list):
+    "Result stand-in where string keys index the first row"
+
+    def __getitem__(self, key):
+        if isinstance(key, basestring):
+            if not self:
+                raise replicant.EmptyRowError
+            return list.__getitem__(self, 0)[key]
+        return list.__getitem__(self, key)
+
+class Machine(object):
+    "Machine stand-in for servers that are given no defaults file"
+    defaults_file = None
+
+class Cursor(object):
+    """Cursor stand-in returning its rows one at a time. By default it
+    records the statements in the connection and returns no rows."""
+
+    def __init__(self, conn=None, rows=()):
+        self.conn = conn
+        self.rows = list(rows)
+
+    def execute(self, command, args=None):
+        self.conn.statements.append(command)
+
+    def fetchone(self):
+        if self.rows:
+            return self.rows.pop(0)
+        return None
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def close(self):
+        self.rows = []
+
+class Connection(object):
+    """Connection stand-in executing statements without a server. It
+    counts pings and rollbacks, records if it is closed, and creates
+    cursors of cursor_class."""
+
+    cursor_class = Cursor
+
+    def __init__(self, alive=True):
+        self.alive = alive
+        self.pings = 0
+        self.rollbacks = 0
+        self.closed = False
+        self.statements = []
+
+    def cursor(self, cursorclass=None):
+        return self.cursor_class(self)
+
+    def select_db(self, db):
+        self.statements.append("USE " + db)
+
+    def literal(self, args):
+        # Like mysqlclient, a sequence gives a single string
+        if isinstance(args, (tuple, list)):
+            return "(" + ",".join(self.literal(arg) for arg in args) + ")"
+        return "'%s'" % (args)
+
+    def ping(self):
+        self.pings += 1
+        if not self.alive:
+            raise IOError("server has gone away")
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
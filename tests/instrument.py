@@ -0,0 +1,147 @@
+# Copyright (c) 2010, Mats Kindahl, Charles Bell, and Lars Thalmann
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials
+#       provided with the distribution.
+#
+#     * Neither the name of Sun Microsystems nor the names of its
+#       contributors may be used to endorse or promote products
+#       derived from this software without specific prior written
+#       permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL SUN
+# MICROSYSTEMS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+import sys, os.path
+here = os.path.dirname(os.path.abspath(__file__))
+rootpath = os.path.split(here)[0]
+sys.path.append(rootpath)
+
+import logging
+import unittest
+
+import replicant
+from replicant.instrument import instrumented
+
+class _Server(object):
+    "Server stand-in with instrumented operations"
+
+    def __init__(self, name):
+        self.name = name
+
+    @instrumented("echo", lambda result, text: len(text))
+    def echo(self, text):
+        return text
+
+    @instrumented("fail")
+    def fail(self):
+        raise replicant.NotMasterError
+
+class TestInstrument(unittest.TestCase):
+    "Test case for the instrumentation hooks and metrics"
+
+    def setUp(self):
+        self.calls = []
+        self.metrics = replicant.Metrics()
+
+    def tearDown(self):
+        try:
+            replicant.remove_hook(self.metrics.record)
+        except ValueError:
+            pass                # Not added by the test
+
+    def _hook(self, *args):
+        self.calls.append(args)
+
+    def testHooks(self):
+        server = _Server("server1")
+        self.assertEqual(server.echo("no hooks"), "no hooks")
+        replicant.add_hook(self._hook)
+        try:
+            server.echo("hello")
+            self.assertRaises(replicant.NotMasterError, server.fail)
+        finally:
+            replicant.remove_hook(self._hook)
+        server.echo("removed")
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(self.calls[0][0:2], (server, "echo"))
+        self.assertEqual(self.calls[0][3:], (None, 5))
+        self.assert_(isinstance(self.calls[1][3], replicant.NotMasterError))
+        self.assertEqual(_Server.echo.__name__, "echo")
+
+    def testFailingHook(self):
+        def broken(*args):
+            raise RuntimeError("broken hook")
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logger = logging.getLogger("replicant.instrument")
+        logger.addHandler(handler)
+        logger.propagate = False
+        replicant.add_hook(broken)
+        replicant.add_hook(self._hook)
+        try:
+            server = _Server("server1")
+            self.assertEqual(server.echo("hello"), "hello")
+            self.assertRaises(replicant.NotMasterError, server.fail)
+        finally:
+            replicant.remove_hook(broken)
+            replicant.remove_hook(self._hook)
+            logger.removeHandler(handler)
+            logger.propagate = True
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(len(records), 2)
+        self.assert_(records[0].exc_info[0] is RuntimeError)
+
+    def testMetrics(self):
+        server1, server2 = _Server("server1"), _Server("server2")
+        replicant.add_hook(self.metrics.record)
+        for i in range(10):
+            server1.echo("x" * i)
+        server2.echo("text")
+        for i in range(3):
+            self.assertRaises(replicant.NotMasterError, server2.fail)
+        stats = self.metrics.stats()
+        self.assertEqual([(s.server, s.operation) for s in stats],
+                         [("server1", "echo"), ("server2", "echo"),
+                          ("server2", "fail")])
+        self.assertEqual((stats[0].count, stats[0].bytes), (10, 45))
+        self.assertEqual(self.metrics.stats(operation="fail")[0].error_rate,
+                         1.0)
+        self.assertEqual(len(self.metrics.stats(server=server2)), 2)
+        self.assert_(stats[0].percentile(50) <= stats[0].percentile(99))
+        self.metrics.reset()
+        self.assertEqual(self.metrics.stats(), [])
+
+    def testPercentile(self):
+        stats = replicant.OperationStats("server", "sql")
+        for seconds in [0.00005] * 90 + [0.05] * 10:
+            stats.add(seconds, None, None)
+        self.assertEqual(stats.percentile(50), 0.0001)
+        self.assert_(0.05 <= stats.percentile(99) < 0.1)
+        self.assertEqual(stats.max_time, 0.05)
+
+def suite():
+    return unittest.makeSuite(TestInstrument, 'test')
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,193 @@
+# Copyright (c) 2010, Mats Kindahl, Charles Bell, and Lars Thalmann
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials
+#       provided with the distribution.
+#
+#     * Neither the name of Sun Microsystems nor the names of its
+#       contributors may be used to endorse or promote products
+#       derived from this software without specific prior written
+#       permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL SUN
+# MICROSYSTEMS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+import sys, os.path
+here = os.path.dirname(os.path.abspath(__file__))
+rootpath = os.path.split(here)[0]
+sys.path.append(rootpath)
+
+import threading
+import time
+import unittest
+
+import replicant
+
+from fixtures import Connection, Cursor, Machine
+
+class _Server(object):
+    "Server stand-in that records calls to disconnect"
+
+    def __init__(self, name, delay=0):
+        self.name = name
+        self.delay = delay
+        self.disconnects = 0
+
+    def disconnect(self):
+        self.disconnects += 1
+
+class _Cursor(Cursor):
+    "Cursor stand-in returning the statement as the only row"
+
+    def execute(self, command, args=None):
+        self.rows = [{"value": command}]
+
+class _Connection(Connection):
+    cursor_class = _Cursor
+
+class _AsyncServer(replicant.Server):
+    "Server executing statements on stand-ins and commands locally"
+
+    def _new_connection(self):
+        return _Connection()
+
+    def _ssh_process(self, command, stdout=None, stderr=None, group=False):
+        from subprocess import Popen, PIPE, STDOUT
+        return Popen(command, stdout=PIPE, stderr=STDOUT)
+
+def _slow_name(server):
+    if server.delay < 0:
+        raise replicant.NotSlaveError
+    time.sleep(server.delay)
+    return server.name
+
+class TestExecutor(unittest.TestCase):
+    "Test case for the executor and futures"
+
+    def testResult(self):
+        executor = replicant.Executor(2)
+        future = executor.submit(lambda x, y: x + y, 1, y=2)
+        self.assertEqual(future.result(1), 3)
+        self.assert_(future.done())
+        future = executor.submit(int, 'not a number')
+        self.assertRaises(ValueError, future.result)
+        self.assert_(isinstance(future.exception(), ValueError))
+        executor.shutdown()
+
+    def testCancel(self):
+        executor = replicant.Executor(1)
+        event = threading.Event()
+        first = executor.submit(event.wait)
+        second = executor.submit(int, '1')
+        self.assertRaises(replicant.TimeoutError, first.result, 0.01)
+        self.assert_(second.cancel())
+        self.assert_(second.cancelled())
+        event.set()
+        self.assertEqual(first.result(1), True)
+        self.assert_(not first.cancel())
+        executor.shutdown()
+
+    def testCallback(self):
+        executor = replicant.Executor(1)
+        called = []
+        future = executor.submit(int, '1')
+        future.wait()
+        future.add_done_callback(called.append)
+        self.assertEqual(called, [future])
+        executor.shutdown()
+
+    def testAsCompleted(self):
+        executor = replicant.Executor(3)
+        futures = [executor.submit(time.sleep, delay)
+                   for delay in (0.2, 0.0, 0.1)]
+        order = list(replicant.as_completed(futures, 5))
+        self.assertEqual(order, [futures[1], futures[2], futures[0]])
+        event = threading.Event()
+        futures = [executor.submit(event.wait), executor.submit(int, '1')]
+        completed = replicant.as_completed(futures, 0.05)
+        self.assert_(completed.next() is futures[1])
+        self.assertRaises(replicant.TimeoutError, completed.next)
+        event.set()
+        executor.shutdown()
+
+class TestAsync(unittest.TestCase):
+    "Test case for the asynchronous server operations"
+
+    def setUp(self):
+        self.server = _AsyncServer("async", replicant.User("user"),
+                                   replicant.User("user"), Machine())
+
+    def testSqlAsync(self):
+        futures = [self.server.sql_async("SELECT %d" % i) for i in range(20)]
+        rows = [future.result(5) for future in futures]
+        self.assertEqual([row["value"] for row in rows],
+                         ["SELECT %d" % i for i in range(20)])
+        pool = self.server.pool
+        self.assertEqual(pool.idle, pool.size)
+
+    def testSshAsync(self):
+        # The output of each command is larger than a pipe buffer, and
+        # there are more commands than executor threads.
+        futures = [self.server.ssh_async(["seq", "20000"])
+                   for i in range(100)]
+        for future in replicant.as_completed(futures, 30):
+            lines = future.result()
+            self.assertEqual(len(lines), 20001)
+            self.assertEqual(lines[-2], "20000")
+
+class TestDeployment(unittest.TestCase):
+    "Test case for running operations on several servers"
+
+    def testConcurrent(self):
+        servers = [_Server("server%d" % i, 0.1) for i in range(20)]
+        start = time.time()
+        results = replicant.run_on_servers(servers, _slow_name)
+        self.assert_(time.time() - start < 1.0)
+        self.assert_(results.ok)
+        self.assertEqual([r for s, r in results.items()],
+                         [s.name for s in servers])
+        self.assertEqual([s.disconnects for s in servers], [1] * 20)
+
+    def testErrors(self):
+        servers = [_Server("fast"), _Server("slow", 2), _Server("bad", -1)]
+        deployment = replicant.Deployment(servers, timeout=0.1)
+        start = time.time()
+        results = deployment.run(_slow_name)
+        self.assert_(time.time() - start < 1.0)
+        self.assert_(not results.ok)
+        self.assertEqual(results[servers[0]], "fast")
+        self.assertRaises(replicant.TimeoutError,
+                          results.__getitem__, servers[1])
+        self.assertRaises(replicant.NotSlaveError,
+                          results.__getitem__, servers[2])
+        self.assertRaises(replicant.TimeoutError, results.raise_errors)
+        deployment.close()
+
+def suite():
+    return unittest.TestSuite([
+        unittest.makeSuite(TestExecutor, 'test'),
+        unittest.makeSuite(TestAsync, 'test'),
+        unittest.makeSuite(TestDeployment, 'test'),
+        ])
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,220 @@
+# Copyright (c) 2010, Mats Kindahl, Charles Bell, and Lars Thalmann
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials
+#       provided with the distribution.
+#
+#     * Neither the name of Sun Microsystems nor the names of its
+#       contributors may be used to endorse or promote products
+#       derived from this software without specific prior written
+#       permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL SUN
+# MICROSYSTEMS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+import sys, os.path
+here = os.path.dirname(os.path.abspath(__file__))
+rootpath = os.path.split(here)[0]
+sys.path.append(rootpath)
+
+import threading
+import time
+import unittest
+
+import replicant
+
+from fixtures import Connection, Machine
+
+class _PoolServer(replicant.Server):
+    def _new_connection(self):
+        conn = Connection()
+        self.connections.append(conn)
+        return conn
+
+class TestConnectionPool(unittest.TestCase):
+    """
+    Unit test for the connection pool, using connection stand-ins.
+    """
+
+    def setUp(self):
+        self.connections = []
+
+    def connect(self):
+        conn = Connection()
+        self.connections.append(conn)
+        return conn
+
+    def test_reuse(self):
+        "Test that released connections are reused"
+        pool = replicant.ConnectionPool(self.connect, max_size=2)
+        conn1 = pool.checkout()
+        pool.release(conn1)
+        conn2 = pool.checkout()
+        self.assert_(conn1 is conn2)
+        self.assertEqual(len(self.connections), 1)
+        self.assertEqual(conn1.pings, 1)
+        conn3 = pool.checkout()
+        self.assert_(conn3 is not conn2)
+        self.assertEqual(pool.size, 2)
+
+    def test_dead_connection(self):
+        "Test that a connection failing the ping is replaced"
+        pool = replicant.ConnectionPool(self.connect)
+        conn = pool.checkout()
+        conn.alive = False
+        pool.release(conn)
+        new_conn = pool.checkout()
+        self.assert_(new_conn is not conn)
+        self.assert_(conn.closed)
+        self.assertEqual(pool.size, 1)
+
+    def test_exhausted(self):
+        "Test that checkout waits when the pool is full"
+        pool = replicant.ConnectionPool(self.connect, max_size=1)
+        conn = pool.checkout()
+        self.assertRaises(replicant.PoolExhaustedError, pool.checkout,
+                          timeout=0.05)
+        timer = threading.Timer(0.05, pool.release, [conn])
+        timer.start()
+        self.assert_(pool.checkout(timeout=5) is conn)
+        timer.join()
+        pool.discard(conn)
+        self.assertEqual(pool.size, 0)
+        self.assert_(pool.checkout(timeout=0) is not conn)
+
+    def test_idle_eviction(self):
+        "Test that connections idle too long are closed"
+        pool = replicant.ConnectionPool(self.connect, min_size=1,
+                                        idle_timeout=0.01)
+        conns = [pool.checkout() for i in range(3)]
+        for conn in conns:
+            pool.release(conn)
+        time.sleep(0.02)
+        conn = pool.checkout()
+        self.assertEqual(pool.size, 1)
+        self.assert_(conn is conns[-1])
+        self.assertEqual([c.closed for c in conns], [True, True, False])
+
+    def test_threads(self):
+        "Test that threads never share a connection"
+        pool = replicant.ConnectionPool(self.connect, max_size=3)
+        in_use, errors = set(), []
+        lock = threading.Lock()
+        def worker():
+            for i in range(50):
+                conn = pool.checkout()
+                with lock:
+                    if conn in in_use:
+                        errors.append(conn)
+                    in_use.add(conn)
+                time.sleep(0.0001)
+                with lock:
+                    in_use.remove(conn)
+                pool.release(conn)
+        threads = [threading.Thread(target=worker) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assert_(len(self.connections) <= 3)
+
+    def test_lease(self):
+        "Test that a lease dropped by an ending thread is discarded"
+        pool = replicant.ConnectionPool(self.connect, max_size=1)
+        local = threading.local()
+        def worker():
+            local.lease = replicant.Lease(pool, pool.checkout())
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+        conn = pool.checkout(timeout=5)
+        self.assert_(self.connections[0].closed)
+        self.assert_(conn is not self.connections[0])
+        lease = replicant.Lease(pool, conn)
+        self.assert_(lease.take() is conn)
+        del lease
+        self.assertEqual(pool.size, 1)
+
+class TestServerConnections(unittest.TestCase):
+    """
+    Unit test for how a server hands out and takes back the
+    connections of its pool, using connection stand-ins.
+    """
+
+    def setUp(self):
+        _PoolServer.connections = []
+        self.server = _PoolServer("pool", replicant.User("user"),
+                                  replicant.User("user"), Machine(),
+                                  max_connections=2, pool_timeout=5)
+
+    def test_release(self):
+        "Test that the transaction is rolled back when disconnecting"
+        self.server.sql("SELECT 1")
+        self.server.disconnect()
+        conn = self.server.connections[0]
+        self.assertEqual(conn.rollbacks, 1)
+        self.assertFalse(conn.closed)
+        self.assertEqual(self.server.pool.idle, 1)
+
+    def test_session(self):
+        "Test that connections with a changed session are closed"
+        for command, db in [("SET SQL_LOG_BIN = 0", ''),
+                            ("SELECT 1", 'test'),
+                            ("FLUSH TABLES WITH READ LOCK", '')]:
+            self.server.sql(command, db=db)
+            self.server.disconnect()
+            self.assert_(self.server.connections[-1].closed)
+            self.assertEqual(self.server.pool.size, 0)
+        rows = self.server.sql("SELECT 1", db='test', stream=True)
+        self.assertEqual(list(rows), [])
+        self.assert_(self.server.connections[-1].closed)
+        self.assertEqual(self.server.pool.size, 0)
+
+    def test_thread_exit(self):
+        "Test that threads ending without disconnecting do not leak"
+        def worker():
+            self.server.sql("SELECT 1")
+        for i in range(5):
+            thread = threading.Thread(target=worker)
+            thread.start()
+            thread.join()
+        self.server.sql("SELECT 2")
+        # The data of a thread is cleared just after join() returns
+        deadline = time.time() + 5
+        while self.server.pool.size > 1 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.server.pool.size, 1)
+        self.assertEqual([conn.closed for conn in self.server.connections],
+                         [True] * 5 + [False])
+
+def suite():
+    """
+    Create a test suite for the connection pool.
+    """
+    return unittest.TestSuite([
+        unittest.makeSuite(TestConnectionPool, 'test'),
+        unittest.makeSuite(TestServerConnections, 'test'),
+        ])
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,144 @@
+# Copyright (c) 2010, Mats Kindahl, Charles Bell, and Lars Thalmann
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials
+#       provided with the distribution.
+#
+#     * Neither the name of Sun Microsystems nor the names of its
+#       contributors may be used to endorse or promote products
+#       derived from this software without specific prior written
+#       permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL SUN
+# MICROSYSTEMS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+import sys, os.path
+here = os.path.dirname(os.path.abspath(__file__))
+rootpath = os.path.split(here)[0]
+sys.path.append(rootpath)
+
+import re
+import threading
+import time
+import unittest
+
+import replicant
+
+class _RelayServer(object):
+    """Server stand-in holding tables with their engines, which records
+    the statements executed in each thread."""
+
+    def __init__(self, tables):
+        self.name = "relay"
+        self.tables = tables            # (db, table) -> (size, engine)
+        self.lock = threading.Lock()
+        self.log_bin = {}               # Thread -> SQL_LOG_BIN
+        self.altered = []               # (table, SQL_LOG_BIN)
+        self.batches = []
+
+    def sql(self, command, args=None, db='', stream=False, tuples=False):
+        thread = threading.current_thread()
+        if command.startswith("SET SQL_LOG_BIN"):
+            self.log_bin[thread] = int(command.split()[-1])
+            return []
+        assert stream and tuples, "the tables should be streamed"
+        rows = [(db, table, size) for (db, table), (size, engine)
+                in self.tables.items() if engine != 'BLACKHOLE']
+        return sorted(rows, key=lambda row: row[2], reverse=True)
+
+    def sql_batch(self, statements):
+        thread = threading.current_thread()
+        batch = replicant.Server.Batch()
+        with self.lock:
+            self.batches.append(len(statements))
+        for statement in statements:
+            m = re.match(r"ALTER TABLE `(\w+)`.`(\w+)` ENGINE=BLACKHOLE",
+                         statement)
+            key = m.groups()
+            outcome = replicant.Server.Outcome(statement)
+            if key == ('db', 'broken'):
+                outcome.error = replicant.Error("broken table")
+            else:
+                with self.lock:
+                    self.altered.append((key, self.log_bin.get(thread)))
+                    self.tables[key] = (self.tables[key][0], 'BLACKHOLE')
+                outcome.executed = True
+            batch.append(outcome)
+        time.sleep(0.001)
+        return batch
+
+    def disconnect(self):
+        with self.lock:
+            self.log_bin.pop(threading.current_thread(), None)
+
+class TestRelayConversion(unittest.TestCase):
+    """Test case for converting the tables of a relay, using a stand-in
+    for the server."""
+
+    def setUp(self):
+        self.tables = {}
+        for i in range(250):
+            self.tables[('db', 't%03d' % i)] = (i * 10000, 'InnoDB')
+        self.tables[('db', 'done')] = (10 ** 9, 'BLACKHOLE')
+        self.server = _RelayServer(self.tables)
+        self.progress = []
+
+    def _progress(self, server, done, total):
+        self.progress.append((done, total))
+
+    def testConvert(self):
+        relay = replicant.Relay(None, workers=3, progress=self._progress,
+                                small_table=2000000, batch_size=20)
+        relay._convert_tables(self.server)
+        self.assertEqual(len(self.server.altered), 250)
+        self.assert_(('db', 'done') not in
+                     [key for key, log_bin in self.server.altered])
+        self.assertEqual(set(log_bin for key, log_bin in self.server.altered),
+                         set([0]))
+        # Tables of 2000000 bytes or more one at a time, then batches
+        self.assertEqual(sorted(self.server.batches), [1] * 50 + [20] * 10)
+        self.assertEqual(sorted(self.progress)[-1], (250, 250))
+        self.assertEqual(self.server.log_bin, {})
+
+    def testOrder(self):
+        # With several workers the tables are altered in any order, so
+        # the order is checked with a single worker.
+        relay = replicant.Relay(None, workers=1, small_table=0)
+        relay._convert_tables(self.server)
+        self.assertEqual([key for key, log_bin in self.server.altered],
+                         [('db', 't%03d' % i) for i in range(249, -1, -1)])
+
+    def testResume(self):
+        self.tables[('db', 'broken')] = (10 ** 8, 'InnoDB')
+        relay = replicant.Relay(None, workers=1, small_table=0)
+        self.assertRaises(replicant.Error, relay._convert_tables,
+                          self.server)
+        self.assertEqual(self.server.altered, [])
+        del self.tables[('db', 'broken')]
+        relay._convert_tables(self.server)
+        self.assertEqual(len(self.server.altered), 250)
+
+def suite():
+    return unittest.makeSuite(TestRelayConversion, 'test')
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,226 @@
+# Copyright (c) 2010, Mats Kindahl, Charles Bell, and Lars Thalmann
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials
+#       provided with the distribution.
+#
+#     * Neither the name of Sun Microsystems nor the names of its
+#       contributors may be used to endorse or promote products
+#       derived from this software without specific prior written
+#       permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL SUN
+# MICROSYSTEMS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+import sys, os.path
+here = os.path.dirname(os.path.abspath(__file__))
+rootpath = os.path.split(here)[0]
+sys.path.append(rootpath)
+
+import signal
+import subprocess
+import tempfile
+import time
+import unittest
+
+import replicant
+from replicant import remote
+
+class TestRemote(unittest.TestCase):
+    "Test case for the commands sharing ssh connections"
+
+    def tearDown(self):
+        remote.close_connections()
+
+    def _control_path(self, command):
+        options = [arg for arg in command if arg.startswith("ControlPath=")]
+        self.assertEqual(len(options), 1)
+        return options[0][len("ControlPath="):]
+
+    def testCommands(self):
+        ssh = remote.ssh_command("mysql", "db1", "ls /tmp", ["-qTx"])
+        self.assertEqual(ssh[0], "ssh")
+        self.assertEqual(ssh[-3:], ["-qTx", "mysql@db1", "ls /tmp"])
+        self.assert_("ControlMaster=auto" in ssh)
+        scp = remote.scp_command("mysql@db1:/etc/my.cnf", "/tmp/my.cnf")
+        self.assertEqual(scp[0], "scp")
+        self.assertEqual(scp[-2:], ["mysql@db1:/etc/my.cnf", "/tmp/my.cnf"])
+        self.assertEqual(self._control_path(ssh), self._control_path(scp))
+
+    def testClose(self):
+        path = self._control_path(remote.control_options())
+        directory = os.path.dirname(path)
+        self.assert_(os.path.isdir(directory))
+        remote.close_connections()
+        self.assert_(not os.path.exists(directory))
+        remote.close_connections()
+        self.assertNotEqual(self._control_path(remote.control_options()),
+                            path)
+
+def _start(script, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+           group=False):
+    return subprocess.Popen(["sh", "-c", script],
+                            stdout=stdout, stderr=stderr,
+                            preexec_fn=group and os.setpgrp or None)
+
+class _BackupServer(object):
+    "Server stand-in whose shell commands run a local script"
+
+    name = "server1"
+
+    def __init__(self, datadir, script):
+        self.datadir = datadir
+        self.script = script
+        self.statements = []
+
+    def fetch_config(self):
+        return {'datadir': self.datadir}
+
+    def sql(self, command):
+        self.statements.append(command)
+        return {"File": "master-bin.000001", "Position": 4}
+
+    def ssh_stream(self, command, output):
+        return remote.RemoteProcess(_start(self.script, output,
+                                           subprocess.PIPE))
+
+class TestRemoteProcess(unittest.TestCase):
+    "Test case for reading output of commands as it arrives"
+
+    def testLines(self):
+        process = remote.RemoteProcess(_start("echo one; echo two"))
+        self.assertEqual(list(process), ["one", "two"])
+        self.assertEqual(process.returncode, 0)
+
+    def testChunks(self):
+        process = remote.RemoteProcess(_start("head -c 100000 /dev/zero"))
+        chunks = list(process.chunks(4096))
+        self.assertEqual(sum(len(chunk) for chunk in chunks), 100000)
+        self.assert_(max(len(chunk) for chunk in chunks) <= 4096)
+
+    def testTimeout(self):
+        process = remote.RemoteProcess(_start("echo start; exec sleep 10"),
+                                       0.2)
+        lines = iter(process)
+        self.assertEqual(lines.next(), "start")
+        self.assertRaises(replicant.TimeoutError, lines.next)
+
+    def testCancel(self):
+        process = remote.RemoteProcess(_start("exec sleep 10"))
+        process.cancel()
+        self.assertNotEqual(process.wait(), 0)
+
+    def _alive(self, pid):
+        try:
+            os.kill(pid, 0)
+        except OSError:
+            return False
+        return True
+
+    def testCancelGroup(self):
+        process = remote.RemoteProcess(
+            _start("sleep 10 & echo $!; wait", group=True))
+        child = int(iter(process).next())
+        process.cancel()
+        self.assertEqual(process.wait(), -signal.SIGTERM)
+        deadline = time.time() + 5
+        while self._alive(child) and time.time() < deadline:
+            time.sleep(0.05)
+        self.assert_(not self._alive(child))
+
+    def testCancelKill(self):
+        grace, remote.CANCEL_GRACE = remote.CANCEL_GRACE, 0.2
+        try:
+            process = remote.RemoteProcess(
+                _start("trap '' TERM; echo ready; sleep 10", group=True))
+            self.assertEqual(iter(process).next(), "ready")
+            process.cancel()
+            self.assertEqual(process.wait(), -signal.SIGKILL)
+        finally:
+            remote.CANCEL_GRACE = grace
+
+    def testBackupFailure(self):
+        image = tempfile.NamedTemporaryFile()
+        server = _BackupServer(tempfile.gettempdir(),
+                               "echo broken >&2; exit 2")
+        backup = replicant.PhysicalBackup("file:" + image.name)
+        self.assertRaises(replicant.CommandError,
+                          backup.backup_server, server, ["test"])
+        self.assertEqual(server.statements[-1], "UNLOCK TABLES")
+        server.script = "echo archive"
+        backup.backup_server(server, ["test"])
+        self.assertEqual(open(image.name).read(), "archive\n")
+
+    def testDiscard(self):
+        process = remote.RemoteProcess(_start("yes | head -n 100000"))
+        process.process.communicate = None      # Would buffer the output
+        self.assertEqual(iter(process).next(), "y")
+        self.assertEqual(process.wait(), 0)
+        self.assertEqual(process.wait(), 0)
+
+    def testOutput(self):
+        output = tempfile.TemporaryFile()
+        process = remote.RemoteProcess(
+            _start("echo data; echo error >&2; exit 3", output,
+                   subprocess.PIPE))
+        self.assertEqual(process.wait(), 3)
+        self.assertEqual(process.errors, "error\n")
+        output.seek(0)
+        self.assertEqual(output.read(), "data\n")
+
+class TestServerCommands(unittest.TestCase):
+    "Test case for how servers start shell commands"
+
+    def setUp(self):
+        self.started = []
+        self.popen = subprocess.Popen
+        subprocess.Popen = self._popen
+        self.server = replicant.Server("server1", replicant.User("user"),
+                                       replicant.User("user"), None,
+                                       defaults_file=os.devnull)
+
+    def tearDown(self):
+        subprocess.Popen = self.popen
+
+    def _popen(self, command, **kwargs):
+        self.started.append(kwargs["preexec_fn"])
+        return self.popen(["echo", "ok"], stdout=kwargs["stdout"],
+                          stderr=kwargs["stderr"])
+
+    def testProcessGroup(self):
+        # Commands waited for stay in the foreground process group, so
+        # that sudo can prompt on the terminal, while streamed commands
+        # get a group of their own for cancel().
+        self.assertEqual(self.server.ssh(["ls"]), ["ok", ""])
+        self.assertEqual(self.started, [None])
+        self.assertEqual(list(self.server.ssh_stream(["ls"])), ["ok"])
+        self.assertEqual(self.started, [None, os.setpgrp])
+
+def suite():
+    return unittest.TestSuite([
+        unittest.makeSuite(TestRemote, 'test'),
+        unittest.makeSuite(TestRemoteProcess, 'test'),
+        unittest.makeSuite(TestServerCommands, 'test'),
+        ])
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
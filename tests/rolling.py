@@ -0,0 +1,193 @@
+# Copyright (c) 2010, Mats Kindahl, Charles Bell, and Lars Thalmann
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials
+#       provided with the distribution.
+#
+#     * Neither the name of Sun Microsystems nor the names of its
+#       contributors may be used to endorse or promote products
+#       derived from this software without specific prior written
+#       permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL SUN
+# MICROSYSTEMS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+import sys, os.path
+here = os.path.dirname(os.path.abspath(__file__))
+rootpath = os.path.split(here)[0]
+sys.path.append(rootpath)
+
+import threading
+import time
+import unittest
+
+import replicant
+
+from fixtures import Rows
+
+class _Deployment(object):
+    "Keeps track of which servers are down"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.down = set()
+        self.max_down = 0
+        self.max_down_per_master = 0
+        self.masters_down_with_others = 0
+
+class _Server(object):
+    """Server stand-in for a master or a slave. A slave has executed
+    up to position 100 of its master after the restart, and then
+    catches up with 100 for each poll."""
+
+    def __init__(self, deployment, name, port, master=None, fail=False):
+        self.deployment = deployment
+        self.name = name
+        self.host = "localhost"
+        self.port = port
+        self.master = master
+        self.fail = fail
+        self.fail_start = False
+        self.running = "Yes"
+        self.pos = 0
+
+    def stop(self):
+        deployment = self.deployment
+        with deployment.lock:
+            deployment.down.add(self)
+            deployment.max_down = max(deployment.max_down,
+                                      len(deployment.down))
+            if self.master is None and len(deployment.down) > 1:
+                deployment.masters_down_with_others += 1
+            for master in set(s.master for s in deployment.down):
+                down = len([s for s in deployment.down if s.master is master])
+                if master is not None:
+                    deployment.max_down_per_master = max(
+                        deployment.max_down_per_master, down)
+        time.sleep(0.01)
+        if self.fail:
+            raise IOError("could not stop " + self.name)
+        return self
+
+    def start(self):
+        if self.fail_start:
+            raise IOError("could not start " + self.name)
+        self.pos = 100
+        with self.deployment.lock:
+            self.deployment.down.discard(self)
+        return self
+
+    def sql(self, command, args=None, db=''):
+        if command == "SHOW SLAVE STATUS":
+            if self.master is None:
+                return Rows()
+            self.pos += 100
+            return Rows([{"Master_Host": self.master.host,
+                           "Master_Port": str(self.master.port),
+                           "Relay_Master_Log_File": "master-bin.000001",
+                           "Exec_Master_Log_Pos": self.pos,
+                           "Slave_IO_Running": "Yes",
+                           "Slave_SQL_Running": self.running,
+                           "Seconds_Behind_Master": 0}])
+        if command == "SHOW MASTER STATUS":
+            return Rows([{"File": "master-bin.000001", "Position": 300}])
+        raise ValueError(command)
+
+    def disconnect(self):
+        pass
+
+class TestRollingRestart(unittest.TestCase):
+    "Test case for rolling restarts, using stand-ins for the servers"
+
+    def setUp(self):
+        self.deployment = _Deployment()
+        self.masters = [_Server(self.deployment, "master%d" % i, 3300 + i)
+                        for i in range(2)]
+        self.slaves = [_Server(self.deployment, "slave%d" % i, 3400 + i,
+                               self.masters[i % 2])
+                       for i in range(8)]
+
+    def testLimits(self):
+        result = replicant.rolling_restart(self.masters + self.slaves,
+                                           max_in_flight=3, per_master=2)
+        self.assert_(result.results.ok, result.errors)
+        self.assertEqual(self.deployment.max_down, 3)
+        self.assertEqual(self.deployment.max_down_per_master, 2)
+        self.assertEqual(self.deployment.masters_down_with_others, 0)
+        self.assertEqual([phase for phase, seconds
+                          in result.timings[self.slaves[0]]],
+                         ["stop", "start", "catch_up"])
+        self.assertEqual([phase for phase, seconds
+                          in result.timings[self.masters[0]]],
+                         ["stop", "start"])
+        # Caught up to position 300 of the master
+        self.assertEqual(self.slaves[0].pos, 300)
+
+    def testAction(self):
+        called = []
+        result = replicant.rolling_restart(
+            self.slaves[:2], action=lambda server: called.append(server))
+        # The two slaves have different masters, so they are restarted
+        # at the same time and the action is called in either order.
+        self.assertEqual(sorted(server.name for server in called),
+                         ["slave0", "slave1"])
+        self.assertEqual(result.results.errors, {})
+
+    def testActionError(self):
+        def action(server):
+            raise IOError("no configuration")
+        result = replicant.rolling_restart(self.slaves[:1], action=action)
+        self.assert_(isinstance(result.errors[self.slaves[0]], IOError))
+        self.assertEqual(self.deployment.down, set())
+        self.slaves[0].fail_start = True
+        result = replicant.rolling_restart(self.slaves[:1], action=action)
+        self.assert_(isinstance(result.errors[self.slaves[0]],
+                                replicant.ServerDownError))
+        self.assertEqual(self.deployment.down, set([self.slaves[0]]))
+
+    def testSlaveNotRunning(self):
+        self.slaves[0].running = "No"
+        result = replicant.rolling_restart(self.slaves[:1],
+                                           masters=self.masters)
+        self.assert_(isinstance(result.errors[self.slaves[0]],
+                                replicant.SlaveNotRunningError))
+
+    def testUnknownMaster(self):
+        result = replicant.rolling_restart(self.slaves[:1])
+        self.assert_(result.results.ok)
+        self.assertEqual(self.slaves[0].pos, 200)
+
+    def testStopOnError(self):
+        self.slaves[0].fail = True
+        result = replicant.rolling_restart(self.slaves, max_in_flight=1)
+        self.assertEqual(result.errors.keys(), [self.slaves[0]])
+        self.assertEqual(len(result.skipped), 7)
+        result = replicant.rolling_restart(self.slaves, max_in_flight=1,
+                                           stop_on_error=False)
+        self.assertEqual(len(result.results.results), 7)
+        self.assertEqual(result.skipped, [])
+
+def suite():
+    return unittest.makeSuite(TestRollingRestart, 'test')
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
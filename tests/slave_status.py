@@ -0,0 +1,123 @@
+# Copyright (c) 2010, Mats Kindahl, Charles Bell, and Lars Thalmann
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials
+#       provided with the distribution.
+#
+#     * Neither the name of Sun Microsystems nor the names of its
+#       contributors may be used to endorse or promote products
+#       derived from this software without specific prior written
+#       permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL SUN
+# MICROSYSTEMS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+import sys, os.path
+here = os.path.dirname(os.path.abspath(__file__))
+rootpath = os.path.split(here)[0]
+sys.path.append(rootpath)
+
+import time
+import unittest
+
+import replicant
+
+from fixtures import Rows
+
+class _StatusServer(object):
+    """Server stand-in returning a slave status where Exec_Master_Log_Pos
+    advances by step for each poll."""
+
+    def __init__(self, name, step, start=0):
+        self.name = name
+        self.step = step
+        self.pos = start
+        self.polls = 0
+
+    def sql(self, command, args=None, db=''):
+        self.polls += 1
+        self.pos += self.step
+        return Rows([{"Exec_Master_Log_Pos": self.pos,
+                       "Slave_SQL_Running": "Yes"}])
+
+    def disconnect(self):
+        pass
+
+class TestSlaveStatusWait(unittest.TestCase):
+    """Test case for waiting on the slave status, using stand-ins for
+    the servers."""
+
+    def testWaitUntil(self):
+        server = _StatusServer("slave", 10)
+        value = replicant.slave_status_wait_until(
+            server, "Exec_Master_Log_Pos", lambda pos: pos >= 50,
+            min_interval=0.001)
+        self.assertEqual(value, 50)
+        self.assertEqual(server.polls, 5)
+
+    def testBackoff(self):
+        server = _StatusServer("stalled", 0)
+        start = time.time()
+        self.assertRaises(replicant.TimeoutError,
+                          replicant.slave_status_wait_until,
+                          server, "Exec_Master_Log_Pos", bool,
+                          timeout=0.5, min_interval=0.01)
+        self.assert_(time.time() - start < 1.0)
+        # Polls at 0, 0.01, 0.03, 0.07, 0.15, and 0.31 seconds
+        self.assert_(server.polls <= 7, "%d polls" % server.polls)
+
+    def testWaitFor(self):
+        fast = _StatusServer("fast", 100)
+        slow = _StatusServer("slow", 10)
+        at_pos = lambda pos: pos >= 100
+        conditions = [(slow, "Exec_Master_Log_Pos", at_pos),
+                      (fast, "Exec_Master_Log_Pos", at_pos),
+                      (fast, "Slave_SQL_Running", lambda v: v == "Yes")]
+        satisfied = list(replicant.slave_status_wait_for(
+                conditions, timeout=5, min_interval=0.001))
+        self.assertEqual(len(satisfied), 3)
+        self.assertEqual(satisfied[-1], (slow, "Exec_Master_Log_Pos", 100))
+        self.assertEqual(fast.polls, 1)
+
+    def testTimeout(self):
+        servers = [_StatusServer("slave%d" % i, i) for i in range(3)]
+        conditions = [(server, "Exec_Master_Log_Pos", lambda pos: pos > 0)
+                      for server in servers]
+        waiter = replicant.slave_status_wait_for(conditions, timeout=0.1)
+        self.assertEqual(sorted(waiter.next()[0].name for i in range(2)),
+                         ["slave1", "slave2"])
+        self.assertRaises(replicant.TimeoutError, waiter.next)
+
+    def testDeadline(self):
+        server = _StatusServer("moving", 1)
+        start = time.time()
+        self.assertRaises(replicant.TimeoutError,
+                          replicant.slave_status_wait_until,
+                          server, "Exec_Master_Log_Pos", lambda pos: False,
+                          timeout=0.2, min_interval=0)
+        self.assert_(time.time() - start < 1.0)
+
+def suite():
+    return unittest.makeSuite(TestSlaveStatusWait, 'test')
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,105 @@
+# Copyright (c) 2010, Mats Kindahl, Charles Bell, and Lars Thalmann
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials
+#       provided with the distribution.
+#
+#     * Neither the name of Sun Microsystems nor the names of its
+#       contributors may be used to endorse or promote products
+#       derived from this software without specific prior written
+#       permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL SUN
+# MICROSYSTEMS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+import sys, os.path
+here = os.path.dirname(os.path.abspath(__file__))
+rootpath = os.path.split(here)[0]
+sys.path.append(rootpath)
+
+import unittest
+
+import replicant
+
+from batch import _BatchServer
+from fixtures import Cursor, Machine
+
+class TestServerStream(unittest.TestCase):
+    "Test case for streaming results, using a stand-in for the connection"
+
+    def setUp(self):
+        self.server = _BatchServer("stream", replicant.User("user"),
+                                   replicant.User("user"), Machine())
+
+    def testStream(self):
+        pool = self.server.pool
+        row = self.server.sql("SELECT 1", stream=True)
+        self.assertEqual(pool.size - pool.idle, 1)
+        self.assertEqual(row["value"], "1")
+        self.assertEqual(list(row), [{"value": "1"}])
+        self.assertEqual(pool.size - pool.idle, 0)
+        self.server.sql("SELECT 2")
+        row = self.server.sql("SELECT 3", stream=True)
+        self.assertEqual(pool.size - pool.idle, 2)
+        row.close()
+        self.assertEqual(pool.size - pool.idle, 1)
+        self.assertRaises(StopIteration, row.next)
+
+    def testFirstRow(self):
+        pool = self.server.pool
+        self.assertEqual(self.server.sql("SELECT 1", stream=True)["value"],
+                         "1")
+        self.assertEqual(pool.size - pool.idle, 0)
+        row = self.server.sql("SELECT 2", stream=True)
+        self.assertEqual(str(row), "2")
+        self.assertEqual(pool.size - pool.idle, 0)
+        self.assertEqual(list(row), [{"value": "2"}])
+
+    def testWith(self):
+        pool = self.server.pool
+        with self.server.sql("SELECT 1", stream=True):
+            self.assertEqual(pool.size - pool.idle, 1)
+        self.assertEqual(pool.size - pool.idle, 0)
+        self.assertEqual(pool.idle, 1)
+
+    def testDropped(self):
+        pool = self.server.pool
+        rows = self.server.sql("SELECT 1", stream=True)
+        self.assertEqual(pool.size, 1)
+        del rows
+        self.assertEqual(pool.size, 0)
+
+    def testTupleRows(self):
+        row = replicant.Server.Row(Cursor(rows=[(1,), (2,)]))
+        self.assertEqual(str(row), "1")
+        self.assertEqual(row[0], 1)
+        self.assertEqual(list(row), [(1,), (2,)])
+        row = replicant.Server.Row(Cursor(rows=[(1, 2)]))
+        self.assertRaises(replicant.EmptyRowError, str, row)
+        row = replicant.Server.Row(Cursor(rows=[]))
+        self.assertRaises(replicant.EmptyRowError, str, row)
+
+def suite():
+    return unittest.makeSuite(TestServerStream, 'test')
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')